@@ -0,0 +1,6 @@
+# Read by gunicorn from the working directory: gunicorn src.webhook:app
+
+def post_fork(server, worker):
+    """Start each worker's background threads at boot instead of on its first request."""
+    from src.webhook import start_background_workers
+    start_background_workers()
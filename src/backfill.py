@@ -0,0 +1,154 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from src.config import BACKFILL_OCR_WORKERS, BACKFILL_PARSE_WORKERS, BACKFILL_BATCH_SIZE
+from src.dedup import invoice_index
+from src.ocr import detect_text_batch, VISION_BATCH_SIZE
+from src.ocr_benchmark import IMAGE_EXTENSIONS
+from src.parser import parse_invoice_text
+from src.sheets import store_invoices_data, get_spreadsheet
+
+logger = logging.getLogger(__name__)
+
+class Checkpoint:
+    """Per-image progress of a backfill run, saved atomically to a JSON file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.images = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.images = json.load(f).get("images", {})
+            logger.info(f"Resuming from {path}: {len(self.images)} images already handled")
+
+    def status(self, name):
+        return self.images.get(name, {}).get("status")
+
+    def mark(self, name, status, **info):
+        self.images[name] = dict(info, status=status)
+
+    def save(self):
+        partial_path = self.path + ".part"
+        with open(partial_path, "w", encoding="utf-8") as f:
+            json.dump({"images": self.images}, f, ensure_ascii=False, indent=1)
+        os.replace(partial_path, self.path)
+
+def find_images(folder):
+    return sorted(name for name in os.listdir(folder) if name.lower().endswith(IMAGE_EXTENSIONS))
+
+def run_backfill(folder, paid_status="T", checkpoint_path=None, ocr_workers=BACKFILL_OCR_WORKERS,
+                 parse_workers=BACKFILL_PARSE_WORKERS, batch_size=BACKFILL_BATCH_SIZE, retry_failed=False, limit=None):
+    """OCR, parse and store every image in a folder, resuming from the checkpoint file.
+
+    Images are OCR'd in Vision-sized batches on one thread pool and parsed on
+    a second, bounded one; parsed invoices are written to Sheets batch_size
+    at a time with store_invoices_data. An image is marked "stored" only
+    after its batch was written, so an interrupted run redoes at most one
+    batch (OCR and parse results are served from the cache). Images that
+    failed OCR or parsing are skipped on resume unless retry_failed is set.
+    Invoices already in the ledgers (or earlier in the folder) are marked
+    "duplicate" and not stored again. Returns a summary dict.
+    """
+    checkpoint = Checkpoint(checkpoint_path or os.path.join(folder, ".backfill_checkpoint.json"))
+    pending = [
+        name for name in find_images(folder)
+        if checkpoint.status(name) is None or (retry_failed and checkpoint.status(name) == "failed")
+    ][:limit]
+    logger.info(f"Backfilling {len(pending)} images from {folder}")
+    invoice_index.ensure_loaded(get_spreadsheet())
+    results = queue.Queue()
+    summary = {"images": len(pending), "stored": 0, "failed": 0, "duplicates": 0, "api_calls": 0}
+    start = time.perf_counter()
+
+    def parse(name, text):
+        try:
+            results.put((name, parse_invoice_text(text, paid_status), "parse"))
+        except Exception as e:
+            logger.error(f"Failed to parse {name}: {e}")
+            results.put((name, None, "parse"))
+
+    with ThreadPoolExecutor(max_workers=parse_workers) as parse_pool, \
+            ThreadPoolExecutor(max_workers=ocr_workers) as ocr_pool:
+
+        def ocr(names):
+            try:
+                texts = detect_text_batch([os.path.join(folder, name) for name in names])
+            except Exception as e:
+                logger.error(f"Failed to OCR {names}: {e}")
+                texts = [None] * len(names)
+            for name, text in zip(names, texts):
+                if text:
+                    parse_pool.submit(parse, name, text)
+                else:
+                    results.put((name, None, "ocr"))
+
+        for i in range(0, len(pending), VISION_BATCH_SIZE):
+            ocr_pool.submit(ocr, pending[i:i + VISION_BATCH_SIZE])
+
+        try:
+            _collect(results, len(pending), batch_size, checkpoint, summary, start)
+        except BaseException:
+            # Stop handing out work; everything not yet stored is redone on resume
+            ocr_pool.shutdown(wait=False, cancel_futures=True)
+            parse_pool.shutdown(wait=False, cancel_futures=True)
+            checkpoint.save()
+            raise
+    elapsed = time.perf_counter() - start
+    summary["seconds"] = round(elapsed, 1)
+    summary["invoices_per_minute"] = round(summary["stored"] / elapsed * 60, 1) if elapsed else None
+    return summary
+
+def _collect(results, total, batch_size, checkpoint, summary, start):
+    """Consume OCR/parse results as they finish, storing every batch_size invoices."""
+    batch = []
+    for done in range(1, total + 1):
+        name, parsed_data, stage = results.get()
+        if parsed_data and parsed_data.get("ingredients") is not None:
+            duplicate = invoice_index.claim(parsed_data, f"backfill:{name}")
+            if duplicate:
+                checkpoint.mark(name, "duplicate", **duplicate)
+                summary["duplicates"] += 1
+            else:
+                batch.append((name, parsed_data))
+        else:
+            checkpoint.mark(name, "failed", stage=stage)
+            summary["failed"] += 1
+        if len(batch) >= batch_size or done == total:
+            _flush(batch, checkpoint, summary)
+            batch = []
+            elapsed = time.perf_counter() - start
+            logger.info(
+                f"{done}/{total} images, {summary['stored']} stored, {summary['failed']} failed, "
+                f"{summary['stored'] / elapsed * 60:.1f} invoices/min"
+            )
+
+def _flush(batch, checkpoint, summary):
+    if batch:
+        summary["api_calls"] += store_invoices_data([parsed_data for _, parsed_data in batch])
+        for name, parsed_data in batch:
+            checkpoint.mark(name, "stored", invoice_number=parsed_data.get("invoice_number", ""),
+                            seller=parsed_data.get("seller", ""))
+        summary["stored"] += len(batch)
+    checkpoint.save()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Import a folder of archived invoice images into the sheets.")
+    parser.add_argument("folder", help="Folder of invoice images")
+    parser.add_argument("--paid", choices=["T", "N"], default="T", help="Paid status of the archived invoices")
+    parser.add_argument("--checkpoint", help="Progress file (default: FOLDER/.backfill_checkpoint.json)")
+    parser.add_argument("--ocr-workers", type=int, default=BACKFILL_OCR_WORKERS)
+    parser.add_argument("--parse-workers", type=int, default=BACKFILL_PARSE_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE, help="Invoices per Sheets write")
+    parser.add_argument("--retry-failed", action="store_true", help="Retry images that failed on an earlier run")
+    parser.add_argument("--limit", type=int, help="Process at most this many images")
+    args = parser.parse_args()
+    summary = run_backfill(
+        args.folder, args.paid, args.checkpoint, args.ocr_workers, args.parse_workers,
+        args.batch_size, args.retry_failed, args.limit
+    )
+    print(json.dumps(summary, indent=2))
@@ -0,0 +1,172 @@
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+logger = logging.getLogger(__name__)
+
+CATEGORY_HEADER = ["Data", "Składnik", "Jednostka", "Cena netto (za JM)", "VAT (%)", "Cena brutto (za JM)", "Sprzedawca"]
+
+CATALOG = {
+    "JEDZENIE": ["Kukurydza kolby 2,5kg", "Mąka pszenna typ 450 1kg", "Ser mozzarella 2kg", "Pomidory krojone 2,5kg",
+                 "Filet z kurczaka", "Makaron penne 5kg", "Oliwa z oliwek 1l", "Cebula", "Czosnek", "Ryż basmati 5kg"],
+    "NAPOJE": ["Woda niegazowana 1,5l", "Sok pomarańczowy 1l", "Cola 0,33l", "Herbata czarna 100szt"],
+    "NAPOJE ALKOHOLOWE": ["Piwo jasne 0,5l", "Wino czerwone 0,75l", "Wódka 0,7l"],
+    "CHEMIA": ["Płyn do naczyń 5l", "Ręczniki papierowe", "Worki na śmieci 120l"],
+    "INNE": ["Pudełka na pizzę 32cm", "Serwetki", "Folia spożywcza"]
+}
+UNITS = {"JEDZENIE": "kg", "NAPOJE": "szt", "NAPOJE ALKOHOLOWE": "szt", "CHEMIA": "szt", "INNE": "szt"}
+SELLERS = ["Makro Cash and Carry", "Selgros", "Hurtownia Smak", "Eurocash", "Chemia-Pol"]
+
+def synthetic_invoices(count, items, seed=0):
+    """Generate invoice texts over a shared catalog, with prices drifting between invoices."""
+    rng = random.Random(seed)
+    prices = {name: round(rng.uniform(2, 60), 2) for names in CATALOG.values() for name in names}
+    catalog = [(category, name) for category, names in CATALOG.items() for name in names]
+    from src.fakes import fake_invoice_text
+    start = date.today() - timedelta(days=count)
+    invoices = []
+    for n in range(count):
+        invoice_date = start + timedelta(days=n)
+        lines = []
+        for category, name in rng.sample(catalog, min(items, len(catalog))):
+            if rng.random() < 0.3:
+                prices[name] = round(prices[name] * rng.uniform(0.85, 1.2), 2)
+            vat = 23 if category in ("CHEMIA", "NAPOJE ALKOHOLOWE", "INNE") else 5
+            lines.append({
+                "name": name, "unit": UNITS[category], "net_price_per_unit": prices[name], "vat_percent": vat,
+                "gross_price_per_unit": round(prices[name] * (1 + vat / 100), 2), "category": category
+            })
+        invoices.append(fake_invoice_text(
+            f"FV/{invoice_date.year}/{n + 1:04d}", rng.choice(SELLERS), invoice_date.strftime("%d.%m.%Y"),
+            (invoice_date + timedelta(days=rng.choice([3, 7, 14]))).strftime("%d.%m.%Y"), lines
+        ))
+    return invoices
+
+def install_fakes(args):
+    """Build the fake services and point the app's clients at them. Returns {service: FaultInjector}."""
+    from src import ocr, parser, notifications, sheets, utils
+    from src.fakes import (
+        FaultInjector, FakeVisionClient, FakeOpenAIClient, FakeTwilioClient, FakeSpreadsheet, FakeHttpSession
+    )
+    from src.payments import LEDGER_HEADER
+    injectors = {
+        service: FaultInjector(service, getattr(args, f"{service}_latency"), args.jitter, args.error_rate, args.seed)
+        for service in ("media", "vision", "xai", "sheets", "twilio")
+    }
+    sheet_headers = {category: CATEGORY_HEADER for category in sheets.CATEGORY_SHEETS}
+    sheet_headers.update({"Faktury Niezapłacone": LEDGER_HEADER, "Faktury Zapłacone": LEDGER_HEADER})
+    ocr._client = FakeVisionClient(injectors["vision"])
+    parser.client = FakeOpenAIClient(injectors["xai"])
+    notifications.client = FakeTwilioClient(injectors["twilio"])
+    sheets._spreadsheet = FakeSpreadsheet(injectors["sheets"], sheet_headers)
+    utils._session = FakeHttpSession(injectors["media"])
+    return injectors
+
+def _wait_until_drained(queue, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if not set(queue.depth()) & {"queued", "running"}:
+            return True
+        time.sleep(0.05)
+    return False
+
+def run_benchmark(args):
+    """Drive synthetic invoices through the job queue and the full pipeline against the fakes."""
+    from src import utils
+    from src.fakes import fake_invoice_image
+    from src.jobs import ensure_workers, get_queue, get_stats, reset_stage_stats
+    from src.dispatcher import get_outbox
+    from src.pipeline import process_invoice_job, notify_job_failure
+    injectors = install_fakes(args)
+    invoices = synthetic_invoices(args.invoices, args.items, args.seed)
+    for n, text in enumerate(invoices):
+        utils._session.media[f"https://fake.twilio/media/{n}"] = fake_invoice_image(text)
+    reset_stage_stats()
+    tracemalloc.start()
+    start = time.perf_counter()
+    pool = ensure_workers(process_invoice_job, notify_job_failure)
+    queue = get_queue()
+    for n in range(len(invoices)):
+        queue.enqueue(
+            {"from_number": "whatsapp:+48000000000", "media_urls": [f"https://fake.twilio/media/{n}"], "paid_status": "N"},
+            message_sid=f"bench-{n}"
+        )
+    pool.notify()
+    drained = _wait_until_drained(queue, args.timeout)
+    wall_seconds = time.perf_counter() - start
+    _wait_until_drained(get_outbox(), args.timeout)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = get_stats()
+    calls = {}
+    errors = {}
+    for injector in injectors.values():
+        calls.update(injector.calls)
+        errors.update(injector.errors)
+    return {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "invoices": len(invoices),
+        "completed": stats["counters"].get("completed", 0),
+        "failed": stats["counters"].get("failed", 0),
+        "retries": stats["counters"].get("retries", 0),
+        "timed_out": not drained,
+        "wall_seconds": round(wall_seconds, 3),
+        "invoices_per_minute": round(len(invoices) / wall_seconds * 60, 1) if wall_seconds else None,
+        "stages": {
+            stage: {key: entry[key] for key in ("count", "p50_seconds", "p95_seconds", "max_seconds")}
+            for stage, entry in stats["stages"].items()
+        },
+        "api_calls": dict(sorted(calls.items())),
+        "api_calls_per_invoice": {name: round(count / len(invoices), 2) for name, count in sorted(calls.items())},
+        "injected_errors": dict(sorted(errors.items())),
+        "peak_memory": {
+            "traced_bytes": peak_bytes,
+            # ru_maxrss is in kilobytes on Linux and bytes on macOS
+            "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // (1024 if sys.platform == "darwin" else 1)
+        }
+    }
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Benchmark the invoice pipeline offline against fake services.")
+    parser.add_argument("--invoices", type=int, default=50, help="Number of synthetic invoices")
+    parser.add_argument("--items", type=int, default=12, help="Line items per invoice")
+    parser.add_argument("--media-latency", type=float, default=0.05, help="Seconds per media download")
+    parser.add_argument("--vision-latency", type=float, default=0.4, help="Seconds per Vision request")
+    parser.add_argument("--xai-latency", type=float, default=1.5, help="Seconds per LLM completion")
+    parser.add_argument("--sheets-latency", type=float, default=0.3, help="Seconds per Sheets API call")
+    parser.add_argument("--twilio-latency", type=float, default=0.2, help="Seconds per Twilio message")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform +/- jitter added to every latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls to every service that fail")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=600, help="Give up waiting for the queue after this long")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    # Run in a scratch directory so queue, caches, history and downloaded images start empty
+    sys.path.insert(0, os.getcwd())
+    os.chdir(tempfile.mkdtemp(prefix="invoice-bench-"))
+    os.environ.setdefault("JOB_RETRY_DELAY", "0.1")
+    os.environ.setdefault("NOTIFY_RETRY_DELAY", "0.1")
+    os.environ.setdefault("NOTIFICATION_WHATSAPP_NUMBER", "whatsapp:+48000000001")
+    # Measure the pipeline, not the Sheets quota; set these to benchmark under the real quota
+    os.environ.setdefault("SHEETS_READS_PER_MINUTE", "100000")
+    os.environ.setdefault("SHEETS_WRITES_PER_MINUTE", "100000")
+    for name in ("TWILIO_ACCOUNT_SID", "TWILIO_AUTH_TOKEN", "XAI_API_KEY"):
+        os.environ.setdefault(name, "benchmark")
+    report = run_benchmark(args)
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
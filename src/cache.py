@@ -0,0 +1,113 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from src.config import CACHE_DB_PATH, CACHE_MAX_ENTRIES, CACHE_MAX_AGE
+
+logger = logging.getLogger(__name__)
+
+def content_hash(*parts):
+    """Return the SHA-256 hex digest of the given bytes/str parts."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+class ResultCache:
+    """Persistent SQLite cache of JSON-serializable results keyed by content hash.
+
+    Entries older than max_age seconds are dropped, and once a namespace holds
+    more than max_entries the least recently used entries are evicted.
+    """
+
+    def __init__(self, namespace, db_path=CACHE_DB_PATH, max_entries=CACHE_MAX_ENTRIES, max_age=CACHE_MAX_AGE):
+        self.namespace = namespace
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        # Open lazily and per process: SQLite connections must not cross a fork
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss."""
+        try:
+            with self._lock:
+                conn = self._connection()
+                row = conn.execute(
+                    "SELECT value FROM cache WHERE namespace = ? AND key = ? AND created_at >= ?",
+                    (self.namespace, key, time.time() - self.max_age)
+                ).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                conn.execute(
+                    "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                    (time.time(), self.namespace, key)
+                )
+                self.hits += 1
+            return json.loads(row[0])
+        except Exception as e:
+            logger.warning(f"Cache lookup failed in {self.namespace}: {e}")
+            return None
+
+    def set(self, key, value):
+        """Store a value and evict expired or least recently used entries."""
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._connection()
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (namespace, key, value, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (self.namespace, key, json.dumps(value, ensure_ascii=False), now, now)
+                )
+                conn.execute(
+                    "DELETE FROM cache WHERE namespace = ? AND created_at < ?",
+                    (self.namespace, now - self.max_age)
+                )
+                conn.execute(
+                    "DELETE FROM cache WHERE namespace = ? AND key IN ("
+                    "SELECT key FROM cache WHERE namespace = ? ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.namespace, self.namespace, self.max_entries)
+                )
+        except Exception as e:
+            logger.warning(f"Cache write failed in {self.namespace}: {e}")
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0
+        }
+
+ocr_cache = ResultCache("ocr")
+parse_cache = ResultCache("parse")
+
+def get_cache_stats():
+    """Return hit/miss counters for the OCR and parse caches."""
+    return {"ocr": ocr_cache.stats(), "parse": parse_cache.stats()}
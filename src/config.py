@@ -15,6 +15,114 @@ XAI_API_KEY = os.getenv("XAI_API_KEY")
 # Google Sheets
 SPREADSHEET_ID = "GrLufeQeZMwP9vd3OYA2zhzh50FOiNFePWtP0PbCCXk"
 CREDENTIALS_PATH = "credentials.json"
+SHEETS_TOKEN_REFRESH_INTERVAL = float(os.getenv("SHEETS_TOKEN_REFRESH_INTERVAL", "2700"))
+
+# Google Sheets API quota (per minute, per service account), shared by every
+# process on the host through the SHEETS_QUOTA_PATH file
+SHEETS_READS_PER_MINUTE = int(os.getenv("SHEETS_READS_PER_MINUTE", "60"))
+SHEETS_WRITES_PER_MINUTE = int(os.getenv("SHEETS_WRITES_PER_MINUTE", "60"))
+SHEETS_BURST = int(os.getenv("SHEETS_BURST", "10"))
+SHEETS_QUOTA_PATH = os.getenv("SHEETS_QUOTA_PATH", "sheets_quota")
+SHEETS_MAX_ATTEMPTS = int(os.getenv("SHEETS_MAX_ATTEMPTS", "5"))
+SHEETS_BACKOFF_BASE = float(os.getenv("SHEETS_BACKOFF_BASE", "1"))
+SHEETS_BACKOFF_MAX = float(os.getenv("SHEETS_BACKOFF_MAX", "64"))
+# Identical reads within this many seconds share one API call
+SHEETS_COALESCE_WINDOW = float(os.getenv("SHEETS_COALESCE_WINDOW", "2"))
 
 # Local storage
-INVOICES_DIR = "invoices"
\ No newline at end of file
+INVOICES_DIR = "invoices"
+
+# Media downloads
+MEDIA_MAX_BYTES = int(os.getenv("MEDIA_MAX_BYTES", str(20 * 1024 * 1024)))
+MEDIA_DOWNLOAD_TIMEOUT = float(os.getenv("MEDIA_DOWNLOAD_TIMEOUT", "30"))
+MEDIA_POOL_SIZE = int(os.getenv("MEDIA_POOL_SIZE", "10"))
+
+# Background job queue
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "30"))
+JOB_STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", "600"))
+
+# WhatsApp notification dispatch (outbox table lives in JOBS_DB_PATH)
+NOTIFY_WORKERS = int(os.getenv("NOTIFY_WORKERS", "3"))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "5"))
+NOTIFY_RETRY_DELAY = float(os.getenv("NOTIFY_RETRY_DELAY", "5"))
+# Twilio send rate, shared by every process on the host through the TWILIO_QUOTA_PATH file
+TWILIO_MESSAGES_PER_SECOND = float(os.getenv("TWILIO_MESSAGES_PER_SECOND", "5"))
+TWILIO_QUOTA_PATH = os.getenv("TWILIO_QUOTA_PATH", "twilio_quota.json")
+# Digest mode folds all price changes of an invoice (or all due reminders) into one message
+NOTIFY_DIGEST = os.getenv("NOTIFY_DIGEST", "0") == "1"
+NOTIFY_DIGEST_CONTENT_SID = os.getenv("NOTIFY_DIGEST_CONTENT_SID")
+
+# Prometheus metrics, shared by every process on the host
+METRICS_DB_PATH = os.getenv("METRICS_DB_PATH", "metrics.db")
+# Each process buffers its metric updates and writes them to METRICS_DB_PATH this often
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "1"))
+
+# Email notifications (sent from a background thread over one SMTP session)
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+SMTP_SSL = os.getenv("SMTP_SSL", "1") == "1"
+SMTP_IDLE_TIMEOUT = float(os.getenv("SMTP_IDLE_TIMEOUT", "60"))
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "3"))
+
+# Payment reminders: days before the due date at which a reminder is sent
+REMINDER_THRESHOLDS = [int(days) for days in os.getenv("REMINDER_THRESHOLDS", "3,1,0").split(",")]
+REMINDER_CHECK_INTERVAL = float(os.getenv("REMINDER_CHECK_INTERVAL", "900"))
+REMINDER_REFRESH_INTERVAL = float(os.getenv("REMINDER_REFRESH_INTERVAL", str(6 * 3600)))
+
+# Local SQLite replica of the category sheets and invoice ledgers: the Drive
+# revision is checked at most every REPLICA_CHECK_INTERVAL seconds and a sheet
+# is downloaded again only when it changed (or after REPLICA_MAX_AGE seconds)
+REPLICA_DB_PATH = os.getenv("REPLICA_DB_PATH", "replica.db")
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", "30"))
+REPLICA_MAX_AGE = float(os.getenv("REPLICA_MAX_AGE", "3600"))
+# Lock file serializing the paid/unpaid ledger sync across processes
+SYNC_LOCK_PATH = os.getenv("SYNC_LOCK_PATH", "sync_invoice_status.lock")
+
+# Ingredient price changes: a single invoice moving a price by more than
+# PRICE_CHANGE_THRESHOLD percent is alerted on its own
+PRICE_CHANGE_WORKERS = int(os.getenv("PRICE_CHANGE_WORKERS", "5"))
+PRICE_CHANGE_THRESHOLD = float(os.getenv("PRICE_CHANGE_THRESHOLD", "5"))
+
+# Price history and trend detection
+PRICE_HISTORY_DB_PATH = os.getenv("PRICE_HISTORY_DB_PATH", "price_history.db")
+PRICE_HISTORY_WINDOW = int(os.getenv("PRICE_HISTORY_WINDOW", "10"))
+PRICE_TREND_DAYS = int(os.getenv("PRICE_TREND_DAYS", "90"))
+PRICE_TREND_THRESHOLD = float(os.getenv("PRICE_TREND_THRESHOLD", "10"))
+
+# OCR / parse result cache
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "cache.db")
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "5000"))
+CACHE_MAX_AGE = float(os.getenv("CACHE_MAX_AGE", str(30 * 24 * 3600)))
+
+# OCR: "text" sends the raw Vision text to the parser, "layout" a compact
+# HEADER / ITEMS / TOTALS form rebuilt from word bounding boxes
+OCR_MODE = os.getenv("OCR_MODE", "text")
+
+# OCR image preprocessing (downscale, grayscale, re-encode before upload). Off
+# by default until its effect on Vision accuracy has been measured on real photos
+OCR_PREPROCESS = os.getenv("OCR_PREPROCESS", "0") == "1"
+OCR_MAX_DIMENSION = int(os.getenv("OCR_MAX_DIMENSION", "2000"))
+OCR_JPEG_QUALITY = int(os.getenv("OCR_JPEG_QUALITY", "80"))
+OCR_GRAYSCALE = os.getenv("OCR_GRAYSCALE", "1") == "1"
+OCR_UPLINK_BYTES_PER_SEC = float(os.getenv("OCR_UPLINK_BYTES_PER_SEC", str(1024 * 1024)))
+
+# Seller-specific parsing templates
+SELLER_TEMPLATES_PATH = os.getenv("SELLER_TEMPLATES_PATH", "seller_templates.json")
+
+# Invoice parsing: each ingredient costs roughly 60 output tokens, so invoices
+# with more than PARSE_CHUNK_ITEMS priced lines are split into chunks of at most
+# that many to stay well under PARSE_MAX_TOKENS
+PARSE_MAX_TOKENS = int(os.getenv("PARSE_MAX_TOKENS", "2000"))
+PARSE_CHUNK_ITEMS = int(os.getenv("PARSE_CHUNK_ITEMS", "20"))
+PARSE_CHUNK_WORKERS = int(os.getenv("PARSE_CHUNK_WORKERS", "4"))
+
+# Bulk backfill of archived invoice images
+BACKFILL_OCR_WORKERS = int(os.getenv("BACKFILL_OCR_WORKERS", "4"))
+BACKFILL_PARSE_WORKERS = int(os.getenv("BACKFILL_PARSE_WORKERS", "8"))
+BACKFILL_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", "50"))
+
+# Fuzzy ingredient-name matching
+FUZZY_MATCH_THRESHOLD = float(os.getenv("FUZZY_MATCH_THRESHOLD", "0.85"))
@@ -0,0 +1,159 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from src.config import JOBS_DB_PATH
+from src.fuzzy import normalize_name
+
+logger = logging.getLogger(__name__)
+
+LEDGER_SHEETS = ["Faktury Niezapłacone", "Faktury Zapłacone"]
+
+# Legal-form suffixes that OCR and the LLM include inconsistently
+SELLER_SUFFIX_PATTERN = re.compile(r"\b(sp\.?\s*z\s*o\.?\s*o\.?|sp\.?\s*j\.?|sp\.?\s*k\.?|s\.?\s*a\.?|s\.?\s*c\.?)\s*$")
+
+def normalize_seller(seller):
+    name = normalize_name(str(seller or "")).replace(".", " ")
+    name = SELLER_SUFFIX_PATTERN.sub("", " ".join(name.split()))
+    return " ".join(name.split())
+
+def invoice_dedup_key(seller, invoice_number):
+    """Key an invoice by normalized seller and invoice number, or None without an invoice number."""
+    number = re.sub(r"\s+", "", str(invoice_number or "")).upper()
+    if not number:
+        return None
+    return f"{normalize_seller(seller)}|{number}"
+
+class InvoiceIndex:
+    """SQLite index of ingested invoices, shared by every worker process.
+
+    Invoices are keyed by invoice_dedup_key(); the SHA-256 of each stored
+    image is kept as well, so a re-sent photo is recognised before OCR, even
+    for invoices without a number.
+    Keys already in the ledgers are loaded once per process. A job claims an
+    invoice key when it parses it, so two copies processed at the same time
+    cannot both be stored; the claim is released if the job fails for good.
+    """
+
+    def __init__(self, db_path=JOBS_DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._loaded = False
+
+    def _connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS ingested_invoices (
+                    invoice_key TEXT PRIMARY KEY,
+                    seller TEXT NOT NULL,
+                    invoice_number TEXT NOT NULL,
+                    owner TEXT,
+                    recorded_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS ingested_images (
+                    image_hash TEXT PRIMARY KEY,
+                    invoice_key TEXT NOT NULL
+                )
+            """)
+            self._pid = os.getpid()
+            self._loaded = False
+        return self._conn
+
+    def ensure_loaded(self, spreadsheet):
+        """Add the invoices already in the ledger sheets, once per process, from the local replica."""
+        with self._lock:
+            conn = self._connection()
+            if self._loaded:
+                return
+        from src.replica import sheet_replica
+        rows = []
+        for title in LEDGER_SHEETS:
+            for record in sheet_replica.records(spreadsheet, title):
+                key = invoice_dedup_key(record.get("Sprzedawca"), record.get("Numer Faktury"))
+                if key:
+                    rows.append((key, str(record.get("Sprzedawca", "")), str(record.get("Numer Faktury", "")), time.time()))
+        with self._lock:
+            conn.executemany(
+                "INSERT OR IGNORE INTO ingested_invoices (invoice_key, seller, invoice_number, recorded_at) "
+                "VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._loaded = True
+        logger.info(f"Loaded {len(rows)} ledger invoices into the dedup index")
+
+    def claim(self, invoice_data, owner):
+        """Claim an invoice for owner (e.g. a job id).
+
+        Returns None if it is new (or already claimed by the same owner),
+        otherwise a dict with the seller and invoice number on record.
+        """
+        key = invoice_dedup_key(invoice_data.get("seller"), invoice_data.get("invoice_number"))
+        if key is None:
+            return None
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR IGNORE INTO ingested_invoices (invoice_key, seller, invoice_number, owner, recorded_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, invoice_data.get("seller", ""), invoice_data.get("invoice_number", ""), str(owner), time.time())
+            )
+            row = conn.execute(
+                "SELECT seller, invoice_number, owner FROM ingested_invoices WHERE invoice_key = ?", (key,)
+            ).fetchone()
+        if row[2] == str(owner):
+            return None
+        return {"seller": row[0], "invoice_number": row[1]}
+
+    def release(self, owner):
+        """Drop the claims of an owner whose invoice was never stored."""
+        with self._lock:
+            self._connection().execute("DELETE FROM ingested_invoices WHERE owner = ?", (str(owner),))
+
+    def record_images(self, invoice_data, image_hashes):
+        """Remember the images of a stored invoice so re-sent photos are caught before OCR.
+
+        An invoice without a parsed number is recorded under its first image
+        hash instead, so its photos are still recognised.
+        """
+        if not image_hashes:
+            return
+        key = invoice_dedup_key(invoice_data.get("seller"), invoice_data.get("invoice_number"))
+        with self._lock:
+            conn = self._connection()
+            if key is None:
+                key = f"image:{image_hashes[0]}"
+                conn.execute(
+                    "INSERT OR IGNORE INTO ingested_invoices (invoice_key, seller, invoice_number, recorded_at) "
+                    "VALUES (?, ?, '', ?)",
+                    (key, invoice_data.get("seller", ""), time.time())
+                )
+            conn.executemany(
+                "INSERT OR IGNORE INTO ingested_images (image_hash, invoice_key) VALUES (?, ?)",
+                [(image_hash, key) for image_hash in image_hashes]
+            )
+
+    def find_images(self, image_hashes):
+        """Return the recorded invoice if every image was already stored as part of it, else None."""
+        if not image_hashes:
+            return None
+        with self._lock:
+            conn = self._connection()
+            placeholders = ",".join("?" * len(image_hashes))
+            rows = conn.execute(
+                f"SELECT i.image_hash, v.seller, v.invoice_number FROM ingested_images i "
+                f"JOIN ingested_invoices v ON v.invoice_key = i.invoice_key WHERE i.image_hash IN ({placeholders})",
+                list(image_hashes)
+            ).fetchall()
+        if len({row[0] for row in rows}) < len(set(image_hashes)):
+            return None
+        return {"seller": rows[0][1], "invoice_number": rows[0][2]}
+
+invoice_index = InvoiceIndex()
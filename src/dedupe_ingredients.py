@@ -0,0 +1,76 @@
+import argparse
+import logging
+from datetime import datetime
+from gspread.utils import rowcol_to_a1
+from src.config import FUZZY_MATCH_THRESHOLD
+from src.fuzzy import NameIndex
+from src.sheets import get_spreadsheet, get_worksheet, CATEGORY_SHEETS
+from src.replica import sheet_replica
+from src.sheets_quota import sheets_scheduler
+
+logger = logging.getLogger(__name__)
+
+def _row_date(row):
+    try:
+        return datetime.strptime(str(row[0]), "%d.%m.%Y")
+    except ValueError:
+        return datetime.min
+
+def find_duplicates(rows, threshold=FUZZY_MATCH_THRESHOLD):
+    """Group data rows (without header) by canonical ingredient name.
+
+    The first spelling seen becomes the canonical name. Returns
+    {canonical_name: [row, ...]} in sheet order.
+    """
+    names = NameIndex()
+    groups = {}
+    for row in rows:
+        if len(row) < 2 or not row[1]:
+            continue
+        canonical, _ = names.match(row[1], threshold)
+        if canonical is None:
+            canonical = row[1]
+            names.add(canonical)
+        groups.setdefault(canonical, []).append(row)
+    return groups
+
+def merge_category(worksheet, threshold=FUZZY_MATCH_THRESHOLD, apply=False):
+    """Merge duplicate ingredient rows of one category sheet, keeping the most recent price.
+
+    The merged sheet is written back with a single range update. Returns the
+    number of rows removed.
+    """
+    values = sheets_scheduler.read(worksheet, "get_all_values")
+    if not values:
+        return 0
+    header, rows = values[0], values[1:]
+    groups = find_duplicates(rows, threshold)
+    merged = []
+    for canonical, group in groups.items():
+        latest = max(group, key=_row_date)
+        if len(group) > 1:
+            variants = sorted({row[1] for row in group if row[1] != canonical})
+            logger.info(f"{worksheet.title}: merging {variants} into '{canonical}'")
+        merged.append([latest[0], canonical] + latest[2:])
+    removed = len(rows) - len(merged)
+    if apply and removed:
+        width = len(header)
+        blank_rows = [[""] * width] * removed
+        padded = [row + [""] * (width - len(row)) for row in merged]
+        sheets_scheduler.write(worksheet, "update", range_name=f"A2:{rowcol_to_a1(len(rows) + 1, width)}", values=padded + blank_rows)
+        sheet_replica.invalidate(worksheet.title)
+        logger.info(f"{worksheet.title}: removed {removed} duplicate rows")
+    return removed
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Merge duplicate ingredient rows that differ only in spelling.")
+    parser.add_argument("--category", choices=CATEGORY_SHEETS, action="append", help="Category sheet(s) to clean (default: all)")
+    parser.add_argument("--threshold", type=float, default=FUZZY_MATCH_THRESHOLD, help="Minimum match score")
+    parser.add_argument("--apply", action="store_true", help="Write the merged sheets (default is a dry run)")
+    args = parser.parse_args()
+    spreadsheet = get_spreadsheet()
+    total = 0
+    for category in args.category or CATEGORY_SHEETS:
+        total += merge_category(get_worksheet(spreadsheet, category), args.threshold, args.apply)
+    print(f"{'Removed' if args.apply else 'Would remove'} {total} duplicate rows")
@@ -0,0 +1,84 @@
+import logging
+import os
+import threading
+import time
+from src.config import (
+    JOBS_DB_PATH, NOTIFY_WORKERS, NOTIFY_MAX_ATTEMPTS, NOTIFY_RETRY_DELAY, TWILIO_MESSAGES_PER_SECOND,
+    TWILIO_QUOTA_PATH
+)
+from src.jobs import JobQueue, WorkerPool
+from src.ratelimit import SharedTokenBucket
+
+logger = logging.getLogger(__name__)
+
+_stats_lock = threading.Lock()
+_latency = {"count": 0, "total": 0.0, "max": 0.0}
+
+_outbox = None
+_pool = None
+_pid = None
+_init_lock = threading.Lock()
+
+# Shared by the dispatcher threads of every process on the host
+rate_limiter = SharedTokenBucket(TWILIO_QUOTA_PATH, TWILIO_MESSAGES_PER_SECOND)
+
+def record_delivery(notification):
+    """Record the time from enqueueing a notification to its delivery."""
+    elapsed = time.time() - notification.get("created_at", time.time())
+    with _stats_lock:
+        _latency["count"] += 1
+        _latency["total"] += elapsed
+        _latency["max"] = max(_latency["max"], elapsed)
+
+def get_outbox():
+    """Return the process-wide notification outbox (a table next to the job queue)."""
+    global _outbox, _pid
+    with _init_lock:
+        if _outbox is None or _pid != os.getpid():
+            _outbox = JobQueue(JOBS_DB_PATH, table="outbox")
+            _pid = os.getpid()
+        return _outbox
+
+def ensure_dispatcher(deliver):
+    """Start the dispatcher threads for this process if they are not running yet.
+
+    `deliver(notification)` sends one notification and raises on failure; an
+    exception with retryable=False fails it without retrying.
+    """
+    global _pool
+    outbox = get_outbox()
+    with _init_lock:
+        if _pool is None or _pool.queue is not outbox:
+            def handler(job, checkpoint):
+                rate_limiter.acquire()
+                deliver(job["payload"])
+                record_delivery(job["payload"])
+            _pool = WorkerPool(
+                outbox, handler, num_workers=NOTIFY_WORKERS, max_attempts=NOTIFY_MAX_ATTEMPTS,
+                retry_delay=NOTIFY_RETRY_DELAY, poll_interval=0.5, name="notify-worker"
+            )
+            _pool.start()
+        return _pool
+
+def dispatch(notification, deliver, dedupe_key=None):
+    """Persist a notification in the outbox and wake a dispatcher thread. Returns the outbox id."""
+    notification = dict(notification, created_at=time.time())
+    outbox_id = get_outbox().enqueue(notification, dedupe_key)
+    ensure_dispatcher(deliver).notify()
+    return outbox_id
+
+def get_dispatch_stats():
+    """Return outbox depth, delivery latency and sent/retried/failed counts."""
+    with _stats_lock:
+        latency = {
+            "count": _latency["count"],
+            "avg_seconds": round(_latency["total"] / _latency["count"], 3) if _latency["count"] else 0.0,
+            "max_seconds": round(_latency["max"], 3)
+        }
+    outbox = get_outbox()
+    with outbox._lock:
+        counters = dict(outbox.counters)
+    if _pool is not None:
+        with _pool._counters_lock:
+            counters.update(_pool.counters)
+    return {"outbox_depth": outbox.depth(), "delivery_latency": latency, "counters": counters}
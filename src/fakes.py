@@ -0,0 +1,294 @@
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from types import SimpleNamespace
+from gspread.utils import rowcol_to_a1
+
+# In-process stand-ins for Twilio, Google Vision, xAI, Google Sheets and the
+# Twilio media download, exposing only the parts of each client this app
+# uses. Every fake sleeps for a configurable latency, fails a configurable
+# fraction of calls and counts the calls it receives.
+
+IMAGE_PREFIX = b"FAKE-INVOICE\n"
+
+class FaultInjector:
+    """Latency, error injection and call counting shared by the fakes of one service."""
+
+    def __init__(self, service, latency=0.0, jitter=0.0, error_rate=0.0, seed=None, error_factory=None):
+        self.service = service
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_factory = error_factory or (lambda name: RuntimeError(f"Injected {name} failure"))
+        self.calls = Counter()
+        self.errors = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def call(self, method):
+        """Count a call, sleep for the configured latency and raise an injected error if drawn."""
+        name = f"{self.service}.{method}"
+        with self._lock:
+            self.calls[name] += 1
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors[name] += 1
+        if delay:
+            time.sleep(delay)
+        if failed:
+            raise self.error_factory(name)
+
+def _a1_to_index(cell):
+    """Convert an A1 cell reference ("B12") to zero-based (row, column)."""
+    match = re.fullmatch(r"([A-Z]+)(\d+)", cell)
+    column = 0
+    for char in match.group(1):
+        column = column * 26 + ord(char) - ord("A") + 1
+    return int(match.group(2)) - 1, column - 1
+
+def _numericise(value):
+    """Convert numeric cell strings the way gspread's get_all_records does."""
+    if isinstance(value, str):
+        for cast in (int, float):
+            try:
+                return cast(value)
+            except ValueError:
+                pass
+    return value
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, title, header):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.rows = [list(header)]
+
+    def _call(self, method, write=False):
+        self.spreadsheet.injector.call(method)
+        if write:
+            self.spreadsheet.touch()
+
+    def _values(self):
+        rows = [[str(value) for value in row] for row in self.rows]
+        # The Sheets API omits trailing empty rows
+        while len(rows) > 1 and not any(rows[-1]):
+            rows.pop()
+        return rows
+
+    def get_all_values(self):
+        self._call("get_all_values")
+        return self._values()
+
+    def get_all_records(self):
+        self._call("get_all_records")
+        values = self._values()
+        header = values[0]
+        return [
+            {column: _numericise(row[i] if i < len(row) else "") for i, column in enumerate(header)}
+            for row in values[1:]
+        ]
+
+    def _write(self, range_name, values):
+        start = range_name.split("!")[-1].split(":")[0].replace("'", "")
+        row, column = _a1_to_index(start)
+        for offset, values_row in enumerate(values):
+            while len(self.rows) <= row + offset:
+                self.rows.append([])
+            target = self.rows[row + offset]
+            while len(target) < column + len(values_row):
+                target.append("")
+            target[column:column + len(values_row)] = [str(value) for value in values_row]
+
+    def update(self, range_name=None, values=None):
+        self._call("update", write=True)
+        self._write(range_name, values)
+        return {"updatedRange": f"'{self.title}'!{range_name}"}
+
+    def batch_update(self, data):
+        self._call("batch_update", write=True)
+        for item in data:
+            self._write(item["range"], item["values"])
+        return {"totalUpdatedRows": sum(len(item["values"]) for item in data)}
+
+    def append_rows(self, rows):
+        self._call("append_rows", write=True)
+        start = len(self._values()) + 1
+        del self.rows[start - 1:]
+        self.rows.extend([str(value) for value in row] for row in rows)
+        return {"updates": {"updatedRange": f"'{self.title}'!A{start}:{rowcol_to_a1(start + len(rows) - 1, len(rows[0]))}"}}
+
+    def append_row(self, row):
+        self._call("append_row", write=True)
+        start = len(self._values()) + 1
+        del self.rows[start - 1:]
+        self.rows.append([str(value) for value in row])
+        return {"updates": {"updatedRange": f"'{self.title}'!A{start}"}}
+
+class FakeSpreadsheet:
+    """Google Sheets stand-in holding every worksheet in memory; injector.calls counts API calls."""
+
+    def __init__(self, injector, sheets):
+        self.id = f"fake-{uuid.uuid4().hex[:8]}"
+        self.injector = injector
+        self._worksheets = {title: FakeWorksheet(self, title, header) for title, header in sheets.items()}
+        self._updated = time.time()
+
+    def touch(self):
+        self._updated = time.time()
+
+    def worksheet(self, title):
+        self.injector.call("worksheet")
+        return self._worksheets[title]
+
+    def get_lastUpdateTime(self):
+        self.injector.call("get_lastUpdateTime")
+        return f"{self._updated:.6f}"
+
+class FakeVisionClient:
+    """Vision ImageAnnotatorClient stand-in: images made by fake_invoice_image() OCR to their text."""
+
+    def __init__(self, injector):
+        self.injector = injector
+
+    def batch_annotate_images(self, requests):
+        self.injector.call("batch_annotate_images")
+        responses = []
+        for request in requests:
+            content = request.image.content
+            text = content[len(IMAGE_PREFIX):].decode("utf-8") if content.startswith(IMAGE_PREFIX) else ""
+            responses.append(SimpleNamespace(
+                error=SimpleNamespace(message=""),
+                text_annotations=[SimpleNamespace(description=text)] if text else [],
+                full_text_annotation=SimpleNamespace(pages=[])
+            ))
+        return SimpleNamespace(responses=responses)
+
+ITEM_PATTERN = re.compile(
+    r"^\d+ \| (?P<name>[^|]+) \| (?P<unit>\w+) \| (?P<net>[\d,]+) \| (?P<vat>\d+) \| (?P<gross>[\d,]+) \| (?P<category>[A-Z ]+)$",
+    re.MULTILINE
+)
+
+def _field(pattern, text, default=""):
+    match = re.search(pattern, text, re.MULTILINE)
+    return match.group(1).strip() if match else default
+
+class _FakeCompletions:
+    def __init__(self, injector):
+        self.injector = injector
+
+    def create(self, model=None, messages=None, max_tokens=None, **kwargs):
+        self.injector.call("chat.completions.create")
+        prompt = messages[-1]["content"]
+        ingredients = [
+            {
+                "name": match.group("name"),
+                "unit": match.group("unit"),
+                "net_price_per_unit": float(match.group("net").replace(",", ".")),
+                "vat_percent": float(match.group("vat")),
+                "gross_price_per_unit": float(match.group("gross").replace(",", ".")),
+                "category": match.group("category")
+            }
+            for match in ITEM_PATTERN.finditer(prompt)
+        ]
+        if "return ingredients as an empty list" in prompt:
+            ingredients = []
+        categories = [ingredient["category"] for ingredient in ingredients]
+        result = {
+            "ingredients": ingredients,
+            "invoice_date": _field(r"^Data wystawienia: (.+)$", prompt),
+            "due_date": _field(r"^Termin płatności: (.+)$", prompt),
+            "total": float(_field(r"^Razem: ([\d,]+)", prompt, "0").replace(",", ".")),
+            "paid": _field(r"^Paid status: ([TN])", prompt, "N"),
+            "seller": _field(r"^Sprzedawca: (.+)$", prompt, "Unknown"),
+            "category": max(categories, key=categories.count) if categories else "INNE",
+            "invoice_number": _field(r"^FAKTURA VAT (.+)$", prompt)
+        }
+        content = json.dumps(result, ensure_ascii=False)
+        finish_reason = "stop"
+        # Counted like usage below: about four characters per token
+        if max_tokens is not None and len(content) // 4 > max_tokens:
+            content, finish_reason = content[:max_tokens * 4], "length"
+        usage = SimpleNamespace(
+            prompt_tokens=len(prompt) // 4, completion_tokens=len(content) // 4, prompt_tokens_details=None
+        )
+        choice = SimpleNamespace(message=SimpleNamespace(content=content), finish_reason=finish_reason)
+        return SimpleNamespace(choices=[choice], usage=usage)
+
+class FakeOpenAIClient:
+    """xAI (OpenAI-compatible) client stand-in that "parses" invoices made by fake_invoice_text()."""
+
+    def __init__(self, injector):
+        self.chat = SimpleNamespace(completions=_FakeCompletions(injector))
+
+class _FakeMessages:
+    def __init__(self, injector):
+        self.injector = injector
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def create(self, **kwargs):
+        self.injector.call("messages.create")
+        message = SimpleNamespace(sid=f"SM{uuid.uuid4().hex}", **kwargs)
+        with self._lock:
+            self.sent.append(message)
+        return message
+
+class FakeTwilioClient:
+    """Twilio REST client stand-in; messages.sent keeps every message created."""
+
+    def __init__(self, injector):
+        self.messages = _FakeMessages(injector)
+
+class _FakeResponse:
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {"Content-Length": str(len(content))}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+class FakeHttpSession:
+    """requests.Session stand-in serving Twilio media from a dict of url -> bytes."""
+
+    def __init__(self, injector, media=None):
+        self.injector = injector
+        self.media = media if media is not None else {}
+
+    def get(self, url, stream=False, timeout=None):
+        self.injector.call("get")
+        content = self.media.get(url)
+        return _FakeResponse(404, b"") if content is None else _FakeResponse(200, content)
+
+def fake_invoice_text(number, seller, invoice_date, due_date, items):
+    """Render an invoice the fake OCR and LLM understand; items are ingredient dicts as the parser returns them."""
+    lines = [
+        f"FAKTURA VAT {number}",
+        f"Sprzedawca: {seller}",
+        f"Data wystawienia: {invoice_date}",
+        f"Termin płatności: {due_date}",
+        "Lp | Nazwa | J.m. | Cena netto | VAT | Cena brutto | Kategoria"
+    ]
+    for i, item in enumerate(items, start=1):
+        lines.append(
+            f"{i} | {item['name']} | {item['unit']} | {item['net_price_per_unit']:.2f} | {item['vat_percent']:.0f} | "
+            f"{item['gross_price_per_unit']:.2f} | {item['category']}".replace(".", ",")
+        )
+    total = sum(item["gross_price_per_unit"] for item in items)
+    lines.append(f"Razem: {total:.2f}".replace(".", ","))
+    return "\n".join(lines)
+
+def fake_invoice_image(text):
+    """Wrap invoice text as image bytes the fake Vision client reads back."""
+    return IMAGE_PREFIX + text.encode("utf-8")
@@ -0,0 +1,131 @@
+import re
+import unicodedata
+from collections import Counter
+from src.config import FUZZY_MATCH_THRESHOLD
+
+# Candidates are generated from the rarest trigrams of a query only, which
+# keeps lookups sub-millisecond on catalogs of tens of thousands of names.
+CANDIDATE_TRIGRAMS = 6
+
+POLISH_CHARS = str.maketrans("ąćęłńóśźżĄĆĘŁŃÓŚŹŻ", "acelnoszzACELNOSZZ")
+
+UNIT_ALIASES = {
+    "kg": "kg", "kilo": "kg", "g": "g", "gr": "g", "l": "l", "litr": "l", "ltr": "l", "ml": "ml",
+    "szt": "szt", "sztuk": "szt", "zgrz": "zgrz", "kart": "kart", "op": "op", "opak": "op"
+}
+
+QUANTITY_PATTERN = re.compile(r"(\d+(?:[.,]\d+)?)\s*(" + "|".join(sorted(UNIT_ALIASES, key=len, reverse=True)) + r")\b\.?")
+DECIMAL_COMMA_PATTERN = re.compile(r"(\d),(\d)")
+PACK_PATTERN = re.compile(r"\b(\d+)\s*x\b|\bx\s*(\d+)\b")
+
+def normalize_name(name):
+    """Normalize an ingredient name: strip diacritics, lowercase, canonical units and pack sizes.
+
+    "Kukurydza kolby 2,5kg" and "kukurydza  kolby 2.5 KG" both become
+    "kukurydza kolby 2.5kg"; "Mleko 3,2% 1l" becomes "mleko 3.2 1l".
+    """
+    text = unicodedata.normalize("NFKD", name.translate(POLISH_CHARS))
+    text = "".join(char for char in text if not unicodedata.combining(char)).lower()
+    # Decimal commas first, so punctuation stripping below cannot split "3,2" into two numbers
+    text = DECIMAL_COMMA_PATTERN.sub(r"\1.\2", text)
+
+    def quantity(match):
+        number = match.group(1).replace(",", ".")
+        if "." in number:
+            number = number.rstrip("0").rstrip(".")
+        return f" {number}{UNIT_ALIASES[match.group(2)]} "
+
+    text = QUANTITY_PATTERN.sub(quantity, text)
+    text = PACK_PATTERN.sub(lambda m: f" x{m.group(1) or m.group(2)} ", text)
+    text = re.sub(r"[^\w.]+", " ", text)
+    return " ".join(text.split())
+
+def quantities(normalized):
+    """Return the quantity/pack tokens of a normalized name, e.g. {"2.5kg", "x12"}."""
+    return {token for token in normalized.split() if token[0].isdigit() or re.fullmatch(r"x\d+", token)}
+
+def trigrams(normalized):
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _is_unit_noise(token):
+    return token in UNIT_ALIASES.values() or token[0].isdigit() or re.fullmatch(r"x\d+", token) is not None
+
+def similarity(a, b):
+    """Score two normalized names in [0, 1]; names with different quantities never match."""
+    quantities_a, quantities_b = quantities(a), quantities(b)
+    if quantities_a and quantities_b and quantities_a != quantities_b:
+        return 0.0
+    grams_a, grams_b = trigrams(a), trigrams(b)
+    shared = len(grams_a & grams_b)
+    if not shared:
+        return 0.0
+    jaccard = shared / len(grams_a | grams_b)
+    # One name adding only a quantity or unit to the other ("cebula" and
+    # "cebula 1kg") still counts as a match; any other extra word ("cukier
+    # puder") names a different product
+    tokens_a, tokens_b = set(a.split()), set(b.split())
+    if tokens_a <= tokens_b or tokens_b <= tokens_a:
+        extra = tokens_a ^ tokens_b
+        if all(_is_unit_noise(token) for token in extra):
+            return max(jaccard, 0.95)
+        if len(extra) == 1 and quantities_a and _is_producer(*sorted((a, b), key=len)):
+            return max(jaccard, 0.9)
+    return jaccard
+
+def _is_producer(shorter, longer):
+    """True if longer is shorter plus one last word after the quantity, where invoices print the producer.
+
+    Only trusted when the shared name has at least two words besides the
+    quantity: "kukurydza kolby 2.5kg oerlemans" is a brand, while the "extra"
+    in "maslo 200g extra" names a different product.
+    """
+    words = longer.split()
+    if " ".join(words[:-1]) != shorter or not _is_unit_noise(words[-2]):
+        return False
+    return sum(1 for token in shorter.split() if not _is_unit_noise(token)) >= 2
+
+class NameIndex:
+    """Trigram index over the canonical ingredient names of one category."""
+
+    def __init__(self, names=()):
+        self._names = []
+        self._normalized = []
+        self._by_normalized = {}
+        self._postings = {}
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self._names)
+
+    def add(self, name):
+        normalized = normalize_name(name)
+        if normalized in self._by_normalized:
+            return
+        name_id = len(self._names)
+        self._names.append(name)
+        self._normalized.append(normalized)
+        self._by_normalized[normalized] = name_id
+        for gram in trigrams(normalized):
+            self._postings.setdefault(gram, []).append(name_id)
+
+    def match(self, name, threshold=FUZZY_MATCH_THRESHOLD):
+        """Return (canonical_name, score) for the best match at or above threshold, or (None, 0.0)."""
+        normalized = normalize_name(name)
+        exact = self._by_normalized.get(normalized)
+        if exact is not None:
+            return self._names[exact], 1.0
+        grams = [gram for gram in trigrams(normalized) if gram in self._postings]
+        if not grams:
+            return None, 0.0
+        rare = sorted(grams, key=lambda gram: len(self._postings[gram]))[:CANDIDATE_TRIGRAMS]
+        candidates = Counter(name_id for gram in rare for name_id in self._postings[gram])
+        best_name, best_score = None, 0.0
+        for name_id, _ in candidates.most_common(10):
+            score = similarity(normalized, self._normalized[name_id])
+            if score > best_score:
+                best_name, best_score = self._names[name_id], score
+        if best_score >= threshold:
+            return best_name, best_score
+        return None, best_score
@@ -0,0 +1,289 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from src.config import JOBS_DB_PATH, JOB_WORKERS, JOB_MAX_ATTEMPTS, JOB_RETRY_DELAY, JOB_STALE_AFTER
+from src.metrics import STAGE_SECONDS, count_retry
+
+logger = logging.getLogger(__name__)
+
+# Recent latencies kept per stage for percentiles
+STAGE_SAMPLES = 1000
+
+_stats_lock = threading.Lock()
+_stage_stats = {}
+
+def record_stage(stage, seconds):
+    """Record the latency of one pipeline stage."""
+    with _stats_lock:
+        entry = _stage_stats.setdefault(
+            stage, {"count": 0, "total": 0.0, "max": 0.0, "samples": deque(maxlen=STAGE_SAMPLES)}
+        )
+        entry["count"] += 1
+        entry["total"] += seconds
+        entry["max"] = max(entry["max"], seconds)
+        entry["samples"].append(seconds)
+    STAGE_SECONDS.observe(seconds, stage=stage)
+
+def percentile(samples, fraction):
+    """Return the nearest-rank percentile of a sequence of numbers (0.0 if empty)."""
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+def reset_stage_stats():
+    """Forget recorded stage latencies, e.g. between benchmark runs."""
+    with _stats_lock:
+        _stage_stats.clear()
+
+@contextmanager
+def timed_stage(stage):
+    """Time a block of code and record it as a pipeline stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        record_stage(stage, elapsed)
+        logger.debug(f"Stage {stage} took {elapsed:.3f}s")
+
+class JobQueue:
+    """Durable SQLite-backed queue of jobs, shared by all worker processes."""
+
+    def __init__(self, db_path=JOBS_DB_PATH, table="jobs"):
+        self.db_path = db_path
+        self.table = table
+        self.counters = {"enqueued": 0, "duplicates": 0}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.table} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                message_sid TEXT UNIQUE,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT '{{}}',
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                error TEXT
+            )
+        """)
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.table}_status ON {self.table} (status, available_at)")
+
+    def enqueue(self, payload, message_sid=None):
+        """Persist a new job. Returns its id, or None if the message was already queued."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                f"INSERT OR IGNORE INTO {self.table} (message_sid, payload, available_at, updated_at) VALUES (?, ?, ?, ?)",
+                (message_sid, json.dumps(payload, ensure_ascii=False), now, now)
+            )
+            self.counters["duplicates" if cursor.rowcount == 0 else "enqueued"] += 1
+        if cursor.rowcount == 0:
+            logger.info(f"Ignoring redelivered message {message_sid}")
+            return None
+        logger.info(f"Queued {self.table} entry {cursor.lastrowid} for message {message_sid}")
+        return cursor.lastrowid
+
+    def claim(self):
+        """Atomically take the oldest runnable job, or return None if there is none."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    f"SELECT id, payload, state, attempts FROM {self.table} "
+                    "WHERE status = 'queued' AND available_at <= ? ORDER BY available_at, id LIMIT 1",
+                    (now,)
+                ).fetchone()
+                if row:
+                    self._conn.execute(
+                        f"UPDATE {self.table} SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                        (now, row[0])
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if not row:
+            return None
+        return {
+            "id": row[0],
+            "payload": json.loads(row[1]),
+            "state": json.loads(row[2]),
+            "attempts": row[3] + 1
+        }
+
+    def save_state(self, job):
+        """Checkpoint a job's intermediate results so a retry resumes where it stopped."""
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE {self.table} SET state = ?, updated_at = ? WHERE id = ?",
+                (json.dumps(job["state"], ensure_ascii=False), time.time(), job["id"])
+            )
+
+    def complete(self, job):
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE {self.table} SET status = 'done', error = NULL, updated_at = ? WHERE id = ?",
+                (time.time(), job["id"])
+            )
+
+    def retry(self, job, error, delay):
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE {self.table} SET status = 'queued', error = ?, available_at = ?, updated_at = ? WHERE id = ?",
+                (str(error), time.time() + delay, time.time(), job["id"])
+            )
+
+    def fail(self, job, error):
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE {self.table} SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+                (str(error), time.time(), job["id"])
+            )
+
+    def requeue_stale(self, older_than=JOB_STALE_AFTER):
+        """Requeue jobs left 'running' by a worker process that died."""
+        with self._lock:
+            cursor = self._conn.execute(
+                f"UPDATE {self.table} SET status = 'queued', available_at = ? WHERE status = 'running' AND updated_at < ?",
+                (time.time(), time.time() - older_than)
+            )
+        if cursor.rowcount:
+            logger.warning(f"Requeued {cursor.rowcount} stale jobs")
+        return cursor.rowcount
+
+    def depth(self):
+        """Return the number of jobs per status."""
+        with self._lock:
+            rows = self._conn.execute(f"SELECT status, COUNT(*) FROM {self.table} GROUP BY status").fetchall()
+        return dict(rows)
+
+class WorkerPool:
+    """Threads that drain the job queue and run each job through a handler."""
+
+    def __init__(self, queue, handler, on_failure=None, num_workers=JOB_WORKERS, max_attempts=JOB_MAX_ATTEMPTS,
+                 retry_delay=JOB_RETRY_DELAY, poll_interval=1.0, name="invoice-worker"):
+        self.queue = queue
+        self.name = name
+        self.counters = {"completed": 0, "failed": 0, "retries": 0}
+        self._counters_lock = threading.Lock()
+        self.handler = handler
+        self.on_failure = on_failure
+        self.num_workers = num_workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self.queue.requeue_stale()
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.num_workers} {self.name} threads")
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def notify(self):
+        """Wake an idle worker after a job has been enqueued."""
+        self._wakeup.set()
+
+    def _increment(self, counter):
+        with self._counters_lock:
+            self.counters[counter] += 1
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                job = self.queue.claim()
+            except Exception as e:
+                logger.error(f"Failed to claim job: {e}")
+                job = None
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._process(job)
+
+    def _process(self, job):
+        start = time.perf_counter()
+        try:
+            self.handler(job, lambda: self.queue.save_state(job))
+            self.queue.complete(job)
+            self._increment("completed")
+            if self.queue.table == "jobs":
+                record_stage("total", time.perf_counter() - start)
+        except Exception as e:
+            if job["attempts"] < self.max_attempts and getattr(e, "retryable", True):
+                delay = self.retry_delay * 2 ** (job["attempts"] - 1)
+                logger.warning(f"Job {job['id']} failed (attempt {job['attempts']}), retrying in {delay:.0f}s: {e}")
+                self.queue.retry(job, e, delay)
+                self._increment("retries")
+                count_retry(self.name)
+                return
+            logger.error(f"Job {job['id']} failed permanently after {job['attempts']} attempts: {e}")
+            self.queue.fail(job, e)
+            self._increment("failed")
+            if self.on_failure:
+                self.on_failure(job, e)
+
+_queue = None
+_pool = None
+_pid = None
+_init_lock = threading.Lock()
+
+def get_queue():
+    """Return the process-wide job queue, opened lazily (after gunicorn forks)."""
+    global _queue, _pid
+    with _init_lock:
+        if _queue is None or _pid != os.getpid():
+            _queue = JobQueue()
+            _pid = os.getpid()
+        return _queue
+
+def ensure_workers(handler, on_failure=None):
+    """Start the worker pool for this process if it is not running yet."""
+    global _pool
+    queue = get_queue()
+    with _init_lock:
+        if _pool is None or _pool.queue is not queue:
+            _pool = WorkerPool(queue, handler, on_failure)
+            _pool.start()
+        return _pool
+
+def get_stats():
+    """Return queue depth, per-stage latency (average, max and recent p50/p95) and retry counters."""
+    with _stats_lock:
+        stages = {
+            stage: {
+                "count": entry["count"],
+                "avg_seconds": round(entry["total"] / entry["count"], 3) if entry["count"] else 0.0,
+                "max_seconds": round(entry["max"], 3),
+                "p50_seconds": round(percentile(entry["samples"], 0.5), 3),
+                "p95_seconds": round(percentile(entry["samples"], 0.95), 3)
+            }
+            for stage, entry in _stage_stats.items()
+        }
+    queue = get_queue()
+    with queue._lock:
+        counters = dict(queue.counters)
+    if _pool is not None:
+        with _pool._counters_lock:
+            counters.update(_pool.counters)
+    return {"queue_depth": queue.depth(), "stages": stages, "counters": counters}
@@ -0,0 +1,90 @@
+import logging
+import re
+from statistics import median
+
+logger = logging.getLogger(__name__)
+
+# Header cells that mark the start of the line-item table
+TABLE_HEADER_PATTERN = re.compile(r"\b(lp\.?|nazwa|towar|ilość|ilosc|cena|j\.?\s?m\.?)\b", re.IGNORECASE)
+# Rows that end the line-item table
+TOTALS_PATTERN = re.compile(r"\b(razem|suma|do zapłaty|do zaplaty|ogółem|ogolem|w tym)\b", re.IGNORECASE)
+# Header rows worth keeping for the parser
+HEADER_FIELD_PATTERN = re.compile(
+    r"(faktura|nr|numer|data|termin|płatn|platn|sprzedawca|sprzedaż|sprzedaz|nip)",
+    re.IGNORECASE
+)
+# Rows that never help parsing (bank details, signatures, footers)
+NOISE_PATTERN = re.compile(
+    r"(iban|swift|nr konta|rachunek|bank|podpis|osoba upoważniona|osoba upowazniona|strona \d|www\.|e-mail|tel\.)",
+    re.IGNORECASE
+)
+
+def words_from_annotation(full_text_annotation):
+    """Flatten a Vision full_text_annotation into (text, x0, y0, x1, y1) word boxes."""
+    words = []
+    for page in full_text_annotation.pages:
+        for block in page.blocks:
+            for paragraph in block.paragraphs:
+                for word in paragraph.words:
+                    text = "".join(symbol.text for symbol in word.symbols)
+                    xs = [vertex.x for vertex in word.bounding_box.vertices]
+                    ys = [vertex.y for vertex in word.bounding_box.vertices]
+                    words.append((text, min(xs), min(ys), max(xs), max(ys)))
+    return words
+
+def group_rows(words):
+    """Cluster word boxes into visual rows by vertical centre, each sorted left to right."""
+    if not words:
+        return []
+    tolerance = median(y1 - y0 for _, _, y0, _, y1 in words) * 0.6
+    rows = []
+    for word in sorted(words, key=lambda w: (w[2] + w[4]) / 2):
+        centre = (word[2] + word[4]) / 2
+        if rows and abs(centre - rows[-1]["centre"]) <= tolerance:
+            rows[-1]["words"].append(word)
+            count = len(rows[-1]["words"])
+            rows[-1]["centre"] += (centre - rows[-1]["centre"]) / count
+        else:
+            rows.append({"centre": centre, "words": [word]})
+    return [sorted(row["words"], key=lambda w: w[1]) for row in rows]
+
+def row_text(row, column_gap=None):
+    """Join a row's words, separating columns (wide horizontal gaps) with " | "."""
+    if column_gap is None:
+        widths = [(x1 - x0) / max(len(text), 1) for text, x0, _, x1, _ in row]
+        column_gap = median(widths) * 2.5 if widths else 0
+    parts = [row[0][0]]
+    for previous, word in zip(row, row[1:]):
+        parts.append(" | " if word[1] - previous[3] > column_gap else " ")
+        parts.append(word[0])
+    return "".join(parts)
+
+def compact_layout(words):
+    """Rebuild an invoice from word boxes into HEADER / ITEMS / TOTALS sections.
+
+    Only header rows that carry invoice fields are kept, the line-item table
+    is emitted row by row with column separators, and bank details and
+    footers are dropped. Falls back to all rows if no table header is found.
+    """
+    lines = [row_text(row) for row in group_rows(words)]
+    start = next((i for i, line in enumerate(lines) if len(TABLE_HEADER_PATTERN.findall(line)) >= 2), None)
+    if start is None:
+        logger.debug("No line-item table found, returning all rows")
+        return "\n".join(line for line in lines if not NOISE_PATTERN.search(line))
+    end = next((i for i in range(start + 1, len(lines)) if TOTALS_PATTERN.search(lines[i])), len(lines))
+    header = [line for line in lines[:start] if HEADER_FIELD_PATTERN.search(line) and not NOISE_PATTERN.search(line)]
+    items = lines[start:end]
+    totals = [line for line in lines[end:end + 4] if not NOISE_PATTERN.search(line)]
+    # Seller names usually sit in the first rows without a field label
+    header = lines[:2] + [line for line in header if line not in lines[:2]]
+    return "HEADER:\n" + "\n".join(header) + "\nITEMS:\n" + "\n".join(items) + "\nTOTALS:\n" + "\n".join(totals)
+
+def flatten_layout(text):
+    """Turn compact_layout() output back into plain rows: drop the section markers and column separators.
+
+    Text that is not in the compact layout form is returned unchanged.
+    """
+    if not text.startswith("HEADER:\n") or "\nITEMS:\n" not in text:
+        return text
+    lines = [line for line in text.splitlines() if line not in ("HEADER:", "ITEMS:", "TOTALS:")]
+    return "\n".join(line.replace(" | ", " ") for line in lines)
@@ -0,0 +1,120 @@
+import logging
+import os
+import queue
+import smtplib
+import threading
+import time
+from src.config import SMTP_HOST, SMTP_PORT, SMTP_SSL, SMTP_IDLE_TIMEOUT, EMAIL_MAX_ATTEMPTS
+from src.metrics import instrumented, count_api_call, count_retry
+
+logger = logging.getLogger(__name__)
+
+class EmailSender:
+    """Background thread that sends queued emails over one long-lived SMTP session.
+
+    The session is opened on the first message, reused for the following
+    ones, reopened after a disconnect and closed after idle_timeout seconds
+    without mail. For local testing point it at a stand-in server, e.g.
+    `python -m aiosmtpd -n -l localhost:8025` with SMTP_PORT=8025 SMTP_SSL=0.
+    """
+
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, use_ssl=SMTP_SSL, idle_timeout=SMTP_IDLE_TIMEOUT,
+                 max_attempts=EMAIL_MAX_ATTEMPTS):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.idle_timeout = idle_timeout
+        self.max_attempts = max_attempts
+        self.stats = {"sent": 0, "failed": 0, "connects": 0}
+        self._queue = queue.Queue()
+        self._conn = None
+        self._login = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, sender, password, recipient, msg):
+        """Queue a message for sending; returns immediately."""
+        self._ensure_thread()
+        self._queue.put((sender, password, recipient, msg))
+
+    def flush(self):
+        """Block until every queued message has been sent or given up on."""
+        self._queue.join()
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # A forked child inherits neither the thread nor a usable connection
+                self._conn = None
+                self._queue = queue.Queue()
+                self._thread = None
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="email-sender", daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+
+    def _connect(self, sender, password):
+        if self.use_ssl:
+            conn = smtplib.SMTP_SSL(self.host, self.port, timeout=30)
+        else:
+            conn = smtplib.SMTP(self.host, self.port, timeout=30)
+        conn.ehlo()
+        if password and conn.has_extn("auth"):
+            conn.login(sender, password)
+        self.stats["connects"] += 1
+        logger.info(f"Opened SMTP session to {self.host}:{self.port}")
+        return conn
+
+    def _close(self):
+        if self._conn is None:
+            return
+        try:
+            self._conn.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self._conn = None
+        logger.info("Closed SMTP session")
+
+    @instrumented("send_email")
+    def _send(self, sender, password, recipient, msg):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                if self._conn is None or self._login != (sender, password):
+                    self._close()
+                    self._conn = self._connect(sender, password)
+                    self._login = (sender, password)
+                count_api_call("smtp")
+                self._conn.sendmail(sender, recipient, msg.as_string())
+                self.stats["sent"] += 1
+                logger.info(f"Sent email notification: {msg['Subject']}")
+                return
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError) as e:
+                # The server dropped the session; reconnect and try again
+                logger.warning(f"SMTP session lost (attempt {attempt}): {e}")
+                self._conn = None
+                if attempt < self.max_attempts:
+                    count_retry("smtp")
+                    time.sleep(2 ** (attempt - 1))
+            except smtplib.SMTPException as e:
+                logger.error(f"Failed to send email notification '{msg['Subject']}': {e}")
+                self._close()
+                break
+        self.stats["failed"] += 1
+        logger.error(f"Giving up on email notification: {msg['Subject']}")
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                self._close()
+                continue
+            try:
+                self._send(*item)
+            except Exception as e:
+                logger.error(f"Unexpected error sending email: {e}")
+            finally:
+                self._queue.task_done()
+
+email_sender = EmailSender()
@@ -0,0 +1,308 @@
+import atexit
+import functools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from src.config import METRICS_DB_PATH, METRICS_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Minimal Prometheus-compatible metrics: counters, gauges and histograms
+# rendered in the text exposition format by /metrics. Values are kept in a
+# SQLite file shared by every process on the host, so any gunicorn worker
+# answering a scrape reports the totals of all of them. Recording only
+# updates an in-memory buffer; a background thread in each process writes
+# the buffer in one transaction every METRICS_FLUSH_INTERVAL seconds, so a
+# scrape can lag the other processes by that much.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key):
+    if not key:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in key)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(key, escaped)) + "}"
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _count(value):
+    return int(value) if float(value).is_integer() else value
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class MetricStore:
+    """SQLite table of metric samples, one row per metric, label set and field.
+
+    A field is "" for counters and set gauges, the recording process's pid
+    for gauges moved with inc/dec (rows of dead processes are dropped when
+    read), and a bucket index, "sum" or "count" for histograms. Updates are
+    buffered per process and written by flush().
+    """
+
+    def __init__(self, db_path=METRICS_DB_PATH, flush_interval=METRICS_FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._owner = None
+
+    def _connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS metric_samples (
+                    metric TEXT NOT NULL,
+                    labels TEXT NOT NULL,
+                    field TEXT NOT NULL,
+                    value REAL NOT NULL,
+                    PRIMARY KEY (metric, labels, field)
+                )
+            """)
+            self._pid = os.getpid()
+        return self._conn
+
+    def _start_flusher(self):
+        """Start this process's flush thread; a forked child drops the buffer it inherited from its parent."""
+        if self._owner == os.getpid():
+            return
+        with self._start_lock:
+            if self._owner == os.getpid():
+                return
+            first = self._owner is None
+            self._lock = threading.Lock()
+            self._pending_lock = threading.Lock()
+            self._pending = {}
+            self._owner = os.getpid()
+            threading.Thread(target=self._run, daemon=True, name="metrics-flush").start()
+        if first:
+            atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def add(self, metric, key, changes, replace=False):
+        """Buffer adding (or with replace, setting) {field: value} for one label set of a metric."""
+        self._start_flusher()
+        with self._pending_lock:
+            for field, value in changes.items():
+                sample = (metric, key, field)
+                if replace or sample not in self._pending:
+                    self._pending[sample] = (value, replace)
+                else:
+                    total, replaced = self._pending[sample]
+                    self._pending[sample] = (total + value, replaced)
+
+    def flush(self):
+        """Write the updates buffered by this process in one transaction."""
+        if self._owner != os.getpid():
+            return
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        rows = {False: [], True: []}
+        for (metric, key, field), (value, replace) in pending.items():
+            rows[replace].append((metric, json.dumps(key, ensure_ascii=False), field, value))
+        try:
+            with self._lock:
+                conn = self._connection()
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    for replace, operation in ((False, "value + excluded.value"), (True, "excluded.value")):
+                        conn.executemany(
+                            "INSERT INTO metric_samples (metric, labels, field, value) VALUES (?, ?, ?, ?) "
+                            f"ON CONFLICT(metric, labels, field) DO UPDATE SET value = {operation}",
+                            rows[replace]
+                        )
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to write {len(pending)} metric samples: {e}")
+
+    def read(self, metric):
+        """Return {label key: {field: value}} for a metric, including this process's buffered updates."""
+        self.flush()
+        try:
+            with self._lock:
+                rows = self._connection().execute(
+                    "SELECT labels, field, value FROM metric_samples WHERE metric = ?", (metric,)
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to read metric {metric}: {e}")
+            return {}
+        values = {}
+        for labels, field, value in rows:
+            key = tuple(tuple(pair) for pair in json.loads(labels))
+            values.setdefault(key, {})[field] = value
+        return values
+
+    def drop_fields(self, metric, fields):
+        try:
+            with self._lock:
+                self._connection().executemany(
+                    "DELETE FROM metric_samples WHERE metric = ? AND field = ?", [(metric, field) for field in fields]
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to drop samples of metric {metric}: {e}")
+
+_store = MetricStore()
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+
+    def inc(self, amount=1, **labels):
+        _store.add(self.name, _label_key(labels), {"": amount})
+
+    def samples(self):
+        return [(self.name, key, _count(fields.get("", 0))) for key, fields in _store.read(self.name).items()]
+
+class Gauge(Counter):
+    """Gauge moved with inc/dec per process and summed over live processes, or set to a shared value."""
+
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        _store.add(self.name, _label_key(labels), {str(os.getpid()): amount})
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        _store.add(self.name, _label_key(labels), {"": value}, replace=True)
+
+    def samples(self):
+        values = _store.read(self.name)
+        dead = {field for fields in values.values() for field in fields if field and not _pid_alive(int(field))}
+        if dead:
+            _store.drop_fields(self.name, dead)
+        return [
+            (self.name, key, _count(sum(value for field, value in fields.items() if field not in dead)))
+            for key, fields in values.items()
+        ]
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        changes = {"sum": value, "count": 1}
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            changes[str(index)] = 1
+        _store.add(self.name, _label_key(labels), changes)
+
+    def samples(self):
+        samples = []
+        for key, entry in _store.read(self.name).items():
+            cumulative = 0
+            for index, bound in enumerate(self.buckets):
+                cumulative += entry.get(str(index), 0)
+                samples.append((f"{self.name}_bucket", key + (("le", _format_value(float(bound))),), _count(cumulative)))
+            samples.append((f"{self.name}_bucket", key + (("le", "+Inf"),), _count(entry.get("count", 0))))
+            samples.append((f"{self.name}_sum", key, entry.get("sum", 0.0)))
+            samples.append((f"{self.name}_count", key, _count(entry.get("count", 0))))
+        return samples
+
+def _register(cls, name, documentation, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, documentation, **kwargs)
+        return metric
+
+def counter(name, documentation):
+    """Return the counter called name, creating it on first use."""
+    return _register(Counter, name, documentation)
+
+def gauge(name, documentation):
+    """Return the gauge called name, creating it on first use."""
+    return _register(Gauge, name, documentation)
+
+def histogram(name, documentation, buckets=DEFAULT_BUCKETS):
+    """Return the histogram called name, creating it on first use."""
+    return _register(Histogram, name, documentation, buckets=buckets)
+
+def render():
+    """Render every registered metric in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = sorted(_registry.values(), key=lambda metric: metric.name)
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, key, value in metric.samples():
+            lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+OPERATION_SECONDS = histogram("invoice_operation_seconds", "Latency of instrumented operations.")
+OPERATION_IN_PROGRESS = gauge("invoice_operation_in_progress", "Instrumented operations currently running.")
+OPERATION_ERRORS = counter("invoice_operation_errors_total", "Instrumented operations that raised.")
+API_CALLS = counter("invoice_api_calls_total", "Outbound calls to external services.")
+RETRIES = counter("invoice_retries_total", "Retried attempts, by component.")
+STAGE_SECONDS = histogram("invoice_stage_seconds", "Latency of invoice pipeline stages.")
+
+def instrumented(operation):
+    """Decorator timing each call as `operation`, counting it as in flight and counting exceptions."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            OPERATION_IN_PROGRESS.inc(operation=operation)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                OPERATION_ERRORS.inc(operation=operation)
+                raise
+            finally:
+                OPERATION_SECONDS.observe(time.perf_counter() - start, operation=operation)
+                OPERATION_IN_PROGRESS.dec(operation=operation)
+        return wrapper
+    return decorator
+
+def count_api_call(service, amount=1):
+    """Count outbound calls to an external service (twilio, vision, xai, sheets, smtp)."""
+    if amount:
+        API_CALLS.inc(amount, service=service)
+
+def count_retry(component):
+    RETRIES.inc(component=component)
+
+def flush():
+    """Write this process's buffered metric updates now, e.g. before a short-lived child process exits."""
+    _store.flush()
@@ -1,36 +1,96 @@
 from twilio.rest import Client
-from src.config import TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_WHATSAPP_NUMBER
+from twilio.base.exceptions import TwilioRestException
+from src.config import (
+    TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_WHATSAPP_NUMBER, NOTIFY_DIGEST, NOTIFY_DIGEST_CONTENT_SID
+)
+from src.dispatcher import dispatch, ensure_dispatcher, rate_limiter
+from src.mailer import email_sender
+from src.metrics import instrumented, count_api_call
 import os
-import smtplib
 from email.mime.text import MIMEText
 import logging
 import json
+from datetime import date, timedelta
 
 logger = logging.getLogger(__name__)
 
 client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
 
-def send_whatsapp_notification(content_sid, content_variables, to_number=None):
-    """Send a WhatsApp notification using a template."""
+PRICE_CHANGE_CONTENT_SID = "HX39bfa570490a5a5aa7e5ad2371436979"  # price_change_notification
+PAYMENT_REMINDER_CONTENT_SID = "HX96688fa611964bde3348ff65389b54df"  # payment_reminder
+
+@instrumented("send_whatsapp")
+def _create_message(notification):
+    """Send one outbox notification through Twilio; raises on failure.
+
+    Client errors other than 429 (bad number, bad template) are marked as not
+    retryable.
+    """
+    kwargs = {"from_": TWILIO_WHATSAPP_NUMBER, "to": notification["to"]}
+    if notification.get("content_sid"):
+        kwargs["content_sid"] = notification["content_sid"]
+        kwargs["content_variables"] = json.dumps(notification["content_variables"])
+    else:
+        kwargs["body"] = notification["body"]
     try:
-        to_number = to_number or os.getenv("NOTIFICATION_WHATSAPP_NUMBER")
-        if not to_number:
-            logger.error("No WhatsApp number configured for notifications")
-            return False
-        message = client.messages.create(
-            from_=TWILIO_WHATSAPP_NUMBER,
-            to=to_number,
-            content_sid=content_sid,
-            content_variables=json.dumps(content_variables)
-        )
-        logger.info(f"Sent WhatsApp notification with SID: {message.sid}")
+        count_api_call("twilio")
+        message = client.messages.create(**kwargs)
+    except TwilioRestException as e:
+        if e.status and 400 <= e.status < 500 and e.status != 429:
+            e.retryable = False
+        raise
+    logger.info(f"Sent WhatsApp notification with SID: {message.sid}")
+
+def _notification_number(to_number=None):
+    to_number = to_number or os.getenv("NOTIFICATION_WHATSAPP_NUMBER")
+    if not to_number:
+        logger.error("No WhatsApp number configured for notifications")
+    return to_number
+
+def send_whatsapp_message(body, to_number):
+    """Send a free-form WhatsApp message (e.g. a reply to the invoice sender)."""
+    try:
+        rate_limiter.acquire()
+        _create_message({"to": to_number, "body": body})
         return True
     except Exception as e:
-        logger.error(f"Failed to send WhatsApp notification: {e}")
+        logger.error(f"Failed to send WhatsApp message to {to_number}: {e}")
         return False
 
+def start_dispatcher():
+    """Start this process's dispatcher threads, so outbox rows left by a crashed process are sent at boot."""
+    return ensure_dispatcher(_create_message)
+
+def queue_whatsapp_notification(content_sid, content_variables, to_number=None):
+    """Queue a template notification in the outbox; it is sent by the dispatcher threads."""
+    to_number = _notification_number(to_number)
+    if not to_number:
+        return None
+    return dispatch(
+        {"to": to_number, "content_sid": content_sid, "content_variables": content_variables}, _create_message
+    )
+
+def queue_whatsapp_digest(title, lines, to_number=None):
+    """Queue a single notification summarizing several events.
+
+    Uses the NOTIFY_DIGEST_CONTENT_SID template when configured (1: title,
+    2: summary), a free-form message otherwise.
+    """
+    to_number = _notification_number(to_number)
+    if not to_number or not lines:
+        return None
+    summary = "\n".join(lines)
+    if NOTIFY_DIGEST_CONTENT_SID:
+        notification = {"content_sid": NOTIFY_DIGEST_CONTENT_SID, "content_variables": {"1": title, "2": summary}}
+    else:
+        notification = {"body": f"{title}\n{summary}"}
+    return dispatch(dict(notification, to=to_number), _create_message)
+
+def _pl_number(value, fmt=".2f"):
+    return format(value, fmt).replace(".", ",")
+
 def send_email_notification(subject, message, to_email=None):
-    """Send a notification via email."""
+    """Queue a notification email; it is sent by the background email sender."""
     try:
         sender = os.getenv("EMAIL_SENDER")
         password = os.getenv("EMAIL_PASSWORD")
@@ -42,79 +102,109 @@ def send_email_notification(subject, message, to_email=None):
         msg["Subject"] = subject
         msg["From"] = sender
         msg["To"] = recipient
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-            server.login(sender, password)
-            server.sendmail(sender, recipient, msg.as_string())
-        logger.info(f"Sent email notification: {subject}")
+        email_sender.submit(sender, password, recipient, msg)
+        logger.debug(f"Queued email notification: {subject}")
         return True
     except Exception as e:
-        logger.error(f"Failed to send email notification: {e}")
+        logger.error(f"Failed to queue email notification: {e}")
         return False
 
 def notify_price_changes(price_changes_by_category):
-    """Notify about price changes >5% using a WhatsApp template."""
+    """Queue notifications about price changes >5%: one template message per change, or one digest."""
     if not price_changes_by_category:
         return
-    content_sid = "HX39bfa570490a5a5aa7e5ad2371436979"  # price_change_notification
-    for category, changes in price_changes_by_category.items():
-        for change in changes:
-            content_variables = {
-                "1": category,
-                "2": change["name"],
-                "3": f"{change['old_price']:.2f}".replace(".", ","),
-                "4": f"{change['new_price']:.2f}".replace(".", ","),
-                "5": f"{change['change_percent']:+.2f}".replace(".", ",")
-            }
-            send_whatsapp_notification(content_sid, content_variables)
+    if NOTIFY_DIGEST:
+        lines = []
+        for category, changes in price_changes_by_category.items():
+            for change in changes:
+                trend = f", trend {change['trend_days']} dni" if change.get("trend_days") else ""
+                lines.append(
+                    f"{category}: {change['name']} {_pl_number(change['old_price'])} → "
+                    f"{_pl_number(change['new_price'])} PLN ({_pl_number(change['change_percent'], '+.2f')}%{trend})"
+                )
+        queue_whatsapp_digest(f"Zmiany cen składników ({len(lines)}):", lines)
+    else:
+        for category, changes in price_changes_by_category.items():
+            for change in changes:
+                content_variables = {
+                    "1": category,
+                    "2": change["name"],
+                    "3": _pl_number(change["old_price"]),
+                    "4": _pl_number(change["new_price"]),
+                    "5": _pl_number(change["change_percent"], "+.2f")
+                }
+                queue_whatsapp_notification(PRICE_CHANGE_CONTENT_SID, content_variables)
     # Fallback to email with free-form message
     if os.getenv("EMAIL_SENDER"):
         message = "Zmiany cen składników (>5%):\n"
         for category, changes in price_changes_by_category.items():
             message += f"\nKategoria: {category}\n"
             for change in changes:
+                trend = f", trend {change['trend_days']} dni" if change.get("trend_days") else ""
                 message += (
                     f"- {change['name']}: {change['old_price']:.2f} PLN → "
-                    f"{change['new_price']:.2f} PLN ({change['change_percent']:+.2f}%)\n"
+                    f"{change['new_price']:.2f} PLN ({change['change_percent']:+.2f}%{trend})\n"
                 )
         send_email_notification("Zmiany Cen Składników", message.strip())
 
+def send_payment_reminders(urgent_invoices):
+    """Queue reminders for invoices given as dicts with invoice_number, seller, amount, due_date and days_left."""
+    if not urgent_invoices:
+        return
+    if NOTIFY_DIGEST:
+        queue_whatsapp_digest(
+            f"Przypomnienia o płatnościach ({len(urgent_invoices)}):",
+            [
+                f"{inv['invoice_number']}, {inv['seller']}: {inv['amount']} PLN, "
+                f"termin {inv['due_date']} ({inv['days_left']} dni)"
+                for inv in urgent_invoices
+            ]
+        )
+    else:
+        for inv in urgent_invoices:
+            content_variables = {
+                "1": inv["invoice_number"],
+                "2": inv["seller"],
+                "3": inv["amount"],
+                "4": inv["due_date"],
+                "5": inv["days_left"]
+            }
+            queue_whatsapp_notification(PAYMENT_REMINDER_CONTENT_SID, content_variables)
+    # Fallback to email with free-form message
+    if os.getenv("EMAIL_SENDER"):
+        message = "Przypomnienia o płatnościach (<3 dni):\n"
+        for inv in urgent_invoices:
+            message += (
+                f"Faktura {inv['invoice_number']}, Sprzedawca: {inv['seller']}, "
+                f"Kwota: {inv['amount']} PLN, Termin: {inv['due_date']} ({inv['days_left']} dni)\n"
+            )
+        send_email_notification("Przypomnienia o Płatnościach", message.strip())
+    logger.info(f"Queued payment reminders for {len(urgent_invoices)} invoices")
+
 def notify_payment_reminders(spreadsheet):
-    """Notify about unpaid invoices due in <3 days using a WhatsApp template."""
+    """Remind about every unpaid invoice due in <3 days, queried from the local replica.
+
+    Sends again on every call; the reminder scheduler (src.reminders) sends
+    each reminder once and is what the pipeline uses.
+    """
     try:
         from src.payments import calculate_days_to_due
-        unpaid_sheet = spreadsheet.worksheet("Faktury Niezapłacone")
-        unpaid_data = unpaid_sheet.get_all_records()
-        content_sid = "HX96688fa611964bde3348ff65389b54df"  # payment_reminder
+        from src.replica import sheet_replica
+        unpaid_data = sheet_replica.invoices(
+            spreadsheet, "Faktury Niezapłacone", due_before=date.today() + timedelta(days=4)
+        )
         urgent_invoices = []
         for row in unpaid_data:
             if row["Opłacona (T/N)"] == "N":
                 days_left, alert = calculate_days_to_due(row["Termin Płatności"])
                 if alert:
-                    invoice_info = {
+                    urgent_invoices.append({
                         "invoice_number": row.get("Numer Faktury", "brak numeru"),
                         "seller": row["Sprzedawca"],
                         "amount": row["Kwota Całkowita (PLN)"],
                         "due_date": row["Termin Płatności"],
                         "days_left": str(days_left)
-                    }
-                    content_variables = {
-                        "1": invoice_info["invoice_number"],
-                        "2": invoice_info["seller"],
-                        "3": invoice_info["amount"],
-                        "4": invoice_info["due_date"],
-                        "5": invoice_info["days_left"]
-                    }
-                    send_whatsapp_notification(content_sid, content_variables)
-                    urgent_invoices.append(invoice_info)
-        # Fallback to email with free-form message
-        if os.getenv("EMAIL_SENDER") and urgent_invoices:
-            message = "Przypomnienia o płatnościach (<3 dni):\n"
-            for inv in urgent_invoices:
-                message += (
-                    f"Faktura {inv['invoice_number']}, Sprzedawca: {inv['seller']}, "
-                    f"Kwota: {inv['amount']} PLN, Termin: {inv['due_date']} ({inv['days_left']} dni)\n"
-                )
-            send_email_notification("Przypomnienia o Płatnościach", message.strip())
-        logger.info(f"Sent payment reminders for {len(urgent_invoices)} invoices")
+                    })
+        send_payment_reminders(urgent_invoices)
     except Exception as e:
-        logger.error(f"Failed to send payment reminders: {e}")
\ No newline at end of file
+        logger.error(f"Failed to send payment reminders: {e}")
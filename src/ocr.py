@@ -1,27 +1,169 @@
 from google.cloud import vision
+import io
 import os
 import logging
+import threading
+import time
+from src.cache import ocr_cache, content_hash
+from src.layout import words_from_annotation, compact_layout
+from src.metrics import instrumented, count_api_call
+from src.config import OCR_MODE, OCR_PREPROCESS, OCR_MAX_DIMENSION, OCR_JPEG_QUALITY, OCR_GRAYSCALE, OCR_UPLINK_BYTES_PER_SEC
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
 
 logger = logging.getLogger(__name__)
 
-def detect_text(image_path):
-    """Extract text from an image using Google Cloud Vision API."""
+# Vision accepts at most 16 images per batch_annotate_images request
+VISION_BATCH_SIZE = 16
+
+_client = None
+_client_lock = threading.Lock()
+
+def _reset_after_fork():
+    global _client, _client_lock
+    _client = None
+    _client_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def get_vision_client():
+    """Return the process-wide Vision client, created on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            os.environ["GRPC_POLL_STRATEGY"] = "poll"
+            _client = vision.ImageAnnotatorClient()
+        return _client
+
+def preprocess_image(content, max_dimension=OCR_MAX_DIMENSION, quality=OCR_JPEG_QUALITY, grayscale=OCR_GRAYSCALE):
+    """Shrink a phone photo before upload: apply EXIF rotation, downscale, grayscale, re-encode as JPEG.
+
+    Returns (bytes, stats). The original bytes are returned unchanged if
+    Pillow is not installed, the image cannot be decoded, or the result
+    would not be smaller.
+    """
+    stats = {"original_bytes": len(content), "bytes": len(content), "bytes_saved": 0, "seconds": 0.0}
+    if Image is None:
+        return content, stats
+    start = time.perf_counter()
     try:
-        os.environ["GRPC_POLL_STRATEGY"] = "poll"
-        client = vision.ImageAnnotatorClient()
-        with open(image_path, "rb") as image_file:
-            content = image_file.read()
-        image = vision.Image(content=content)
-        response = client.text_detection(image=image)
-        if response.error.message:
-            logger.error(f"OCR error: {response.error.message}")
-            return None
-        if not response.text_annotations:
-            logger.warning("No text detected in image")
+        with Image.open(io.BytesIO(content)) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_dimension, max_dimension))
+            image = image.convert("L" if grayscale else "RGB")
+            output = io.BytesIO()
+            image.save(output, format="JPEG", quality=quality, optimize=True)
+        processed = output.getvalue()
+    except Exception as e:
+        logger.warning(f"Image preprocessing failed, sending original: {e}")
+        return content, stats
+    stats["seconds"] = time.perf_counter() - start
+    if len(processed) >= len(content):
+        return content, stats
+    stats["bytes"] = len(processed)
+    stats["bytes_saved"] = len(content) - len(processed)
+    return processed, stats
+
+def _text_from_response(response, image_path, mode="text"):
+    if response.error.message:
+        logger.error(f"OCR error for {image_path}: {response.error.message}")
+        return None
+    if mode == "layout":
+        words = words_from_annotation(response.full_text_annotation)
+        if not words:
+            logger.warning(f"No text detected in image {image_path}")
             return ""
-        text = response.text_annotations[0].description
-        logger.info(f"Extracted text from {image_path}: {text[:100]}...")
+        text = compact_layout(words)
+        logger.info(f"Extracted layout from {image_path}: {len(words)} words, {len(text)} chars")
         return text
+    if not response.text_annotations:
+        logger.warning(f"No text detected in image {image_path}")
+        return ""
+    text = response.text_annotations[0].description
+    logger.info(f"Extracted text from {image_path}: {text[:100]}...")
+    return text
+
+@instrumented("detect_text")
+def detect_text_batch(image_paths, mode=OCR_MODE):
+    """Extract text from several images with batched Google Cloud Vision requests.
+
+    Returns one entry per image, in order: the text, "" if none was found, or
+    None on error. Images already seen (by SHA-256 of their bytes) are served
+    from the cache and left out of the request. In "layout" mode the text is
+    the compact HEADER / ITEMS / TOTALS form rebuilt from word bounding boxes.
+    """
+    results = [None] * len(image_paths)
+    pending = []
+    for i, image_path in enumerate(image_paths):
+        try:
+            with open(image_path, "rb") as image_file:
+                content = image_file.read()
+        except OSError as e:
+            logger.error(f"Failed to read image {image_path}: {e}")
+            continue
+        cache_key = content_hash(content) if mode == "text" else content_hash(content, mode)
+        cached = ocr_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"OCR cache hit for {image_path}")
+            results[i] = cached
+        else:
+            pending.append((i, cache_key, content))
+    if not pending:
+        return results
+    contents = []
+    for i, cache_key, content in pending:
+        if OCR_PREPROCESS:
+            content, stats = preprocess_image(content)
+            upload_saved = stats["bytes_saved"] / OCR_UPLINK_BYTES_PER_SEC
+            logger.info(
+                f"Preprocessed {image_paths[i]}: {stats['original_bytes']} -> {stats['bytes']} bytes, "
+                f"~{upload_saved - stats['seconds']:.2f}s upload time saved"
+            )
+        contents.append(content)
+    texts = annotate_images(contents, [image_paths[i] for i, _, _ in pending], mode)
+    for (i, cache_key, _), text in zip(pending, texts):
+        results[i] = text
+        if text:
+            ocr_cache.set(cache_key, text)
+    return results
+
+def annotate_images(contents, labels=None, mode="text"):
+    """Run Vision text detection on raw image bytes, batching up to VISION_BATCH_SIZE per request.
+
+    mode "text" uses TEXT_DETECTION; "layout" uses DOCUMENT_TEXT_DETECTION and
+    rebuilds table rows from the word geometry. Returns one entry per image:
+    the text, "" if none was found, or None on error.
+    """
+    labels = labels or [f"image {i}" for i in range(len(contents))]
+    texts = [None] * len(contents)
+    feature_type = (
+        vision.Feature.Type.DOCUMENT_TEXT_DETECTION if mode == "layout" else vision.Feature.Type.TEXT_DETECTION
+    )
+    try:
+        client = get_vision_client()
+        for start in range(0, len(contents), VISION_BATCH_SIZE):
+            count_api_call("vision")
+            response = client.batch_annotate_images(requests=[
+                vision.AnnotateImageRequest(
+                    image=vision.Image(content=content),
+                    features=[vision.Feature(type_=feature_type)]
+                )
+                for content in contents[start:start + VISION_BATCH_SIZE]
+            ])
+            for offset, image_response in enumerate(response.responses):
+                texts[start + offset] = _text_from_response(image_response, labels[start + offset], mode)
     except Exception as e:
-        logger.error(f"Failed to process image {image_path}: {e}")
-        return None
\ No newline at end of file
+        logger.error(f"Failed to process images {labels}: {e}")
+    return texts
+
+def detect_text(image_path, mode=OCR_MODE):
+    """Extract text from an image using Google Cloud Vision API.
+
+    Results are cached by the SHA-256 of the image bytes, so a re-sent photo
+    skips the Vision call.
+    """
+    return detect_text_batch([image_path], mode)[0]
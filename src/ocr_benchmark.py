@@ -0,0 +1,67 @@
+import argparse
+import difflib
+import json
+import logging
+import os
+import time
+from src.ocr import annotate_images, preprocess_image, get_vision_client
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+def _timed_ocr(content, label):
+    start = time.perf_counter()
+    text = annotate_images([content], [label])[0]
+    return text or "", time.perf_counter() - start
+
+def benchmark_image(image_path):
+    """OCR one image with and without preprocessing and compare the results."""
+    with open(image_path, "rb") as image_file:
+        original = image_file.read()
+    original_text, original_seconds = _timed_ocr(original, image_path)
+    processed, stats = preprocess_image(original)
+    processed_text, processed_seconds = _timed_ocr(processed, image_path)
+    return {
+        "image": os.path.basename(image_path),
+        "original_bytes": stats["original_bytes"],
+        "processed_bytes": stats["bytes"],
+        "bytes_saved": stats["bytes_saved"],
+        "preprocess_seconds": round(stats["seconds"], 3),
+        "original_ocr_seconds": round(original_seconds, 3),
+        "processed_ocr_seconds": round(processed_seconds, 3),
+        "latency_saved_seconds": round(original_seconds - processed_seconds - stats["seconds"], 3),
+        "text_similarity": round(difflib.SequenceMatcher(None, original_text, processed_text).ratio(), 4)
+    }
+
+def run_benchmark(folder):
+    """Benchmark every image in a folder. Bypasses the OCR cache so both variants hit Vision."""
+    image_paths = sorted(
+        os.path.join(folder, name) for name in os.listdir(folder)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    # Create the client up front so its setup cost is not charged to the first image
+    get_vision_client()
+    results = [benchmark_image(path) for path in image_paths]
+    summary = {
+        "images": len(results),
+        "total_bytes_saved": sum(r["bytes_saved"] for r in results),
+        "total_latency_saved_seconds": round(sum(r["latency_saved_seconds"] for r in results), 3),
+        "min_text_similarity": min((r["text_similarity"] for r in results), default=None),
+        "mean_text_similarity": round(sum(r["text_similarity"] for r in results) / len(results), 4) if results else None
+    }
+    return {"results": results, "summary": summary}
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Compare OCR text and timing with and without image preprocessing.")
+    parser.add_argument("folder", help="Folder of sample invoice images")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+    report = run_benchmark(args.folder)
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
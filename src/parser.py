@@ -1,130 +1,265 @@
 from openai import OpenAI
 import json
 import logging
-from src.config import XAI_API_KEY
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from src.config import XAI_API_KEY, PARSE_MAX_TOKENS, PARSE_CHUNK_ITEMS, PARSE_CHUNK_WORKERS
+from src.cache import parse_cache, content_hash
+from src.templates import parse_with_template, record_llm_latency
+from src.metrics import instrumented, count_api_call
 
 logger = logging.getLogger(__name__)
 
 client = OpenAI(api_key=XAI_API_KEY, base_url="https://api.x.ai/v1")
 
-def parse_invoice_text(text, paid_status):
-    """Parse OCR-extracted text into structured JSON using Grok-3."""
-    prompt = f"""
-    You are an expert at extracting data from Polish invoices. Parse the provided invoice text into a JSON object with the exact structure below. The invoice is in Polish, prices are in PLN, and formats may vary.
-
-    ```json
-    {{
-        "ingredients": [
-            {{
-                "name": "string",
-                "unit": "kg|l|szt|zgrz|kart",
-                "net_price_per_unit": float,
-                "vat_percent": float,
-                "gross_price_per_unit": float,
-                "category": "JEDZENIE|NAPOJE|NAPOJE ALKOHOLOWE|CHEMIA|INNE"
-            }}
-        ],
-        "invoice_date": "DD.MM.YYYY",
-        "due_date": "DD.MM.YYYY",
-        "total": float,
-        "paid": "T|N",
-        "seller": "string",
-        "category": "JEDZENIE|NAPOJE|NAPOJE ALKOHOLOWE|CHEMIA|INNE",
-        "invoice_number": "string"
-    }}
-    ```
-
-    **Input**:
-    - Invoice text: {text}
-    - Paid status: {paid_status} (T for paid, N for unpaid)
-
-    **Instructions**:
-    - **Ingredients**:
-      - Extract each ingredient's name, unit, net price per unit, VAT percent, and gross price per unit.
-      - Assign a category based on the ingredient:
-        - JEDZENIE: Food items (e.g., kukurydza, mięso, makaron, sery).
-        - NAPOJE: Non-alcoholic drinks (e.g., woda, sok, lemoniada).
-        - NAPOJE ALKOHOLOWE: Alcoholic drinks (e.g., piwo, wino, wódka).
-        - CHEMIA: Cleaning products or chemicals.
-        - INNE: Other items (e.g., packaging, services).
-      - Ignore non-ingredient items (e.g., discounts, fees).
-      - Example: "Kukurydza kolby 2,5kg Oerlemans, Cena netto: 10,00 PLN, VAT: 5%" → 
-        {{ "name": "Kukurydza kolby 2,5kg Oerlemans", "unit": "kg", "net_price_per_unit": 10.00, "vat_percent": 5.0, "gross_price_per_unit": 10.50, "category": "JEDZENIE" }}
-    - **Invoice Date**:
-      - Find the issuance date (e.g., "Data wystawienia", "Data sprzedaży", or standalone "10.04.2025").
-      - Use format DD.MM.YYYY. If ambiguous, pick the most likely date.
-    - **Due Date**:
-      - Find the payment due date (e.g., "Termin płatności", "Płatne do", or "Płatność 7 dni").
-      - If "Płatność X dni", calculate as invoice_date + X days.
-      - If missing, assume invoice_date + 7 days.
-      - Use format DD.MM.YYYY.
-    - **Total**:
-      - Extract the total invoice amount (gross, in PLN).
-    - **Paid**:
-      - Use the provided paid_status (T or N).
-    - **Seller**:
-      - Extract the seller's name (e.g., from "Sprzedawca" or header).
-      - If missing, use "Unknown".
-    - **Category**:
-      - Assign based on the dominant ingredient category (most items).
-      - If unclear, use "INNE".
-    - **Invoice Number**:
-      - Find the invoice number (e.g., "Numer faktury", "FV/2025/123", "2025-04-095").
-      - If missing, use empty string ("").
-    - **Rules**:
-      - Return only valid JSON, no additional text or comments.
-      - Skip unclear or incomplete ingredient entries but maintain JSON structure.
-      - Handle Polish characters (e.g., ą, ę, ł) correctly.
-      - If data is missing, use reasonable defaults (e.g., "Unknown" for seller, "" for invoice_number).
-
-    **Example**:
-    Input: "FAKTURA VAT 051/04/2025, Data wystawienia: 10.04.2025, Termin płatności: 17.04.2025, Sprzedawca: ABC Sp. z o.o., Kukurydza kolby 2,5kg Oerlemans, Cena netto: 10,00 PLN, VAT: 5%, Woda 1,5L, Cena netto: 2,00 PLN, VAT: 8%"
-    Output:
-    ```json
-    {{
-        "ingredients": [
-            {{
-                "name": "Kukurydza kolby 2,5kg Oerlemans",
-                "unit": "kg",
-                "net_price_per_unit": 10.00,
-                "vat_percent": 5.0,
-                "gross_price_per_unit": 10.50,
-                "category": "JEDZENIE"
-            }},
-            {{
-                "name": "Woda 1,5L",
-                "unit": "l",
-                "net_price_per_unit": 2.00,
-                "vat_percent": 8.0,
-                "gross_price_per_unit": 2.16,
-                "category": "NAPOJE"
-            }}
-        ],
-        "invoice_date": "10.04.2025",
-        "due_date": "17.04.2025",
-        "total": 12.66,
-        "paid": "T",
-        "seller": "ABC Sp. z o.o.",
-        "category": "JEDZENIE",
-        "invoice_number": "051/04/2025"
-    }}
-    ```
+MODEL = "grok-3-beta"
+
+CATEGORIES = ["JEDZENIE", "NAPOJE", "NAPOJE ALKOHOLOWE", "CHEMIA", "INNE"]
+
+INVOICE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "ingredients": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "unit": {"type": "string", "enum": ["kg", "l", "szt", "zgrz", "kart"]},
+                    "net_price_per_unit": {"type": "number"},
+                    "vat_percent": {"type": "number"},
+                    "gross_price_per_unit": {"type": "number"},
+                    "category": {"type": "string", "enum": CATEGORIES}
+                },
+                "required": ["name", "unit", "net_price_per_unit", "vat_percent", "gross_price_per_unit", "category"],
+                "additionalProperties": False
+            }
+        },
+        "invoice_date": {"type": "string"},
+        "due_date": {"type": "string"},
+        "total": {"type": "number"},
+        "paid": {"type": "string", "enum": ["T", "N"]},
+        "seller": {"type": "string"},
+        "category": {"type": "string", "enum": CATEGORIES},
+        "invoice_number": {"type": "string"}
+    },
+    "required": ["ingredients", "invoice_date", "due_date", "total", "paid", "seller", "category", "invoice_number"],
+    "additionalProperties": False
+}
+
+# Static instructions live in the system message so every request shares the
+# same prefix and can hit the provider's prompt cache; only the user message
+# (invoice text and paid status) changes between calls.
+SYSTEM_PROMPT = """You extract data from Polish invoices (prices in PLN) into the provided JSON schema.
+
+Ingredients:
+- For each item give name, unit, net price per unit, VAT percent and gross price per unit.
+- Category: JEDZENIE (food, e.g. kukurydza, mięso, makaron, sery), NAPOJE (non-alcoholic drinks, e.g. woda, sok), NAPOJE ALKOHOLOWE (piwo, wino, wódka), CHEMIA (cleaning products, chemicals), INNE (packaging, services, other).
+- Ignore non-ingredient lines (discounts, fees). Skip unclear or incomplete items.
+invoice_date: issuance date ("Data wystawienia", "Data sprzedaży" or a standalone date), DD.MM.YYYY; if ambiguous pick the most likely.
+due_date: "Termin płatności" / "Płatne do", DD.MM.YYYY. "Płatność X dni" means invoice_date + X days; if missing use invoice_date + 7 days.
+total: gross invoice total in PLN.
+paid: the paid status given by the user (T or N).
+seller: seller name ("Sprzedawca" or header), "Unknown" if missing.
+category: the category of most ingredients, "INNE" if unclear.
+invoice_number: e.g. "FV/2025/123", "2025-04-095", "" if missing.
+Keep Polish characters (ą, ę, ł) intact.
+The invoice text may be a layout summary with HEADER, ITEMS and TOTALS sections; in ITEMS each line is one table row with columns separated by "|".
+
+Example input: "FAKTURA VAT 051/04/2025, Data wystawienia: 10.04.2025, Termin płatności: 17.04.2025, Sprzedawca: ABC Sp. z o.o., Kukurydza kolby 2,5kg Oerlemans, Cena netto: 10,00 PLN, VAT: 5%, Woda 1,5L, Cena netto: 2,00 PLN, VAT: 8%" (paid: T)
+Example output: {"ingredients":[{"name":"Kukurydza kolby 2,5kg Oerlemans","unit":"kg","net_price_per_unit":10.00,"vat_percent":5.0,"gross_price_per_unit":10.50,"category":"JEDZENIE"},{"name":"Woda 1,5L","unit":"l","net_price_per_unit":2.00,"vat_percent":8.0,"gross_price_per_unit":2.16,"category":"NAPOJE"}],"invoice_date":"10.04.2025","due_date":"17.04.2025","total":12.66,"paid":"T","seller":"ABC Sp. z o.o.","category":"JEDZENIE","invoice_number":"051/04/2025"}"""
+
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "invoice", "strict": True, "schema": INVOICE_SCHEMA}
+}
+
+# Lines from the top and bottom of the invoice sent as the header chunk
+HEADER_CHUNK_LINES = 25
+FOOTER_CHUNK_LINES = 15
+
+# A money amount such as "12,50" or "3.99"
+PRICE_PATTERN = re.compile(r"\d[,.]\d{2}(?![.,]?\d)")
+
+class ResponseTruncated(Exception):
+    """The completion stopped at max_tokens, so its JSON is cut off."""
+
+def normalize_text(text):
+    """Collapse whitespace so trivially different OCR output shares a cache entry."""
+    return " ".join(text.split())
+
+def _log_usage(response):
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", 0) if details else 0
+    logger.info(
+        f"Grok usage: {usage.prompt_tokens} prompt tokens ({cached_tokens or 0} cached), "
+        f"{usage.completion_tokens} output tokens"
+    )
+
+def _complete(user_content):
+    """Run one structured-output completion and return the decoded invoice dict, or None.
+
+    Raises ResponseTruncated when the output hit PARSE_MAX_TOKENS.
     """
     try:
+        count_api_call("xai")
         response = client.chat.completions.create(
-            model="grok-3-beta",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=2000,
+            model=MODEL,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": user_content}
+            ],
+            response_format=RESPONSE_FORMAT,
+            max_tokens=PARSE_MAX_TOKENS,
             temperature=0.2
         )
+        _log_usage(response)
+        if getattr(response.choices[0], "finish_reason", None) == "length":
+            raise ResponseTruncated()
         raw_response = response.choices[0].message.content
         logger.debug(f"Raw Grok response: {raw_response}")
-        parsed_data = json.loads(raw_response)
-        logger.info("Successfully parsed invoice data")
-        return parsed_data
+        return json.loads(raw_response)
+    except ResponseTruncated:
+        logger.warning(f"Grok response hit max_tokens ({PARSE_MAX_TOKENS})")
+        raise
     except json.JSONDecodeError as e:
         logger.error(f"Invalid JSON from Grok: {e}")
         return None
     except Exception as e:
         logger.error(f"Failed to parse invoice: {e}")
-        return None
\ No newline at end of file
+        return None
+
+def count_items(text):
+    """Estimate the line items of an invoice as the number of lines carrying a price."""
+    return sum(1 for line in text.splitlines() if PRICE_PATTERN.search(line))
+
+def _header_text(lines, head, foot):
+    if len(lines) <= head + foot:
+        return "\n".join(lines)
+    return "\n".join(lines[:head] + ["..."] + lines[-foot:])
+
+def split_invoice_text(text, chunk_items=PARSE_CHUNK_ITEMS):
+    """Split a long invoice into one header chunk and line-item chunks of at most chunk_items priced lines."""
+    lines = text.splitlines()
+    header = _header_text(lines, HEADER_CHUNK_LINES, FOOTER_CHUNK_LINES)
+    items, current, priced = [], [], 0
+    for line in lines:
+        if PRICE_PATTERN.search(line):
+            if priced == chunk_items:
+                items.append("\n".join(current))
+                current, priced = [], 0
+            priced += 1
+        current.append(line)
+    if current:
+        items.append("\n".join(current))
+    return header, items
+
+def merge_chunk_results(header_data, item_results):
+    """Combine the header fields with the ingredients of every line-item chunk.
+
+    The line-item chunks cover each line once, so all their ingredients are
+    kept, repeated lines included. The header chunk is asked for an empty
+    ingredients list and anything it returns anyway is ignored: it overlaps
+    the line-item chunks and would add its lines a second time.
+    """
+    merged = dict(header_data)
+    ingredients = [ingredient for result in item_results for ingredient in result.get("ingredients", [])]
+    merged["ingredients"] = ingredients
+    categories = [ingredient["category"] for ingredient in ingredients]
+    if categories:
+        merged["category"] = max(categories, key=categories.count)
+    return merged
+
+def _parse_header(text, paid_status, head=HEADER_CHUNK_LINES, foot=FOOTER_CHUNK_LINES):
+    """Parse the header chunk, sending fewer lines from the top and bottom while the response is truncated."""
+    try:
+        return _complete(
+            f"Paid status: {paid_status}\nBeginning and end of a long invoice. Its ingredients are extracted "
+            f"separately, so return ingredients as an empty list [].\n"
+            f"Invoice text:\n{_header_text(text.splitlines(), head, foot)}"
+        )
+    except ResponseTruncated:
+        if head < 2:
+            logger.error("Header chunk of a long invoice is still truncated")
+            return None
+        logger.info(f"Header chunk was truncated, retrying with {head // 2} + {max(foot // 2, 1)} lines")
+        return _parse_header(text, paid_status, head // 2, max(foot // 2, 1))
+
+def _parse_fragment(chunk, paid_status, label):
+    """Parse the ingredients of one line-item chunk, halving it again while the response is truncated."""
+    try:
+        return _complete(
+            f"Paid status: {paid_status}\nFragment {label} of a long invoice. "
+            f"Extract only the ingredients in this fragment; other fields may be empty or 0.\n"
+            f"Invoice text:\n{chunk}"
+        )
+    except ResponseTruncated:
+        lines = chunk.splitlines()
+        if len(lines) < 2:
+            logger.error(f"Fragment {label} is a single line and still truncated")
+            return None
+        logger.info(f"Fragment {label} was truncated, splitting its {len(lines)} lines in two")
+        half = len(lines) // 2
+        parts = [
+            _parse_fragment("\n".join(lines[:half]), paid_status, f"{label}a"),
+            _parse_fragment("\n".join(lines[half:]), paid_status, f"{label}b")
+        ]
+        if any(part is None for part in parts):
+            return None
+        return {"ingredients": parts[0].get("ingredients", []) + parts[1].get("ingredients", [])}
+
+def _parse_chunked(text, paid_status):
+    _, items = split_invoice_text(text)
+    logger.info(f"Parsing long invoice in {len(items)} line-item chunks")
+    with ThreadPoolExecutor(max_workers=PARSE_CHUNK_WORKERS) as executor:
+        header_future = executor.submit(_parse_header, text, paid_status)
+        results = list(executor.map(
+            lambda numbered: _parse_fragment(numbered[1], paid_status, f"{numbered[0]} of {len(items)}"),
+            enumerate(items, start=1)
+        ))
+        header_data = header_future.result()
+    if header_data is None or any(result is None for result in results):
+        logger.error("Failed to parse one or more invoice chunks")
+        return None
+    return merge_chunk_results(header_data, results)
+
+@instrumented("parse_invoice_text")
+def parse_invoice_text(text, paid_status):
+    """Parse OCR-extracted text into structured JSON using Grok-3.
+
+    Invoices from sellers with a registered template are parsed locally;
+    the LLM is only called when no template matches or its result fails
+    validation. The response is constrained to INVOICE_SCHEMA with
+    structured outputs. Invoices with more than PARSE_CHUNK_ITEMS priced
+    lines, or whose response comes back truncated, are split into a header
+    chunk and line-item chunks parsed concurrently; a truncated chunk is
+    split again. Results are cached by a hash of the normalized text and
+    paid status.
+    """
+    cache_key = content_hash(normalize_text(text), paid_status)
+    cached = parse_cache.get(cache_key)
+    if cached is not None:
+        logger.info("Parse cache hit")
+        return cached
+    parsed_data = parse_with_template(text, paid_status)
+    if parsed_data is not None:
+        parse_cache.set(cache_key, parsed_data)
+        return parsed_data
+    start = time.perf_counter()
+    if count_items(text) > PARSE_CHUNK_ITEMS:
+        parsed_data = _parse_chunked(text, paid_status)
+    else:
+        try:
+            parsed_data = _complete(f"Paid status: {paid_status}\nInvoice text:\n{text}")
+        except ResponseTruncated:
+            parsed_data = _parse_chunked(text, paid_status)
+    record_llm_latency(time.perf_counter() - start)
+    if parsed_data is None:
+        return None
+    logger.info("Successfully parsed invoice data")
+    parse_cache.set(cache_key, parsed_data)
+    return parsed_data
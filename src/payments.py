@@ -1,11 +1,24 @@
 import logging
+import os
+import threading
+from contextlib import contextmanager
 from datetime import datetime
+from src.config import SYNC_LOCK_PATH
 from src.sheets import get_worksheet, get_spreadsheet
-from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_exception_type
-import gspread.exceptions
+from src.reminders import reminder_index
+from src.metrics import instrumented
+from src.sheets_quota import sheets_scheduler
+from src.replica import sheet_replica
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 logger = logging.getLogger(__name__)
 
+_sync_thread_lock = threading.Lock()
+
 def calculate_days_to_due(due_date):
     """Calculate days until due date and return alert if <3 days."""
     try:
@@ -18,74 +31,105 @@ def calculate_days_to_due(due_date):
         logger.error(f"Invalid date format for {due_date}: {e}")
         return None, "Błąd daty"
 
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_fixed(2),
-    retry=retry_if_exception_type(gspread.exceptions.APIError)
-)
+LEDGER_HEADER = [
+    "Data Wystawienia", "Numer Faktury", "Sprzedawca", "Kwota Całkowita (PLN)",
+    "Kategoria", "Termin Płatności", "Opłacona (T/N)", "Dni do Zapłaty"
+]
+
+def _ledger_row(row, days_display):
+    """Format an invoice record as a ledger sheet row."""
+    total_str = str(row["Kwota Całkowita (PLN)"]).replace(",", ".")
+    total_formatted = f"{float(total_str):.2f}".replace(".", ",")
+    return [
+        row["Data Wystawienia"],
+        row.get("Numer Faktury", ""),
+        row["Sprzedawca"],
+        total_formatted,
+        row["Kategoria"],
+        row["Termin Płatności"],
+        row["Opłacona (T/N)"],
+        days_display
+    ]
+
+@contextmanager
+def _sync_lock(path=SYNC_LOCK_PATH):
+    """Hold an exclusive flock on path, so one sync at a time runs on the host."""
+    with _sync_thread_lock:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        with os.fdopen(fd, "r+") as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+@instrumented("sync_invoice_status")
 def sync_invoice_status(spreadsheet):
-    """Synchronize invoices between Faktury Niezapłacone and Faktury Zapłacone."""
+    """Synchronize invoices between Faktury Niezapłacone and Faktury Zapłacone.
+
+    The target state is computed from the local replica, which is read again
+    from Sheets only if the spreadsheet changed since (payments are marked by
+    hand in the sheet, so the revision is always checked first). It is applied
+    with at most one append_rows to the paid sheet and one range update of the
+    unpaid sheet, which is skipped when the cells would not change. Syncs are
+    serialized across processes with a file lock, so two of them never move
+    the same paid invoices. Returns the number of Sheets data API calls made.
+    """
     try:
-        unpaid_sheet = get_worksheet(spreadsheet, "Faktury Niezapłacone")
-        paid_sheet = get_worksheet(spreadsheet, "Faktury Zapłacone")
-        unpaid_data = unpaid_sheet.get_all_records()
-        rows_to_move = []
-        for i, row in enumerate(unpaid_data, start=2):
-            if row["Opłacona (T/N)"] == "T":
-                total_str = str(row["Kwota Całkowita (PLN)"]).replace(",", ".")
-                total_float = float(total_str)
-                total_formatted = f"{total_float:.2f}".replace(".", ",")
-                rows_to_move.append((i, [
-                    row["Data Wystawienia"],
-                    row.get("Numer Faktury", ""),
-                    row["Sprzedawca"],
-                    total_formatted,
-                    row["Kategoria"],
-                    row["Termin Płatności"],
-                    row["Opłacona (T/N)"],
-                    ""
-                ]))
-        for row_idx, row_data in reversed(rows_to_move):
-            paid_sheet.append_row(row_data)
-            unpaid_sheet.delete_rows(row_idx)
-            logger.info(f"Moved invoice {row_data[1]} to Faktury Zapłacone")
-        unpaid_data = unpaid_sheet.get_all_records()
-        updated_rows = []
-        for row in unpaid_data:
-            days_left, alert = calculate_days_to_due(row["Termin Płatności"])
-            days_display = alert if alert else str(days_left) if days_left is not None else "Błąd daty"
-            total_str = str(row["Kwota Całkowita (PLN)"]).replace(",", ".")
-            total_float = float(total_str)
-            total_formatted = f"{total_float:.2f}".replace(".", ",")
-            updated_rows.append([
-                row["Data Wystawienia"],
-                row.get("Numer Faktury", ""),
-                row["Sprzedawca"],
-                total_formatted,
-                row["Kategoria"],
-                row["Termin Płatności"],
-                row["Opłacona (T/N)"],
-                days_display
-            ])
-        sorted_rows = sorted(
-            updated_rows,
-            key=lambda x: (
-                float(x[7]) if x[7].replace(".", "").isdigit() else float("inf"),
-                x[7]
-            )
-        )
-        unpaid_sheet.clear()
-        unpaid_sheet.append_row([
-            "Data Wystawienia", "Numer Faktury", "Sprzedawca", "Kwota Całkowita (PLN)",
-            "Kategoria", "Termin Płatności", "Opłacona (T/N)", "Dni do Zapłaty"
-        ])
-        for row in sorted_rows:
-            unpaid_sheet.append_row(row)
-        logger.info("Synchronized and sorted Faktury Niezapłacone")
+        with _sync_lock():
+            return _sync_invoice_status(spreadsheet)
     except Exception as e:
         logger.error(f"Failed to sync invoice status: {e}")
         raise
 
+def _sync_invoice_status(spreadsheet):
+    unpaid_sheet = get_worksheet(spreadsheet, "Faktury Niezapłacone")
+    paid_sheet = get_worksheet(spreadsheet, "Faktury Zapłacone")
+    revision = sheet_replica.check_revision(spreadsheet, force=True)
+    api_calls = sheet_replica.ensure_fresh(spreadsheet, "Faktury Niezapłacone")
+    values = sheet_replica.values(spreadsheet, "Faktury Niezapłacone")
+    # Compare and rewrite cell strings as the sheet holds them, not numericised records
+    current_rows = [row[:len(LEDGER_HEADER)] for row in values[1:]]
+    unpaid_data = [dict(zip(values[0], row)) for row in values[1:]]
+    rows_to_move = []
+    updated_rows = []
+    for row in unpaid_data:
+        if row["Opłacona (T/N)"] == "T":
+            rows_to_move.append(_ledger_row(row, ""))
+            continue
+        days_left, alert = calculate_days_to_due(row["Termin Płatności"])
+        days_display = alert if alert else str(days_left) if days_left is not None else "Błąd daty"
+        updated_rows.append(_ledger_row(row, days_display))
+    sorted_rows = sorted(
+        updated_rows,
+        key=lambda x: (
+            float(x[7]) if x[7].replace(".", "").isdigit() else float("inf"),
+            x[7]
+        )
+    )
+    reminder_index.replace([
+        row for row in sheet_replica.records(spreadsheet, "Faktury Niezapłacone") if row["Opłacona (T/N)"] != "T"
+    ])
+    if rows_to_move:
+        response = sheets_scheduler.write(paid_sheet, "append_rows", rows_to_move)
+        sheet_replica.record_append("Faktury Zapłacone", response, rows_to_move)
+        api_calls += 1
+        for row_data in rows_to_move:
+            logger.info(f"Moved invoice {row_data[1]} to Faktury Zapłacone")
+    if sorted_rows == current_rows:
+        logger.info("Faktury Niezapłacone already up to date")
+        if rows_to_move:
+            sheet_replica.adopt_revision(spreadsheet, revision)
+        return api_calls
+    # Blank out rows left over from invoices moved to the paid sheet so the
+    # whole sheet is rewritten in one call and is never left empty.
+    blank_rows = [[""] * len(LEDGER_HEADER)] * (len(unpaid_data) - len(sorted_rows))
+    values = [LEDGER_HEADER] + sorted_rows + blank_rows
+    sheets_scheduler.write(unpaid_sheet, "update", range_name=f"A1:H{len(values)}", values=values)
+    sheet_replica.replace("Faktury Niezapłacone", values)
+    sheet_replica.adopt_revision(spreadsheet, revision)
+    api_calls += 1
+    logger.info("Synchronized and sorted Faktury Niezapłacone")
+    return api_calls
+
 def update_payment_status(spreadsheet, invoice_data):
     """Update days to due for a new invoice."""
     try:
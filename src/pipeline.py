@@ -0,0 +1,160 @@
+import os
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from src.config import INVOICES_DIR
+from src.utils import download_media, clean_old_invoices, MediaTooLargeError
+from src.ocr import detect_text_batch
+from src.parser import parse_invoice_text
+from src.sheets import store_invoice_data, get_spreadsheet
+from src.price_changes import detect_price_changes_by_category
+from src.payments import sync_invoice_status
+from src.notifications import notify_price_changes, send_whatsapp_message
+from src.reminders import run_check
+from src.jobs import timed_stage
+from src.cache import content_hash
+from src.dedup import invoice_index
+
+logger = logging.getLogger(__name__)
+
+class StageError(Exception):
+    """A pipeline stage failed; carries the message sent to the invoice sender."""
+
+    def __init__(self, stage, user_message, retryable=True):
+        super().__init__(f"Stage {stage} failed")
+        self.stage = stage
+        self.user_message = user_message
+        self.retryable = retryable
+
+def _download_page(media_url, paid_status, page):
+    filename = download_media(media_url, INVOICES_DIR)
+    base, ext = os.path.splitext(filename)
+    new_filename = f"{base}_p{page}_{paid_status}{ext}" if page else f"{base}_{paid_status}{ext}"
+    os.rename(
+        os.path.join(INVOICES_DIR, filename),
+        os.path.join(INVOICES_DIR, new_filename)
+    )
+    return new_filename
+
+def _download(payload, state):
+    media_urls = payload.get("media_urls") or [payload["media_url"]]
+    try:
+        with ThreadPoolExecutor(max_workers=len(media_urls)) as executor:
+            filenames = list(executor.map(
+                lambda item: _download_page(item[1], payload["paid_status"], item[0]),
+                enumerate(media_urls)
+            ))
+    except MediaTooLargeError as e:
+        logger.error(f"Rejected oversized image: {e}")
+        raise StageError("download", "Obraz faktury jest za duży. Wyślij mniejsze zdjęcie.", retryable=False) from e
+    except Exception as e:
+        logger.error(f"Failed to download or rename image: {e}")
+        raise StageError("download", "Nie udało się pobrać obrazu faktury. Spróbuj ponownie.") from e
+    state["filenames"] = filenames
+    image_hashes = []
+    for filename in filenames:
+        with open(os.path.join(INVOICES_DIR, filename), "rb") as f:
+            image_hashes.append(content_hash(f.read()))
+    state["image_hashes"] = image_hashes
+    # The same photo sent again is caught here, before paying for OCR and parsing
+    state["duplicate"] = invoice_index.find_images(image_hashes)
+
+def _ocr(payload, state):
+    texts = detect_text_batch([os.path.join(INVOICES_DIR, filename) for filename in state["filenames"]])
+    if any(text is None for text in texts) or not any(texts):
+        raise StageError("ocr", "Nie udało się odczytać tekstu z faktury. Spróbuj ponownie.")
+    # Pages are joined in the order they were sent so the invoice is parsed once
+    state["text"] = "\n\n".join(text for text in texts if text)
+
+def _parse(payload, state):
+    parsed_data = parse_invoice_text(state["text"], payload["paid_status"])
+    if not parsed_data:
+        raise StageError("parse", "Nie udało się sparsować danych faktury. Sprawdź jakość lub format obrazu.")
+    state["parsed_data"] = parsed_data
+    try:
+        invoice_index.ensure_loaded(get_spreadsheet())
+    except Exception as e:
+        logger.error(f"Failed to load the ledgers into the dedup index: {e}")
+    state["duplicate"] = invoice_index.claim(parsed_data, state["owner"])
+
+def _store(payload, state):
+    try:
+        store_invoice_data(state["parsed_data"])
+        invoice_index.record_images(state["parsed_data"], state.get("image_hashes"))
+    except Exception as e:
+        logger.error(f"Failed to store data: {e}")
+        raise StageError("store", "Nie udało się zapisać danych faktury. Spróbuj ponownie później.") from e
+
+def _price_changes(payload, state):
+    try:
+        spreadsheet = get_spreadsheet()
+        price_changes_by_category = detect_price_changes_by_category(
+            spreadsheet, state["parsed_data"]["ingredients"], state["parsed_data"].get("invoice_date")
+        )
+        notify_price_changes(price_changes_by_category)
+    except Exception as e:
+        logger.error(f"Failed to detect price changes: {e}")
+
+def _sync(payload, state):
+    try:
+        spreadsheet = get_spreadsheet()
+        sync_invoice_status(spreadsheet)
+        run_check(spreadsheet)
+    except Exception as e:
+        logger.error(f"Failed to sync invoices or send reminders: {e}")
+        raise StageError(
+            "sync",
+            "Nie udało się zsynchronizować faktur lub wysłać przypomnień. Spróbuj ponownie później."
+        ) from e
+
+STAGES = [
+    ("download", _download),
+    ("ocr", _ocr),
+    ("parse", _parse),
+    # Compare against the prices on record before store overwrites them
+    ("price_changes", _price_changes),
+    ("store", _store),
+    ("sync", _sync),
+]
+
+def process_invoice_job(job, checkpoint):
+    """Run a queued invoice through every pipeline stage, skipping stages finished on earlier attempts."""
+    payload = job["payload"]
+    state = job["state"]
+    done = state.setdefault("done", [])
+    state.setdefault("owner", f"job:{job['id']}")
+    for stage, run in STAGES:
+        if state.get("duplicate"):
+            break
+        if stage in done:
+            continue
+        with timed_stage(stage):
+            run(payload, state)
+        done.append(stage)
+        checkpoint()
+
+    clean_old_invoices(INVOICES_DIR, days=30)
+    duplicate = state.get("duplicate")
+    if duplicate:
+        send_whatsapp_message(
+            f"Ta faktura została już zapisana (Numer: {duplicate['invoice_number'] or 'brak numeru'}, "
+            f"Sprzedawca: {duplicate['seller']}). Pominięto ją.",
+            payload["from_number"]
+        )
+        logger.info(f"Skipped duplicate invoice {duplicate['invoice_number']} from {duplicate['seller']}")
+        return
+    parsed_data = state["parsed_data"]
+    send_whatsapp_message(
+        f"Przetworzono fakturę: {', '.join(state['filenames'])} (Opłacona: {'Tak' if payload['paid_status'] == 'T' else 'Nie'}). "
+        f"Zapisano {len(parsed_data['ingredients'])} składników.",
+        payload["from_number"]
+    )
+    logger.info(f"Processed and stored invoice: {json.dumps(parsed_data, ensure_ascii=False)}")
+
+def notify_job_failure(job, error):
+    """Tell the sender why their invoice could not be processed once retries are exhausted."""
+    message = getattr(error, "user_message", "Nie udało się przetworzyć faktury. Spróbuj ponownie później.")
+    if "store" not in job["state"].get("done", []):
+        # Never stored, so a resend of this invoice must not count as a duplicate
+        invoice_index.release(job["state"].get("owner", f"job:{job['id']}"))
+    send_whatsapp_message(message, job["payload"]["from_number"])
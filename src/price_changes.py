@@ -1,44 +1,37 @@
 import logging
-from src.sheets import get_worksheet
-from src.config import get_spreadsheet
+from concurrent.futures import ThreadPoolExecutor
+from src.config import PRICE_CHANGE_WORKERS, PRICE_CHANGE_THRESHOLD
+from src.sheets import get_worksheet, canonicalize_ingredients, CATEGORY_SHEETS
+from src.price_index import price_index
+from src.price_history import detect_price_trends
+from src.metrics import instrumented
 
 logger = logging.getLogger(__name__)
 
+@instrumented("detect_price_changes")
 def detect_price_changes(spreadsheet, ingredients, category):
-    """Detect price changes (>5%) for ingredients in a category."""
+    """Detect price changes (>PRICE_CHANGE_THRESHOLD %) for ingredients in a category."""
     try:
         worksheet = get_worksheet(spreadsheet, category)
-        sheet_data = worksheet.get_all_records()
-        formatted_sheet_data = []
-        for record in sheet_data:
-            try:
-                net_price = float(str(record["Cena netto (za JM)"]).replace(",", "."))
-                formatted_record = {
-                    "Składnik": record["Składnik"],
-                    "Cena netto (za JM)": round(net_price, 2)
-                }
-                formatted_sheet_data.append(formatted_record)
-            except (ValueError, KeyError) as e:
-                logger.warning(f"Skipping invalid record in {category}: {e}")
-                continue
+        entries = price_index.get(worksheet)
 
         price_changes = []
         for ingredient in ingredients:
             new_price = ingredient["net_price_per_unit"]
             ingredient_name = ingredient["name"]
-            for record in formatted_sheet_data:
-                if record["Składnik"] == ingredient_name:
-                    old_price = record["Cena netto (za JM)"]
-                    if old_price > 0:
-                        change_percent = ((new_price - old_price) / old_price) * 100
-                        if abs(change_percent) > 5:
-                            price_changes.append({
-                                "name": ingredient_name,
-                                "old_price": round(old_price, 2),
-                                "new_price": round(new_price, 2),
-                                "change_percent": round(change_percent, 2)
-                            })
-                    break
+            entry = entries.get(ingredient_name)
+            if entry is None or entry["price"] is None:
+                continue
+            old_price = round(entry["price"], 2)
+            if old_price > 0:
+                change_percent = ((new_price - old_price) / old_price) * 100
+                if abs(change_percent) > PRICE_CHANGE_THRESHOLD:
+                    price_changes.append({
+                        "name": ingredient_name,
+                        "old_price": round(old_price, 2),
+                        "new_price": round(new_price, 2),
+                        "change_percent": round(change_percent, 2)
+                    })
 
         if price_changes:
             logger.info(f"Price changes in {category}: {price_changes}")
@@ -47,4 +40,35 @@ def detect_price_changes(spreadsheet, ingredients, category):
         return price_changes
     except Exception as e:
         logger.error(f"Failed to detect price changes in {category}: {e}")
-        return []
\ No newline at end of file
+        return []
+
+def detect_price_changes_by_category(spreadsheet, ingredients, invoice_date=None):
+    """Detect price changes for every category of an invoice concurrently.
+
+    Categories are checked on a bounded thread pool sharing one spreadsheet
+    handle. Gradual creep found in the local price history is added for
+    ingredients not flagged by their last change. The result maps category
+    to changes in CATEGORY_SHEETS order and leaves out categories without
+    changes.
+    """
+    by_category = {}
+    for ingredient in canonicalize_ingredients(spreadsheet, ingredients):
+        if ingredient["category"] in CATEGORY_SHEETS:
+            by_category.setdefault(ingredient["category"], []).append(ingredient)
+    categories = [category for category in CATEGORY_SHEETS if category in by_category]
+    if not categories:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(PRICE_CHANGE_WORKERS, len(categories))) as executor:
+        results = dict(zip(categories, executor.map(
+            lambda category: detect_price_changes(spreadsheet, by_category[category], category),
+            categories
+        )))
+    try:
+        trends = detect_price_trends([ing for category in categories for ing in by_category[category]], invoice_date)
+    except Exception as e:
+        logger.error(f"Failed to detect price trends: {e}")
+        trends = {}
+    for category, category_trends in trends.items():
+        flagged = {change["name"] for change in results[category]}
+        results[category] += [trend for trend in category_trends if trend["name"] not in flagged]
+    return {category: results[category] for category in categories if results[category]}
@@ -0,0 +1,216 @@
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, date
+import numpy as np
+from src.config import (
+    PRICE_HISTORY_DB_PATH, PRICE_HISTORY_WINDOW, PRICE_TREND_DAYS, PRICE_TREND_THRESHOLD, PRICE_CHANGE_THRESHOLD
+)
+
+logger = logging.getLogger(__name__)
+
+EPOCH = date(1970, 1, 1)
+
+def to_day(invoice_date):
+    """Convert a DD.MM.YYYY date to days since the epoch (today if it cannot be parsed)."""
+    try:
+        return (datetime.strptime(invoice_date, "%d.%m.%Y").date() - EPOCH).days
+    except (TypeError, ValueError):
+        return (date.today() - EPOCH).days
+
+class PriceHistory:
+    """SQLite log of ingredient net prices, one row per ingredient, day and seller."""
+
+    def __init__(self, db_path=PRICE_HISTORY_DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS price_history (
+                    category TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    day INTEGER NOT NULL,
+                    price REAL NOT NULL,
+                    seller TEXT NOT NULL DEFAULT '',
+                    UNIQUE (category, name, day, seller)
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS trend_alerts (
+                    category TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    day INTEGER NOT NULL,
+                    price REAL NOT NULL,
+                    PRIMARY KEY (category, name)
+                )
+            """)
+            self._pid = os.getpid()
+        return self._conn
+
+    def record_invoice(self, invoice_data):
+        """Record the invoice's ingredient prices; re-recording an invoice keeps its latest (corrected) prices."""
+        day = to_day(invoice_data.get("invoice_date"))
+        rows = [
+            (ingredient["category"], ingredient["name"], day, float(ingredient["net_price_per_unit"]),
+             invoice_data.get("seller", ""))
+            for ingredient in invoice_data["ingredients"]
+        ]
+        with self._lock:
+            self._connection().executemany(
+                "INSERT OR REPLACE INTO price_history (category, name, day, price, seller) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+        logger.debug(f"Recorded {len(rows)} prices in price history")
+
+    def load_matrix(self, keys, window=PRICE_HISTORY_WINDOW, until=None):
+        """Return (prices, days) arrays of shape (len(keys), window) for (category, name) keys.
+
+        Each row holds the ingredient's last `window` observations up to day
+        `until` (all of them if None), oldest to newest and right-aligned,
+        padded with NaN.
+        """
+        prices = np.full((len(keys), window), np.nan)
+        days = np.full((len(keys), window), np.nan)
+        if not keys:
+            return prices, days
+        with self._lock:
+            conn = self._connection()
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS wanted (idx INTEGER, category TEXT, name TEXT)")
+            conn.execute("DELETE FROM wanted")
+            conn.executemany("INSERT INTO wanted VALUES (?, ?, ?)", [(i, c, n) for i, (c, n) in enumerate(keys)])
+            rows = conn.execute("""
+                SELECT idx, rn, day, price FROM (
+                    SELECT w.idx AS idx, h.day AS day, h.price AS price,
+                           ROW_NUMBER() OVER (PARTITION BY w.idx ORDER BY h.day DESC, h.rowid DESC) AS rn
+                    FROM wanted w JOIN price_history h ON h.category = w.category AND h.name = w.name
+                    WHERE ? IS NULL OR h.day <= ?
+                ) WHERE rn <= ?
+            """, (until, until, window)).fetchall()
+        if rows:
+            data = np.array(rows, dtype=float)
+            idx = data[:, 0].astype(int)
+            col = window - data[:, 1].astype(int)
+            days[idx, col] = data[:, 2]
+            prices[idx, col] = data[:, 3]
+        return prices, days
+
+    def load_alerts(self, keys):
+        """Return (prices, days) arrays with the last trend alert of each (category, name) key, NaN if none."""
+        prices = np.full(len(keys), np.nan)
+        days = np.full(len(keys), np.nan)
+        if not keys:
+            return prices, days
+        with self._lock:
+            conn = self._connection()
+            for i, (category, name) in enumerate(keys):
+                row = conn.execute(
+                    "SELECT day, price FROM trend_alerts WHERE category = ? AND name = ?", (category, name)
+                ).fetchone()
+                if row:
+                    days[i], prices[i] = row
+        return prices, days
+
+    def record_alerts(self, alerts):
+        """Remember the (category, name, day, price) of trend alerts so creep is measured from there next time."""
+        with self._lock:
+            self._connection().executemany(
+                "INSERT OR REPLACE INTO trend_alerts (category, name, day, price) VALUES (?, ?, ?, ?)", alerts
+            )
+
+def analyze_prices(new_prices, prices, days, today, trend_days=PRICE_TREND_DAYS, step_threshold=PRICE_CHANGE_THRESHOLD,
+                   alert_prices=None, alert_days=None):
+    """Vectorized price statistics for a whole invoice.
+
+    new_prices has one entry per row of the (n, window) history matrices.
+    Returns a dict of arrays: last price, delta vs last (%), rolling median,
+    baseline and cumulative change vs it (%). The baseline is the oldest
+    price within trend_days, moved forward to the price right after the last
+    step of at least step_threshold (that jump was alerted on its own) and
+    to the price of the last trend alert, so only gradual creep since then
+    counts. Observations dated after today (an older invoice processed
+    late) are ignored. Entries without history are NaN.
+    """
+    new_prices = np.asarray(new_prices, dtype=float)
+    n, window = prices.shape
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # Drop future observations and right-align the rest again; the stable sort keeps their order
+        past = days <= today
+        order = np.argsort(past, axis=1, kind="stable")
+        prices = np.take_along_axis(np.where(past, prices, np.nan), order, axis=1)
+        days = np.take_along_axis(np.where(past, days, np.nan), order, axis=1)
+        last = prices[:, -1]
+        # Ingredients without history are all-NaN rows; nanmedian would warn on them
+        # (and warnings.catch_warnings is not thread-safe)
+        has_history = ~np.isnan(prices).all(axis=1)
+        median = np.full(n, np.nan)
+        median[has_history] = np.nanmedian(prices[has_history], axis=1)
+        # The new price is the last point of each series
+        series = np.column_stack([prices, new_prices])
+        series_days = np.column_stack([days, np.full(n, today)])
+        in_window = (series_days >= today - trend_days) & ~np.isnan(series)
+        jumps = np.zeros_like(in_window)
+        jumps[:, 1:] = np.abs(np.diff(series, axis=1)) / series[:, :-1] * 100 >= step_threshold
+        starts = in_window & (jumps | (np.cumsum(in_window, axis=1) == 1))
+        # The new price is always in the window, so every row has a start
+        start = window - np.argmax(starts[:, ::-1], axis=1)
+        baseline = series[np.arange(n), start]
+        baseline_day = series_days[np.arange(n), start]
+        if alert_prices is not None:
+            use_alert = (alert_days >= baseline_day) & (alert_days >= today - trend_days) & (alert_days <= today)
+            baseline = np.where(use_alert, alert_prices, baseline)
+        baseline = np.where(has_history, baseline, np.nan)
+        return {
+            "last": last,
+            "delta_percent": (new_prices - last) / last * 100,
+            "median": median,
+            "baseline": baseline,
+            "cumulative_percent": (new_prices - baseline) / baseline * 100
+        }
+
+def detect_price_trends(ingredients, invoice_date=None, history=None, threshold=PRICE_TREND_THRESHOLD,
+                        trend_days=PRICE_TREND_DAYS, step_threshold=PRICE_CHANGE_THRESHOLD):
+    """Find gradual price creep over the trend_days before the invoice.
+
+    Creep is the cumulative change above threshold made of steps that each
+    stayed below step_threshold, measured from the last jump or the last
+    trend alert, so a one-off jump is never re-reported as a trend and an
+    alerted trend is not repeated on every invoice. Returns {category:
+    [change, ...]} in the same shape as detect_price_changes, with
+    "trend_days" set on each change. Runs as one array operation over every
+    ingredient of the invoice.
+    """
+    history = history or price_history
+    if not ingredients:
+        return {}
+    keys = [(ingredient["category"], ingredient["name"]) for ingredient in ingredients]
+    today = to_day(invoice_date)
+    prices, days = history.load_matrix(keys, until=today)
+    alert_prices, alert_days = history.load_alerts(keys)
+    stats = analyze_prices(
+        [ingredient["net_price_per_unit"] for ingredient in ingredients],
+        prices, days, today, trend_days, step_threshold, alert_prices, alert_days
+    )
+    flagged = np.flatnonzero(np.abs(np.nan_to_num(stats["cumulative_percent"])) > threshold)
+    trends = {}
+    for i in flagged:
+        ingredient = ingredients[i]
+        trends.setdefault(ingredient["category"], []).append({
+            "name": ingredient["name"],
+            "old_price": round(float(stats["baseline"][i]), 2),
+            "new_price": round(ingredient["net_price_per_unit"], 2),
+            "change_percent": round(float(stats["cumulative_percent"][i]), 2),
+            "median_price": round(float(stats["median"][i]), 2),
+            "trend_days": trend_days
+        })
+    if len(flagged):
+        history.record_alerts([keys[i] + (today, float(ingredients[i]["net_price_per_unit"])) for i in flagged])
+    return trends
+
+price_history = PriceHistory()
@@ -0,0 +1,106 @@
+import logging
+import threading
+from src.fuzzy import NameIndex
+from src.replica import sheet_replica
+
+logger = logging.getLogger(__name__)
+
+def parse_price(value):
+    """Convert a sheet price such as "10,50" to a float, or None if it is not a number."""
+    try:
+        return float(str(value).replace(",", "."))
+    except ValueError:
+        return None
+
+def _entry(row_number, values):
+    # Columns follow ingredient_row(): date, name, unit, net, VAT, gross, seller
+    return {
+        "row": row_number,
+        "price": parse_price(values[3]) if len(values) > 3 else None,
+        "unit": values[2] if len(values) > 2 else "",
+        "seller": values[6] if len(values) > 6 else ""
+    }
+
+class PriceIndex:
+    """Per-category index of ingredient rows keyed by name.
+
+    Each entry holds the sheet row number, last net price, unit and seller.
+    A category is built from the local sheet replica. Rows this process
+    writes are applied to the index in place through record(); it is
+    rebuilt only when the replica's copy changed some other way (a reload
+    or another process's write).
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._categories = {}
+
+    def load_if_needed(self, worksheet):
+        """Build a category index unless the cached one is current. Returns the number of API calls made."""
+        api_calls = sheet_replica.ensure_fresh(worksheet.spreadsheet, worksheet.title)
+        version = sheet_replica.version(worksheet.title)
+        with self._lock:
+            cached = self._categories.get(worksheet.title)
+            if cached and cached["version"] == version:
+                return api_calls
+        entries = {}
+        for i, record in sheet_replica.rows(worksheet.spreadsheet, worksheet.title):
+            try:
+                name = record["Składnik"]
+            except KeyError as e:
+                logger.warning(f"Skipping invalid record in {worksheet.title}: {e}")
+                continue
+            entries.setdefault(name, _entry(i, list(record.values())))
+        with self._lock:
+            self._categories[worksheet.title] = {
+                "entries": entries,
+                "names": NameIndex(entries),
+                "version": version
+            }
+        logger.debug(f"Built price index for {worksheet.title}: {len(entries)} ingredients")
+        return api_calls
+
+    def record(self, title, rows_by_number):
+        """Apply rows this process just wrote through to the replica ({row_number: values}).
+
+        The index is updated in place when that write is the only change to
+        the replica since the index was built; otherwise it is dropped and
+        rebuilt on next use.
+        """
+        version = sheet_replica.version(title)
+        with self._lock:
+            cached = self._categories.get(title)
+            if cached is None:
+                return
+            if not rows_by_number or version is None or version != cached["version"] + 1:
+                del self._categories[title]
+                return
+            entries = cached["entries"]
+            for i, values in rows_by_number.items():
+                name = values[1]
+                if name in entries and entries[name]["row"] != i:
+                    continue
+                entries[name] = _entry(i, values)
+                cached["names"].add(name)
+            cached["version"] = version
+
+    def get(self, worksheet):
+        """Return the name -> entry mapping for a category sheet, loading it if needed."""
+        self.load_if_needed(worksheet)
+        with self._lock:
+            return self._categories[worksheet.title]["entries"]
+
+    def canonical_name(self, worksheet, name):
+        """Return the name already on the sheet that name refers to (fuzzy match), or name itself."""
+        self.load_if_needed(worksheet)
+        with self._lock:
+            category = self._categories[worksheet.title]
+            if name in category["entries"]:
+                return name
+            match, score = category["names"].match(name)
+        if match is None:
+            return name
+        logger.info(f"Matched ingredient '{name}' to '{match}' in {worksheet.title} (score {score:.2f})")
+        return match
+
+price_index = PriceIndex()
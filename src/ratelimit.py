@@ -0,0 +1,100 @@
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens=1):
+        """Block until `tokens` are available and take them. Returns the time spent waiting."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                delay = (tokens - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+class SharedTokenBucket:
+    """Token bucket kept in a small JSON file, so every process on the host draws from one budget.
+
+    The file is locked with flock for each update; where fcntl is not
+    available the bucket is only shared between the threads of one process.
+    block() empties the bucket and holds every process off until a deadline,
+    e.g. when the API answered 429.
+    """
+
+    def __init__(self, path, rate, capacity=None):
+        self.path = path
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self._lock = threading.Lock()
+
+    def _update(self, change):
+        """Apply change(state, now) to the stored state under the file lock and return its result."""
+        with self._lock:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            with os.fdopen(fd, "r+", encoding="utf-8") as f:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    state = json.loads(f.read() or "{}")
+                except ValueError:
+                    state = {}
+                now = time.time()
+                tokens = state.get("tokens", self.capacity)
+                elapsed = max(0.0, now - max(state.get("updated", now), state.get("blocked_until", 0)))
+                state["tokens"] = min(self.capacity, tokens + elapsed * self.rate)
+                state["updated"] = now
+                result = change(state, now)
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                return result
+
+    def acquire(self, tokens=1):
+        """Block until `tokens` are available and take them. Returns the time spent waiting."""
+        def take(state, now):
+            if now < state.get("blocked_until", 0):
+                return state["blocked_until"] - now + tokens / self.rate
+            if state["tokens"] >= tokens:
+                state["tokens"] -= tokens
+                return 0.0
+            return (tokens - state["tokens"]) / self.rate
+
+        waited = 0.0
+        while True:
+            delay = self._update(take)
+            if not delay:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+    def block(self, seconds):
+        """Take every token and stop all processes from acquiring for `seconds`."""
+        def hold(state, now):
+            state["tokens"] = 0.0
+            state["blocked_until"] = max(state.get("blocked_until", 0), now + seconds)
+
+        self._update(hold)
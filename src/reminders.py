@@ -0,0 +1,200 @@
+import argparse
+import heapq
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, date
+from src.config import JOBS_DB_PATH, REMINDER_THRESHOLDS, REMINDER_CHECK_INTERVAL, REMINDER_REFRESH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+def invoice_key(record):
+    """Identify an unpaid-ledger row by seller, invoice number and due date."""
+    return f"{record.get('Sprzedawca', '')}|{record.get('Numer Faktury', '')}|{record.get('Termin Płatności', '')}"
+
+class ReminderIndex:
+    """Min-heap of upcoming reminder events for unpaid invoices, keyed by the day they fire.
+
+    Each unpaid invoice contributes one event per threshold (days before its
+    due date). Due dates are parsed once, when an invoice enters the index;
+    checking for due reminders only pops events that have fired, so a check
+    costs O(log n) per event instead of a sheet download. Removed or changed
+    invoices leave stale heap entries that are skipped when popped. Sent
+    reminders are recorded in SQLite so each threshold fires once per invoice,
+    across restarts and worker processes.
+    """
+
+    def __init__(self, db_path=JOBS_DB_PATH, thresholds=REMINDER_THRESHOLDS):
+        self.db_path = db_path
+        self.thresholds = sorted(thresholds, reverse=True)
+        self.loaded_at = None
+        self._invoices = {}
+        self._heap = []
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def __len__(self):
+        return len(self._invoices)
+
+    def _connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS reminders_sent (
+                    invoice_key TEXT NOT NULL,
+                    threshold INTEGER NOT NULL,
+                    sent_at REAL NOT NULL,
+                    PRIMARY KEY (invoice_key, threshold)
+                )
+            """)
+            self._pid = os.getpid()
+        return self._conn
+
+    def _add(self, record):
+        try:
+            due_day = datetime.strptime(str(record["Termin Płatności"]), "%d.%m.%Y").date().toordinal()
+        except (KeyError, ValueError):
+            logger.warning(f"Skipping reminder for invoice with invalid due date: {record.get('Termin Płatności')}")
+            return
+        key = invoice_key(record)
+        self._invoices[key] = {
+            "invoice_number": record.get("Numer Faktury") or "brak numeru",
+            "seller": record.get("Sprzedawca", ""),
+            "amount": record.get("Kwota Całkowita (PLN)", ""),
+            "due_date": record["Termin Płatności"],
+            "due_day": due_day
+        }
+        for threshold in self.thresholds:
+            heapq.heappush(self._heap, (due_day - threshold, due_day, key))
+
+    def add(self, record):
+        """Index a newly stored unpaid invoice (a row dict with the ledger column names)."""
+        with self._lock:
+            self._add(record)
+
+    def replace(self, records):
+        """Make the index match the given unpaid rows, touching only invoices that changed."""
+        records = {invoice_key(record): record for record in records if record.get("Opłacona (T/N)", "N") != "T"}
+        with self._lock:
+            for key in set(self._invoices) - set(records):
+                del self._invoices[key]
+            for key, record in records.items():
+                if key not in self._invoices:
+                    self._add(record)
+            # Drop stale entries once they outnumber live ones
+            if len(self._heap) > 2 * len(self.thresholds) * max(len(self._invoices), 1):
+                self._heap = [entry for entry in self._heap if self._is_live(entry)]
+                heapq.heapify(self._heap)
+            self.loaded_at = time.time()
+
+    def load(self, spreadsheet):
+        """Rebuild the index from Faktury Niezapłacone in the local replica (a read only if it is stale)."""
+        from src.replica import sheet_replica
+        records = sheet_replica.records(spreadsheet, "Faktury Niezapłacone")
+        self.replace(records)
+        logger.info(f"Loaded {len(self)} unpaid invoices into the reminder index")
+
+    def _is_live(self, entry):
+        invoice = self._invoices.get(entry[2])
+        return invoice is not None and invoice["due_day"] == entry[1]
+
+    def _claim(self, key, thresholds):
+        """Mark thresholds as sent; True if any of them had not been sent yet.
+
+        One transaction, so of two processes popping the same event only one
+        sees a threshold it claimed.
+        """
+        now = time.time()
+        conn = self._connection()
+        claimed = 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for threshold in thresholds:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO reminders_sent (invoice_key, threshold, sent_at) VALUES (?, ?, ?)",
+                    (key, threshold, now)
+                )
+                claimed += cursor.rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return claimed > 0
+
+    def pop_due(self, today=None):
+        """Return the invoices whose reminder fires today, each at most once per threshold.
+
+        When several thresholds were crossed since the last check only one
+        reminder goes out; overdue invoices are marked but not reminded.
+        """
+        today = (today or date.today()).toordinal()
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= today:
+                entry = heapq.heappop(self._heap)
+                if not self._is_live(entry):
+                    continue
+                invoice = self._invoices[entry[2]]
+                days_left = invoice["due_day"] - today
+                crossed = [threshold for threshold in self.thresholds if threshold >= days_left]
+                if self._claim(entry[2], crossed) and days_left >= 0:
+                    due.append(dict(invoice, days_left=str(days_left)))
+        return due
+
+reminder_index = ReminderIndex()
+
+def run_check(spreadsheet=None):
+    """Send the reminders that are due now. Loads the index first if it is empty or old."""
+    from src.notifications import send_payment_reminders
+    if reminder_index.loaded_at is None or time.time() - reminder_index.loaded_at > REMINDER_REFRESH_INTERVAL:
+        from src.sheets import get_spreadsheet
+        reminder_index.load(spreadsheet or get_spreadsheet())
+    due = reminder_index.pop_due()
+    if due:
+        send_payment_reminders(due)
+    return due
+
+_scheduler = None
+_scheduler_pid = None
+_scheduler_lock = threading.Lock()
+
+def _scheduler_loop(interval):
+    while True:
+        try:
+            run_check()
+        except Exception as e:
+            logger.error(f"Payment reminder check failed: {e}")
+        time.sleep(interval)
+
+def ensure_scheduler(interval=REMINDER_CHECK_INTERVAL):
+    """Start the reminder daemon thread for this process if it is not running yet."""
+    global _scheduler, _scheduler_pid
+    with _scheduler_lock:
+        if _scheduler is None or _scheduler_pid != os.getpid() or not _scheduler.is_alive():
+            _scheduler = threading.Thread(target=_scheduler_loop, args=(interval,), name="payment-reminders", daemon=True)
+            _scheduler_pid = os.getpid()
+            _scheduler.start()
+        return _scheduler
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Send payment reminders for unpaid invoices close to their due date.")
+    parser.add_argument("--daemon", action="store_true", help="Keep running and check every --interval seconds")
+    parser.add_argument("--interval", type=float, default=REMINDER_CHECK_INTERVAL, help="Seconds between checks")
+    args = parser.parse_args()
+    if args.daemon:
+        _scheduler_loop(args.interval)
+    else:
+        sent = run_check()
+        # Let the dispatcher and email threads drain before exiting
+        from src.dispatcher import get_outbox
+        from src.mailer import email_sender
+        deadline = time.time() + 60
+        while sent and time.time() < deadline and set(get_outbox().depth()) & {"queued", "running"}:
+            time.sleep(0.5)
+        email_sender.flush()
+        print(f"Sent reminders for {len(sent)} invoices")
@@ -0,0 +1,304 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from src.config import REPLICA_DB_PATH, REPLICA_CHECK_INTERVAL, REPLICA_MAX_AGE
+from src.metrics import count_api_call
+
+logger = logging.getLogger(__name__)
+
+def spreadsheet_revision(spreadsheet):
+    """Return the spreadsheet's last modification time from Drive, or None if unavailable."""
+    try:
+        getter = getattr(spreadsheet, "get_lastUpdateTime", None)
+        count_api_call("drive")
+        return getter() if getter else spreadsheet.lastUpdateTime
+    except Exception as e:
+        logger.warning(f"Failed to read spreadsheet revision: {e}")
+        return None
+
+def _numericise(value):
+    """Convert a cell the way get_all_records does ("5" -> 5, "10,50" stays a string)."""
+    if isinstance(value, str) and "_" not in value:
+        for cast in (int, float):
+            try:
+                return cast(value)
+            except ValueError:
+                pass
+    return value
+
+def _to_record(header, row):
+    return {column: _numericise(str(row[i])) if i < len(row) else "" for i, column in enumerate(header)}
+
+def _iso_day(value):
+    try:
+        return datetime.strptime(str(value), "%d.%m.%Y").date().isoformat()
+    except ValueError:
+        return None
+
+class SheetReplica:
+    """SQLite mirror of the category sheets and the invoice ledgers.
+
+    Each sheet is downloaded with one get_all_values the first time it is
+    read and again only when the spreadsheet's Drive revision moved past the
+    one it was loaded at (checked at most once per check_interval) or it is
+    older than max_age. Writes made by this app are applied to the mirror as
+    well, and adopt_revision() then marks the mirror current, so our own
+    writes do not force a reload. Rows are kept with their sheet row number
+    and indexed by ingredient name, seller and due date. The database file is
+    shared by every process on the host; version(title) changes whenever a
+    sheet's rows do, so in-memory indexes built on top know when to rebuild.
+    """
+
+    def __init__(self, db_path=REPLICA_DB_PATH, check_interval=REPLICA_CHECK_INTERVAL, max_age=REPLICA_MAX_AGE):
+        self.db_path = db_path
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._conn = None
+        self._pid = None
+        self._revision = None
+        self._checked_at = 0.0
+
+    def _connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS sheets (
+                    title TEXT PRIMARY KEY,
+                    header TEXT NOT NULL,
+                    revision TEXT,
+                    loaded_at REAL NOT NULL,
+                    version INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS sheet_rows (
+                    title TEXT NOT NULL,
+                    row_number INTEGER NOT NULL,
+                    name TEXT,
+                    seller TEXT,
+                    due_date TEXT,
+                    record TEXT NOT NULL,
+                    cells TEXT NOT NULL DEFAULT '[]',
+                    PRIMARY KEY (title, row_number)
+                );
+                CREATE INDEX IF NOT EXISTS sheet_rows_name ON sheet_rows (name);
+                CREATE INDEX IF NOT EXISTS sheet_rows_seller ON sheet_rows (seller);
+                CREATE INDEX IF NOT EXISTS sheet_rows_due_date ON sheet_rows (title, due_date);
+            """)
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(sheet_rows)")]
+            if "cells" not in columns:
+                # Mirrors made before raw cells were kept are downloaded again
+                self._conn.execute("ALTER TABLE sheet_rows ADD COLUMN cells TEXT NOT NULL DEFAULT '[]'")
+                self._conn.execute("UPDATE sheets SET loaded_at = 0")
+            self._pid = os.getpid()
+        return self._conn
+
+    def check_revision(self, spreadsheet, force=False):
+        """Fetch the Drive revision, at most once per check_interval (once a second if force). Returns it, or None."""
+        with self._lock:
+            if time.monotonic() - self._checked_at < (1.0 if force else self.check_interval):
+                return self._revision
+            self._checked_at = time.monotonic()
+        revision = spreadsheet_revision(spreadsheet)
+        with self._lock:
+            if revision is not None and revision != self._revision:
+                logger.debug(f"Spreadsheet revision is now {revision}")
+            self._revision = revision
+        return revision
+
+    def _is_fresh(self, meta):
+        if meta is None:
+            return False
+        _, revision, loaded_at, _ = meta
+        age = time.time() - loaded_at
+        if self._revision is None:
+            return age < self.check_interval
+        return revision == str(self._revision) and age < self.max_age
+
+    def _meta(self, title):
+        return self._connection().execute(
+            "SELECT header, revision, loaded_at, version FROM sheets WHERE title = ?", (title,)
+        ).fetchone()
+
+    def ensure_fresh(self, spreadsheet, title):
+        """Download a sheet if it is missing or stale. Returns the number of Sheets API calls made."""
+        self.check_revision(spreadsheet)
+        with self._lock:
+            if self._is_fresh(self._meta(title)):
+                return 0
+            revision = self._revision
+        from src.sheets import get_worksheet
+        from src.sheets_quota import sheets_scheduler
+        # get_all_values keeps the header of a sheet without data rows
+        values = sheets_scheduler.read(get_worksheet(spreadsheet, title), "get_all_values")
+        header = values[0] if values else []
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM sheet_rows WHERE title = ?", (title,))
+                self._insert_rows(title, header, enumerate(values[1:], start=2))
+                conn.execute(
+                    "INSERT INTO sheets (title, header, revision, loaded_at, version) VALUES (?, ?, ?, ?, 1) "
+                    "ON CONFLICT(title) DO UPDATE SET header = excluded.header, revision = excluded.revision, "
+                    "loaded_at = excluded.loaded_at, version = sheets.version + 1",
+                    (title, json.dumps(header, ensure_ascii=False),
+                     None if revision is None else str(revision), time.time())
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        logger.info(f"Loaded {max(len(values) - 1, 0)} rows of {title} into the replica")
+        return 1
+
+    def _insert_rows(self, title, header, numbered_rows):
+        """Store (row_number, cell values) pairs, keeping the cells as strings and as a record."""
+        entries = []
+        for i, row in numbered_rows:
+            cells = [str(value) for value in row]
+            record = _to_record(header, cells)
+            entries.append((
+                title, i, record.get("Składnik"), record.get("Sprzedawca"), _iso_day(record.get("Termin Płatności", "")),
+                json.dumps(record, ensure_ascii=False), json.dumps(cells, ensure_ascii=False)
+            ))
+        self._connection().executemany(
+            "INSERT OR REPLACE INTO sheet_rows (title, row_number, name, seller, due_date, record, cells) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            entries
+        )
+
+    def version(self, title):
+        """A number that changes whenever the rows of a sheet change, or None if it was never loaded."""
+        with self._lock:
+            meta = self._meta(title)
+        return meta[3] if meta else None
+
+    def rows(self, spreadsheet, title):
+        """Return [(row_number, record)] of a sheet in sheet order, records as get_all_records returns them."""
+        self.ensure_fresh(spreadsheet, title)
+        with self._lock:
+            result = self._connection().execute(
+                "SELECT row_number, record FROM sheet_rows WHERE title = ? ORDER BY row_number", (title,)
+            ).fetchall()
+        return [(row_number, json.loads(record)) for row_number, record in result]
+
+    def records(self, spreadsheet, title):
+        """Return the records of a sheet, like worksheet.get_all_records() but from the mirror."""
+        return [record for _, record in self.rows(spreadsheet, title)]
+
+    def values(self, spreadsheet, title):
+        """Return the header and rows of a sheet as cell strings, like worksheet.get_all_values() but from the mirror.
+
+        Rows are padded to the header's width.
+        """
+        self.ensure_fresh(spreadsheet, title)
+        with self._lock:
+            meta = self._meta(title)
+            result = self._connection().execute(
+                "SELECT cells FROM sheet_rows WHERE title = ? ORDER BY row_number", (title,)
+            ).fetchall()
+        header = json.loads(meta[0]) if meta else []
+        rows = [json.loads(cells) for cells, in result]
+        return [header] + [row + [""] * (len(header) - len(row)) for row in rows]
+
+    def invoices(self, spreadsheet, ledger, seller=None, due_before=None):
+        """Return ledger records, optionally only a seller's or those due before a date, ordered by due date.
+
+        Rows whose due date cannot be read are kept by due_before, so callers
+        can still flag them.
+        """
+        self.ensure_fresh(spreadsheet, ledger)
+        query = "SELECT record FROM sheet_rows WHERE title = ?"
+        params = [ledger]
+        if seller is not None:
+            query += " AND seller = ?"
+            params.append(seller)
+        if due_before is not None:
+            query += " AND (due_date < ? OR due_date IS NULL)"
+            params.append(due_before.isoformat())
+        with self._lock:
+            result = self._connection().execute(query + " ORDER BY due_date, row_number", params).fetchall()
+        return [json.loads(record) for record, in result]
+
+    def _write(self, title, change):
+        """Apply change(conn, header) to a loaded sheet and bump its version; no-op for sheets never loaded."""
+        with self._lock:
+            conn = self._connection()
+            meta = self._meta(title)
+            if meta is None:
+                return
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                change(conn, json.loads(meta[0]))
+                conn.execute("UPDATE sheets SET version = version + 1 WHERE title = ?", (title,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def update_rows(self, title, rows_by_number):
+        """Write-through for rows rewritten in place ({row_number: values})."""
+        self._write(title, lambda conn, header: self._insert_rows(title, header, rows_by_number.items()))
+
+    def record_append(self, title, response, rows):
+        """Write-through for appended rows, placed by the range the API reports.
+
+        Returns the rows written through as {row_number: values}, or {} if
+        the range was missing and the sheet was invalidated instead.
+        """
+        match = re.search(r"![A-Z]+(\d+)", (response or {}).get("updates", {}).get("updatedRange", ""))
+        if not match:
+            self.invalidate(title)
+            return {}
+        start = int(match.group(1))
+        rows_by_number = {start + offset: row for offset, row in enumerate(rows)}
+        self.update_rows(title, rows_by_number)
+        return rows_by_number
+
+    def replace(self, title, values):
+        """Write-through for a whole-sheet rewrite; values starts with the header row."""
+        rows = list(values[1:])
+        # The API leaves trailing blank rows out of get_all_records
+        while rows and not any(str(value) for value in rows[-1]):
+            rows.pop()
+
+        def rewrite(conn, header):
+            conn.execute("DELETE FROM sheet_rows WHERE title = ?", (title,))
+            self._insert_rows(title, header, enumerate(rows, start=2))
+        self._write(title, rewrite)
+
+    def invalidate(self, title=None):
+        """Forget a sheet (or all of them) so the next read downloads it again."""
+        with self._lock:
+            conn = self._connection()
+            if title is None:
+                conn.execute("UPDATE sheets SET loaded_at = 0, version = version + 1")
+            else:
+                conn.execute("UPDATE sheets SET loaded_at = 0, version = version + 1 WHERE title = ?", (title,))
+
+    def adopt_revision(self, spreadsheet, expected):
+        """After our own writes, mark sheets that were current at revision `expected` current again.
+
+        Call with the revision from check_revision(force=True) taken before
+        writing. An edit made by someone else between our writes and this
+        call is missed until the next revision change or max_age.
+        """
+        if expected is None:
+            return
+        revision = spreadsheet_revision(spreadsheet)
+        with self._lock:
+            self._checked_at = time.monotonic()
+            self._revision = revision
+            if revision is None or revision == expected:
+                return
+            self._connection().execute(
+                "UPDATE sheets SET revision = ? WHERE revision = ?", (str(revision), str(expected))
+            )
+
+sheet_replica = SheetReplica()
@@ -1,120 +1,319 @@
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
-from src.config import SPREADSHEET_ID, CREDENTIALS_PATH
+from src.config import SPREADSHEET_ID, CREDENTIALS_PATH, SHEETS_TOKEN_REFRESH_INTERVAL
 import logging
-from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_exception_type
+import os
+import threading
+import time
 import gspread.exceptions
+from src.price_index import price_index
+from src.replica import sheet_replica
+from src.price_history import price_history, to_day
+from src.metrics import instrumented
+from src.sheets_quota import sheets_scheduler
 
 logger = logging.getLogger(__name__)
 
+CATEGORY_SHEETS = ["JEDZENIE", "NAPOJE", "NAPOJE ALKOHOLOWE", "CHEMIA", "INNE"]
+
 SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
 
+_lock = threading.Lock()
+_client = None
+_spreadsheet = None
+_worksheets = {}
+_refresher = None
+
+def _reset_after_fork():
+    """Drop the parent's connection so each gunicorn worker authorizes lazily on its own."""
+    global _lock, _client, _spreadsheet, _worksheets, _refresher
+    _lock = threading.Lock()
+    _client = None
+    _spreadsheet = None
+    _worksheets = {}
+    _refresher = None
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def _refresh_token(client):
+    """Refresh the client's access token before it expires."""
+    auth = getattr(client, "auth", None)
+    if hasattr(auth, "refresh"):
+        from google.auth.transport.requests import Request
+        auth.refresh(Request())
+    else:
+        client.login()
+
+def _refresh_loop(client):
+    while True:
+        time.sleep(SHEETS_TOKEN_REFRESH_INTERVAL)
+        if client is not _client:
+            return
+        try:
+            _refresh_token(client)
+            logger.debug("Refreshed Google Sheets access token")
+        except Exception as e:
+            logger.warning(f"Failed to refresh Google Sheets access token: {e}")
+
 def get_spreadsheet():
-    """Connect to Google Sheets."""
-    try:
-        creds = ServiceAccountCredentials.from_json_keyfile_name(CREDENTIALS_PATH, SCOPE)
-        client = gspread.authorize(creds)
-        spreadsheet = client.open_by_key(SPREADSHEET_ID)
-        logger.info("Connected to Google Sheets")
-        return spreadsheet
-    except Exception as e:
-        logger.error(f"Failed to connect to Google Sheets: {e}")
-        raise
+    """Return the process-wide Google Sheets handle, connecting on first use."""
+    global _client, _spreadsheet, _refresher
+    if _spreadsheet is not None:
+        return _spreadsheet
+    with _lock:
+        if _spreadsheet is not None:
+            return _spreadsheet
+        try:
+            creds = ServiceAccountCredentials.from_json_keyfile_name(CREDENTIALS_PATH, SCOPE)
+            client = gspread.authorize(creds)
+            spreadsheet = client.open_by_key(SPREADSHEET_ID)
+            _client = client
+            _spreadsheet = spreadsheet
+            _refresher = threading.Thread(target=_refresh_loop, args=(client,), name="sheets-token-refresh", daemon=True)
+            _refresher.start()
+            logger.info("Connected to Google Sheets")
+            return spreadsheet
+        except Exception as e:
+            logger.error(f"Failed to connect to Google Sheets: {e}")
+            raise
 
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_fixed(2),
-    retry=retry_if_exception_type(gspread.exceptions.APIError)
-)
 def get_worksheet(spreadsheet, title):
-    """Get a worksheet by title with retry logic."""
+    """Get a worksheet by title through the Sheets scheduler, cached per spreadsheet."""
+    key = (spreadsheet.id, title)
+    worksheet = _worksheets.get(key)
+    if worksheet is not None:
+        return worksheet
     try:
-        worksheet = spreadsheet.worksheet(title)
+        worksheet = sheets_scheduler.read(spreadsheet, "worksheet", title)
+        _worksheets[key] = worksheet
         logger.debug(f"Accessed worksheet: {title}")
         return worksheet
     except gspread.exceptions.WorksheetNotFound:
         logger.error(f"Worksheet {title} not found")
         raise
 
-def update_or_append_ingredient(worksheet, ingredient, invoice_date, seller):
-    """Update or append an ingredient's price in the category sheet."""
+def ingredient_row(ingredient, invoice_date, seller):
+    """Format an ingredient as a category sheet row."""
+    return [
+        invoice_date,
+        ingredient["name"],
+        ingredient["unit"],
+        f"{ingredient['net_price_per_unit']:.2f}".replace(".", ","),
+        ingredient["vat_percent"],
+        f"{ingredient['gross_price_per_unit']:.2f}".replace(".", ","),
+        seller
+    ]
+
+def canonicalize_ingredients(spreadsheet, ingredients):
+    """Return copies of the ingredients renamed to the matching names already on their category sheets.
+
+    OCR and LLM variants such as "kukurydza kolby 2.5 KG" map to an
+    existing "Kukurydza kolby 2,5kg" row instead of creating a duplicate.
+    """
+    canonical = []
+    for ingredient in ingredients:
+        if ingredient["category"] in CATEGORY_SHEETS:
+            worksheet = get_worksheet(spreadsheet, ingredient["category"])
+            ingredient = dict(ingredient, name=price_index.canonical_name(worksheet, ingredient["name"]))
+        canonical.append(ingredient)
+    return canonical
+
+def load_price_indexes(spreadsheet, ingredients):
+    """Load the price index of every category sheet the ingredients belong to. Returns the API calls made.
+
+    Called before canonicalize_ingredients so the sheet reads it triggers are counted.
+    """
+    categories = {ingredient["category"] for ingredient in ingredients if ingredient["category"] in CATEGORY_SHEETS}
+    return sum(price_index.load_if_needed(get_worksheet(spreadsheet, category)) for category in sorted(categories))
+
+def update_or_append_ingredients(worksheet, ingredients, invoice_date, seller):
+    """Update or append many ingredients in one category sheet.
+
+    The sheet is looked up through the shared price index, built from the
+    local replica, so it is read only when the replica is stale. Changed rows
+    go out in a single batch_update and new rows in a single append_rows,
+    both written through to the replica and the price index. An ingredient may carry its own
+    "invoice_date" and "seller" (when it comes from a batch of invoices);
+    later ingredients win.
+    Returns the number of API calls made.
+    """
     try:
-        records = worksheet.get_all_records()
-        for i, record in enumerate(records, start=2):
-            if record["Składnik"] == ingredient["name"]:
-                sheet_net_price = float(str(record["Cena netto (za JM)"]).replace(",", "."))
-                if abs(sheet_net_price - ingredient["net_price_per_unit"]) < 0.01:
-                    logger.debug(f"Ingredient {ingredient['name']} already exists with same price")
-                    return
-                else:
-                    worksheet.update(
-                        range_name=f"A{i}:G{i}",
-                        values=[[
-                            invoice_date,
-                            ingredient["name"],
-                            ingredient["unit"],
-                            f"{ingredient['net_price_per_unit']:.2f}".replace(".", ","),
-                            ingredient["vat_percent"],
-                            f"{ingredient['gross_price_per_unit']:.2f}".replace(".", ","),
-                            seller
-                        ]]
-                    )
-                    logger.info(f"Updated ingredient {ingredient['name']} in {worksheet.title}")
-                    return
-        worksheet.append_row([
-            invoice_date,
-            ingredient["name"],
-            ingredient["unit"],
-            f"{ingredient['net_price_per_unit']:.2f}".replace(".", ","),
-            ingredient["vat_percent"],
-            f"{ingredient['gross_price_per_unit']:.2f}".replace(".", ","),
-            seller
-        ])
-        logger.info(f"Appended ingredient {ingredient['name']} to {worksheet.title}")
+        api_calls = price_index.load_if_needed(worksheet)
+        entries = price_index.get(worksheet)
+        updates = {}
+        appends = {}
+        for ingredient in ingredients:
+            name = ingredient["name"]
+            row = ingredient_row(
+                ingredient, ingredient.get("invoice_date", invoice_date), ingredient.get("seller", seller)
+            )
+            if name in appends:
+                appends[name] = row
+            elif name in entries:
+                entry = entries[name]
+                i = entry["row"]
+                if (entry["price"] is not None and i not in updates
+                        and abs(entry["price"] - ingredient["net_price_per_unit"]) < 0.01):
+                    logger.debug(f"Ingredient {name} already exists with same price")
+                    continue
+                updates[i] = row
+            else:
+                appends[name] = row
+        if updates:
+            sheets_scheduler.write(worksheet, "batch_update", [
+                {"range": f"A{i}:G{i}", "values": [row]} for i, row in updates.items()
+            ])
+            api_calls += 1
+            sheet_replica.update_rows(worksheet.title, updates)
+            price_index.record(worksheet.title, updates)
+            logger.info(f"Updated {len(updates)} ingredients in {worksheet.title}")
+        if appends:
+            rows = list(appends.values())
+            response = sheets_scheduler.write(worksheet, "append_rows", rows)
+            api_calls += 1
+            price_index.record(worksheet.title, sheet_replica.record_append(worksheet.title, response, rows))
+            logger.info(f"Appended {len(appends)} ingredients to {worksheet.title}")
+        return api_calls
     except Exception as e:
-        logger.error(f"Failed to update ingredient {ingredient['name']}: {e}")
+        logger.error(f"Failed to update ingredients in {worksheet.title}: {e}")
         raise
 
+def update_or_append_ingredient(worksheet, ingredient, invoice_date, seller):
+    """Update or append an ingredient's price in the category sheet."""
+    return update_or_append_ingredients(worksheet, [ingredient], invoice_date, seller)
+
+def invoice_status_row(spreadsheet, invoice_data):
+    """Format an invoice as a row of Faktury Niezapłacone / Faktury Zapłacone."""
+    from src.payments import update_payment_status
+    total_formatted = f"{invoice_data['total']:.2f}".replace(".", ",")
+    days_display = update_payment_status(spreadsheet, invoice_data)
+    return [
+        invoice_data["invoice_date"],
+        invoice_data.get("invoice_number", ""),
+        invoice_data["seller"],
+        total_formatted,
+        invoice_data["category"],
+        invoice_data["due_date"],
+        invoice_data["paid"],
+        days_display
+    ]
+
 def update_invoice_status(spreadsheet, invoice_data):
     """Update invoice details in Faktury Niezapłacone or Faktury Zapłacone."""
     try:
-        from src.payments import update_payment_status
+        from src.payments import LEDGER_HEADER
+        from src.reminders import reminder_index
         target_sheet_title = "Faktury Zapłacone" if invoice_data["paid"] == "T" else "Faktury Niezapłacone"
         worksheet = get_worksheet(spreadsheet, target_sheet_title)
-        total_formatted = f"{invoice_data['total']:.2f}".replace(".", ",")
-        days_display = update_payment_status(spreadsheet, invoice_data)
-        worksheet.append_row([
-            invoice_data["invoice_date"],
-            invoice_data.get("invoice_number", ""),
-            invoice_data["seller"],
-            total_formatted,
-            invoice_data["category"],
-            invoice_data["due_date"],
-            invoice_data["paid"],
-            days_display
-        ])
+        row = invoice_status_row(spreadsheet, invoice_data)
+        response = sheets_scheduler.write(worksheet, "append_row", row)
+        sheet_replica.record_append(target_sheet_title, response, [row])
+        if invoice_data["paid"] != "T":
+            reminder_index.add(dict(zip(LEDGER_HEADER, row)))
         logger.info(f"Added invoice {invoice_data.get('invoice_number', 'unknown')} to {target_sheet_title}")
     except Exception as e:
         logger.error(f"Failed to update invoice status: {e}")
         raise
 
+def append_invoice_statuses(spreadsheet, invoices):
+    """Add many invoices to the paid/unpaid ledgers with one append_rows per ledger. Returns the API call count."""
+    from src.payments import LEDGER_HEADER
+    from src.reminders import reminder_index
+    rows_by_sheet = {}
+    for invoice_data in invoices:
+        target_sheet_title = "Faktury Zapłacone" if invoice_data["paid"] == "T" else "Faktury Niezapłacone"
+        rows_by_sheet.setdefault(target_sheet_title, []).append(invoice_status_row(spreadsheet, invoice_data))
+    for title, rows in rows_by_sheet.items():
+        response = sheets_scheduler.write(get_worksheet(spreadsheet, title), "append_rows", rows)
+        sheet_replica.record_append(title, response, rows)
+        if title == "Faktury Niezapłacone":
+            for row in rows:
+                reminder_index.add(dict(zip(LEDGER_HEADER, row)))
+        logger.info(f"Added {len(rows)} invoices to {title}")
+    return len(rows_by_sheet)
+
+@instrumented("store_invoice_data")
 def store_invoice_data(invoice_data):
-    """Store all invoice data in Google Sheets."""
+    """Store all invoice data in Google Sheets.
+
+    Ingredients are grouped by category so each category sheet costs at most
+    three API calls (a read only if the replica is stale, batch_update,
+    append_rows) regardless of invoice length, plus two Drive revision
+    checks around the writes. Returns the number of Sheets data API calls made; the cached
+    spreadsheet and worksheet handles cost nothing once warm.
+    """
     try:
         spreadsheet = get_spreadsheet()
-        category_sheets = ["JEDZENIE", "NAPOJE", "NAPOJE ALKOHOLOWE", "CHEMIA", "INNE"]
+        api_calls = 0
+        revision = sheet_replica.check_revision(spreadsheet, force=True)
+        api_calls += load_price_indexes(spreadsheet, invoice_data["ingredients"])
+        invoice_data = dict(invoice_data, ingredients=canonicalize_ingredients(spreadsheet, invoice_data["ingredients"]))
+        ingredients_by_category = {}
         for ingredient in invoice_data["ingredients"]:
             category = ingredient["category"]
-            if category in category_sheets:
-                worksheet = get_worksheet(spreadsheet, category)
-                update_or_append_ingredient(
-                    worksheet,
-                    ingredient,
-                    invoice_data["invoice_date"],
-                    invoice_data["seller"]
-                )
+            if category in CATEGORY_SHEETS:
+                ingredients_by_category.setdefault(category, []).append(ingredient)
+        for category, ingredients in ingredients_by_category.items():
+            worksheet = get_worksheet(spreadsheet, category)
+            api_calls += update_or_append_ingredients(
+                worksheet,
+                ingredients,
+                invoice_data["invoice_date"],
+                invoice_data["seller"]
+            )
         update_invoice_status(spreadsheet, invoice_data)
-        logger.info("Successfully stored invoice data")
+        api_calls += 1
+        try:
+            price_history.record_invoice(invoice_data)
+        except Exception as e:
+            logger.error(f"Failed to record price history: {e}")
+        sheet_replica.adopt_revision(spreadsheet, revision)
+        logger.info(f"Successfully stored invoice data ({api_calls} Sheets API calls)")
+        return api_calls
     except Exception as e:
         logger.error(f"Failed to store invoice data: {e}")
-        raise
\ No newline at end of file
+        raise
+
+@instrumented("store_invoices_data")
+def store_invoices_data(invoices):
+    """Store a batch of invoices with coalesced writes (used by the bulk backfill).
+
+    Invoices are applied oldest first, so the newest price of an ingredient
+    wins. Each category sheet costs at most one read (only if the replica is
+    stale), one batch_update and one append_rows for the whole batch, and
+    each ledger one append_rows.
+    Returns the number of Sheets data API calls made.
+    """
+    try:
+        spreadsheet = get_spreadsheet()
+        api_calls = 0
+        revision = sheet_replica.check_revision(spreadsheet, force=True)
+        api_calls += load_price_indexes(
+            spreadsheet, [ingredient for invoice_data in invoices for ingredient in invoice_data["ingredients"]]
+        )
+        invoices = [
+            dict(invoice_data, ingredients=canonicalize_ingredients(spreadsheet, invoice_data["ingredients"]))
+            for invoice_data in sorted(invoices, key=lambda invoice_data: to_day(invoice_data.get("invoice_date")))
+        ]
+        ingredients_by_category = {}
+        for invoice_data in invoices:
+            for ingredient in invoice_data["ingredients"]:
+                if ingredient["category"] in CATEGORY_SHEETS:
+                    ingredients_by_category.setdefault(ingredient["category"], []).append(
+                        dict(ingredient, invoice_date=invoice_data["invoice_date"], seller=invoice_data["seller"])
+                    )
+        for category, ingredients in ingredients_by_category.items():
+            api_calls += update_or_append_ingredients(get_worksheet(spreadsheet, category), ingredients, None, None)
+        api_calls += append_invoice_statuses(spreadsheet, invoices)
+        for invoice_data in invoices:
+            try:
+                price_history.record_invoice(invoice_data)
+            except Exception as e:
+                logger.error(f"Failed to record price history: {e}")
+        sheet_replica.adopt_revision(spreadsheet, revision)
+        logger.info(f"Stored {len(invoices)} invoices ({api_calls} Sheets API calls)")
+        return api_calls
+    except Exception as e:
+        logger.error(f"Failed to store invoice batch: {e}")
+        raise
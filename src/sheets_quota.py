@@ -0,0 +1,165 @@
+import logging
+import os
+import random
+import threading
+import time
+from src.config import (
+    SHEETS_READS_PER_MINUTE, SHEETS_WRITES_PER_MINUTE, SHEETS_BURST, SHEETS_QUOTA_PATH,
+    SHEETS_MAX_ATTEMPTS, SHEETS_BACKOFF_BASE, SHEETS_BACKOFF_MAX, SHEETS_COALESCE_WINDOW
+)
+from src.ratelimit import SharedTokenBucket
+from src.metrics import count_api_call, count_retry
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+def _per_second(per_minute, burst):
+    # Leave room for a full burst so no 60-second window exceeds the quota
+    return max(per_minute - burst, 1) / 60
+
+def _status_code(error):
+    """HTTP status of a gspread APIError (or anything carrying a response), else None."""
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is None:
+        status = getattr(error, "code", None)
+    return status if isinstance(status, int) else None
+
+def _retry_after(error):
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+def _copy(result):
+    """Copy row lists so callers sharing a coalesced read cannot modify each other's rows."""
+    if isinstance(result, list):
+        return [row.copy() if isinstance(row, (dict, list)) else row for row in result]
+    return result
+
+def _target_key(target):
+    spreadsheet = getattr(target, "spreadsheet", None)
+    if spreadsheet is not None:
+        return (spreadsheet.id, target.title)
+    return (target.id, None)
+
+class SheetsScheduler:
+    """Client-side scheduler for every Google Sheets API call.
+
+    Reads and writes draw from two token buckets sized to the project's
+    per-minute quotas and stored in files, so all gunicorn workers and CLI
+    processes on the host share one budget. Retryable API errors (429 and
+    5xx) are retried with exponential backoff and full jitter; a 429 also
+    empties the shared bucket for the Retry-After time (or the backoff), so
+    every process backs off instead of retrying in lockstep. Identical reads
+    issued while one is in flight, or within coalesce_window seconds of it,
+    share a single call; a write through the scheduler drops the cached
+    reads of its worksheet.
+    """
+
+    def __init__(self, quota_path=SHEETS_QUOTA_PATH, reads_per_minute=SHEETS_READS_PER_MINUTE,
+                 writes_per_minute=SHEETS_WRITES_PER_MINUTE, burst=SHEETS_BURST, max_attempts=SHEETS_MAX_ATTEMPTS,
+                 backoff_base=SHEETS_BACKOFF_BASE, backoff_max=SHEETS_BACKOFF_MAX, coalesce_window=SHEETS_COALESCE_WINDOW):
+        self.buckets = {
+            "read": SharedTokenBucket(f"{quota_path}.read.json", _per_second(reads_per_minute, burst), burst),
+            "write": SharedTokenBucket(f"{quota_path}.write.json", _per_second(writes_per_minute, burst), burst),
+        }
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.coalesce_window = coalesce_window
+        self.counters = {"calls": 0, "coalesced": 0, "retries": 0, "throttled_seconds": 0.0}
+        self._random = random.Random()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._reads = {}
+
+    def _check_pid(self):
+        # A read in flight in the parent has no thread in a forked child to finish it
+        if self._pid != os.getpid():
+            self._reset()
+
+    def _increment(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    def _backoff(self, attempt, error):
+        delay = self._random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def call(self, kind, func, *args, **kwargs):
+        """Run func(*args, **kwargs) as one Sheets API call of kind "read" or "write", with quota and retries."""
+        bucket = self.buckets[kind]
+        attempt = 0
+        while True:
+            waited = bucket.acquire()
+            if waited:
+                self._increment("throttled_seconds", waited)
+            self._increment("calls")
+            count_api_call("sheets")
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                status = _status_code(e)
+                attempt += 1
+                if status not in RETRYABLE_STATUS or attempt >= self.max_attempts:
+                    raise
+                delay = self._backoff(attempt, e)
+                if status == 429:
+                    bucket.block(delay)
+                logger.warning(f"Sheets API returned {status}, retrying in {delay:.1f}s (attempt {attempt})")
+                self._increment("retries")
+                count_retry("sheets")
+                time.sleep(delay)
+
+    def read(self, target, method, *args, **kwargs):
+        """Call target.method(*args, **kwargs) as a read, sharing the result of an identical recent read."""
+        self._check_pid()
+        key = (_target_key(target), method, args, tuple(sorted(kwargs.items())))
+        with self._lock:
+            entry = self._reads.get(key)
+            if entry and (not entry["done"].is_set() or time.monotonic() - entry["at"] < self.coalesce_window):
+                leader = False
+                self.counters["coalesced"] += 1
+            else:
+                entry = self._reads[key] = {"done": threading.Event(), "at": None, "result": None, "error": None}
+                leader = True
+        if leader:
+            try:
+                entry["result"] = self.call("read", getattr(target, method), *args, **kwargs)
+            except Exception as e:
+                entry["error"] = e
+                with self._lock:
+                    if self._reads.get(key) is entry:
+                        del self._reads[key]
+            entry["at"] = time.monotonic()
+            entry["done"].set()
+        else:
+            entry["done"].wait()
+        if entry["error"] is not None:
+            raise entry["error"]
+        return _copy(entry["result"])
+
+    def write(self, target, method, *args, **kwargs):
+        """Call target.method(*args, **kwargs) as a write and forget the cached reads of target."""
+        self._check_pid()
+        target_key = _target_key(target)
+        with self._lock:
+            for key in [key for key in self._reads if key[0] == target_key]:
+                del self._reads[key]
+        try:
+            return self.call("write", getattr(target, method), *args, **kwargs)
+        finally:
+            with self._lock:
+                for key in [key for key in self._reads if key[0] == target_key]:
+                    del self._reads[key]
+
+sheets_scheduler = SheetsScheduler()
@@ -0,0 +1,195 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from src.config import SELLER_TEMPLATES_PATH
+from src.layout import flatten_layout
+
+logger = logging.getLogger(__name__)
+
+# Lines of OCR text searched for the seller header
+HEADER_LINES = 15
+
+CATEGORY_KEYWORDS = {
+    "NAPOJE ALKOHOLOWE": ["piwo", "wino", "wódka", "wodka", "whisky", "gin", "rum", "likier", "prosecco"],
+    "NAPOJE": ["woda", "sok", "lemoniada", "cola", "napój", "napoj", "tonik", "herbata", "kawa"],
+    "CHEMIA": ["płyn", "plyn", "detergent", "środek", "srodek", "proszek", "tabletki do zmywarki", "domestos"],
+    "INNE": ["opakowanie", "pojemnik", "serwetki", "folia", "reklamówka", "usługa", "usluga", "transport"],
+}
+
+def parse_amount(value):
+    """Parse a Polish-formatted amount such as "1 234,56" into a float."""
+    return float(re.sub(r"\s", "", value).replace(",", "."))
+
+def classify_ingredient(name, default="JEDZENIE"):
+    """Guess an ingredient's category from keywords in its name."""
+    lowered = name.lower()
+    for category, keywords in CATEGORY_KEYWORDS.items():
+        if any(keyword in lowered for keyword in keywords):
+            return category
+    return default
+
+class InvoiceTemplate:
+    """Regex extraction rules for one supplier's fixed invoice layout.
+
+    line_pattern must define the named groups name, unit, net and vat, and
+    qty or gross_total for the line-total check in validate_invoice; without
+    them every extraction fails validation and goes to the LLM. Patterns are
+    matched against plain OCR text; layout-mode text is flattened first.
+    """
+
+    def __init__(self, name, seller, seller_pattern, line_pattern, invoice_number_pattern,
+                 invoice_date_pattern, total_pattern, due_date_pattern=None, payment_days=7,
+                 default_category="JEDZENIE", unit_map=None):
+        self.name = name
+        self.seller = seller
+        self.seller_pattern = re.compile(seller_pattern, re.IGNORECASE)
+        self.line_pattern = re.compile(line_pattern, re.MULTILINE)
+        self.invoice_number_pattern = re.compile(invoice_number_pattern, re.IGNORECASE)
+        self.invoice_date_pattern = re.compile(invoice_date_pattern, re.IGNORECASE)
+        self.total_pattern = re.compile(total_pattern, re.IGNORECASE)
+        self.due_date_pattern = re.compile(due_date_pattern, re.IGNORECASE) if due_date_pattern else None
+        self.payment_days = payment_days
+        self.default_category = default_category
+        self.unit_map = unit_map or {}
+        if not {"qty", "gross_total"} & set(self.line_pattern.groupindex):
+            logger.warning(f"Template {name} has no qty or gross_total group; its invoices will be parsed by the LLM")
+
+    def matches(self, text):
+        header = "\n".join(text.splitlines()[:HEADER_LINES])
+        return bool(self.seller_pattern.search(header))
+
+    def extract(self, text, paid_status):
+        """Return the invoice in the same shape as parse_invoice_text, or None if a field is missing."""
+        invoice_number = self.invoice_number_pattern.search(text)
+        invoice_date = self.invoice_date_pattern.search(text)
+        total = self.total_pattern.search(text)
+        if not (invoice_number and invoice_date and total):
+            return None
+        invoice_date = invoice_date.group(1)
+        due_date = self.due_date_pattern.search(text) if self.due_date_pattern else None
+        if due_date:
+            due_date = due_date.group(1)
+        else:
+            due = datetime.strptime(invoice_date, "%d.%m.%Y") + timedelta(days=self.payment_days)
+            due_date = due.strftime("%d.%m.%Y")
+
+        ingredients = []
+        line_totals = []
+        for match in self.line_pattern.finditer(text):
+            fields = match.groupdict()
+            net = parse_amount(fields["net"])
+            vat = parse_amount(fields["vat"])
+            unit = fields["unit"].lower()
+            name = " ".join(fields["name"].split())
+            ingredients.append({
+                "name": name,
+                "unit": self.unit_map.get(unit, unit),
+                "net_price_per_unit": round(net, 2),
+                "vat_percent": vat,
+                "gross_price_per_unit": round(net * (1 + vat / 100), 2),
+                "category": classify_ingredient(name, self.default_category)
+            })
+            if fields.get("gross_total"):
+                line_totals.append(parse_amount(fields["gross_total"]))
+            elif fields.get("qty"):
+                line_totals.append(parse_amount(fields["qty"]) * net * (1 + vat / 100))
+
+        categories = [ingredient["category"] for ingredient in ingredients]
+        return {
+            "ingredients": ingredients,
+            "invoice_date": invoice_date,
+            "due_date": due_date,
+            "total": parse_amount(total.group(1)),
+            "paid": paid_status,
+            "seller": self.seller,
+            "category": max(categories, key=categories.count) if categories else "INNE",
+            "invoice_number": invoice_number.group(1).strip(),
+            "_line_totals": line_totals
+        }
+
+def validate_invoice(data, tolerance=0.01):
+    """Check that a template extraction is complete and its line totals add up to the invoice total.
+
+    An extraction without line totals cannot be cross-checked and fails, so
+    a missed or misread line never reaches the sheets unnoticed.
+    """
+    if not data["ingredients"] or data["total"] <= 0:
+        return False
+    line_totals = data["_line_totals"]
+    if len(line_totals) != len(data["ingredients"]):
+        return False
+    return abs(sum(line_totals) - data["total"]) <= max(0.05, data["total"] * tolerance)
+
+_templates = []
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "validation_failures": 0, "llm_calls": 0, "llm_seconds": 0.0, "template_seconds": 0.0}
+
+def register_template(template):
+    _templates.append(template)
+
+def load_templates(path=SELLER_TEMPLATES_PATH):
+    """Load templates from a JSON list of InvoiceTemplate keyword arguments."""
+    if not os.path.exists(path):
+        return 0
+    try:
+        with open(path, encoding="utf-8") as f:
+            definitions = json.load(f)
+        for definition in definitions:
+            register_template(InvoiceTemplate(**definition))
+        logger.info(f"Loaded {len(definitions)} seller templates from {path}")
+        return len(definitions)
+    except Exception as e:
+        logger.error(f"Failed to load seller templates from {path}: {e}")
+        return 0
+
+def record_llm_latency(seconds):
+    """Record one LLM parse so time saved by template hits can be estimated."""
+    with _stats_lock:
+        _stats["llm_calls"] += 1
+        _stats["llm_seconds"] += seconds
+
+def parse_with_template(text, paid_status):
+    """Parse an invoice with the matching seller template, or return None to fall back to the LLM."""
+    start = time.perf_counter()
+    text = flatten_layout(text)
+    template = next((t for t in _templates if t.matches(text)), None)
+    if template is None:
+        with _stats_lock:
+            _stats["misses"] += 1
+        return None
+    try:
+        data = template.extract(text, paid_status)
+    except (ValueError, KeyError, IndexError) as e:
+        logger.warning(f"Template {template.name} failed to extract invoice: {e}")
+        data = None
+    if data is None or not validate_invoice(data):
+        logger.info(f"Template {template.name} matched but failed validation, falling back to LLM")
+        with _stats_lock:
+            _stats["validation_failures"] += 1
+        return None
+    del data["_line_totals"]
+    with _stats_lock:
+        _stats["hits"] += 1
+        _stats["template_seconds"] += time.perf_counter() - start
+    logger.info(f"Parsed invoice {data['invoice_number']} locally with template {template.name}")
+    return data
+
+def get_template_stats():
+    """Return template hit rate and the estimated LLM time saved."""
+    with _stats_lock:
+        stats = dict(_stats)
+    attempts = stats["hits"] + stats["misses"] + stats["validation_failures"]
+    avg_llm = stats["llm_seconds"] / stats["llm_calls"] if stats["llm_calls"] else 0.0
+    return {
+        "hits": stats["hits"],
+        "misses": stats["misses"],
+        "validation_failures": stats["validation_failures"],
+        "hit_rate": round(stats["hits"] / attempts, 3) if attempts else 0.0,
+        "seconds_saved": round(max(0.0, stats["hits"] * avg_llm - stats["template_seconds"]), 3)
+    }
+
+load_templates()
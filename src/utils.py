@@ -1,24 +1,76 @@
 import requests
+from requests.adapters import HTTPAdapter
 import os
+import threading
+import uuid
 from datetime import datetime, timedelta
-from src.config import TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, INVOICES_DIR
+from src.config import (
+    TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, INVOICES_DIR,
+    MEDIA_MAX_BYTES, MEDIA_DOWNLOAD_TIMEOUT, MEDIA_POOL_SIZE
+)
+from src.metrics import instrumented, count_api_call
 import logging
 
 logger = logging.getLogger(__name__)
 
-def download_media(media_url, invoices_dir):
-    """Download media from Twilio and save it locally."""
+CHUNK_SIZE = 64 * 1024
+
+_session = None
+_session_lock = threading.Lock()
+
+def _reset_after_fork():
+    global _session, _session_lock
+    _session = None
+    _session_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def get_http_session():
+    """Return the process-wide pooled HTTP session used for Twilio media."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            session.auth = (TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+            adapter = HTTPAdapter(pool_connections=MEDIA_POOL_SIZE, pool_maxsize=MEDIA_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+class MediaTooLargeError(Exception):
+    """Raised when a media file exceeds MEDIA_MAX_BYTES."""
+
+@instrumented("download_media")
+def download_media(media_url, invoices_dir, max_bytes=MEDIA_MAX_BYTES):
+    """Download media from Twilio and stream it to a uniquely named local file."""
     try:
         os.makedirs(invoices_dir, exist_ok=True)
-        response = requests.get(media_url, auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN))
-        if response.status_code != 200:
-            raise Exception(f"Failed to download media: {response.status_code}")
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"invoice_{timestamp}.jpg"
+        filename = f"invoice_{timestamp}_{uuid.uuid4().hex[:8]}.jpg"
         file_path = os.path.join(invoices_dir, filename)
-        with open(file_path, "wb") as f:
-            f.write(response.content)
-        logger.info(f"Downloaded media: {filename}")
+        partial_path = file_path + ".part"
+        count_api_call("twilio_media")
+        with get_http_session().get(media_url, stream=True, timeout=MEDIA_DOWNLOAD_TIMEOUT) as response:
+            if response.status_code != 200:
+                raise Exception(f"Failed to download media: {response.status_code}")
+            content_length = int(response.headers.get("Content-Length") or 0)
+            if content_length > max_bytes:
+                raise MediaTooLargeError(f"Media is {content_length} bytes, limit is {max_bytes}")
+            size = 0
+            try:
+                with open(partial_path, "wb") as f:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > max_bytes:
+                            raise MediaTooLargeError(f"Media exceeds the {max_bytes} byte limit")
+                        f.write(chunk)
+                os.replace(partial_path, file_path)
+            finally:
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+        logger.info(f"Downloaded media: {filename} ({size} bytes)")
         return filename
     except Exception as e:
         logger.error(f"Failed to download media: {e}")
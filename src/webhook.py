@@ -1,17 +1,17 @@
-from flask import Flask, request
+from flask import Flask, request, jsonify
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from twilio.rest import Client
-import os
-import json
-from src.config import TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_WHATSAPP_NUMBER, INVOICES_DIR
-from src.utils import download_media, clean_old_invoices
-from src.ocr import detect_text
-from src.parser import parse_invoice_text
-from src.sheets import store_invoice_data, get_spreadsheet
-from src.price_changes import detect_price_changes
-from src.payments import sync_invoice_status
-from src.notifications import notify_price_changes, notify_payment_reminders
+from twilio.twiml.messaging_response import MessagingResponse
+from src.jobs import get_queue, ensure_workers, get_stats
+from src.cache import get_cache_stats
+from src.templates import get_template_stats
+from src.dispatcher import get_dispatch_stats, get_outbox
+from src.metrics import gauge, render
+from src.mailer import email_sender
+from src.notifications import start_dispatcher
+from src.pipeline import process_invoice_job, notify_job_failure
+from src.reminders import ensure_scheduler
+from src.sheets_quota import sheets_scheduler
 import logging
 import logging.handlers
 
@@ -26,8 +26,23 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 limiter = Limiter(app, key_func=get_remote_address, default_limits=["200 per day", "50 per hour"])
 
-# Initialize Twilio client
-client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+def start_background_workers():
+    """Start this process's job workers, notification dispatcher and reminder scheduler.
+
+    Called at boot, from the gunicorn post_fork hook or __main__, so jobs
+    and outbox rows a dead worker left behind drain, and reminders go out,
+    without waiting for a request. Safe to call again.
+    """
+    pool = ensure_workers(process_invoice_job, notify_job_failure)
+    start_dispatcher()
+    ensure_scheduler()
+    return pool
+
+def twiml_reply(body, status=200):
+    """Reply to the sender inline with TwiML instead of a separate API call."""
+    response = MessagingResponse()
+    response.message(body)
+    return str(response), status, {"Content-Type": "application/xml"}
 
 @app.route("/whatsapp", methods=["POST"])
 @limiter.limit("10 per minute")
@@ -39,106 +54,56 @@ def whatsapp_webhook():
     paid_status = "T" if "PAID" in body else "N"
 
     if num_media > 0:
-        media_url = request.form.get("MediaUrl0")
-        media_type = request.form.get("MediaContentType0")
-        if media_type.startswith("image/"):
-            try:
-                filename = download_media(media_url, INVOICES_DIR)
-                base, ext = os.path.splitext(filename)
-                new_filename = f"{base}_{paid_status}{ext}"
-                file_path = os.path.join(INVOICES_DIR, new_filename)
-                os.rename(
-                    os.path.join(INVOICES_DIR, filename),
-                    file_path
-                )
-            except Exception as e:
-                logger.error(f"Failed to download or rename image: {e}")
-                client.messages.create(
-                    body="Nie udało się pobrać obrazu faktury. Spróbuj ponownie.",
-                    from_=TWILIO_WHATSAPP_NUMBER,
-                    to=from_number
-                )
-                return "Download failed", 500
-
-            text = detect_text(file_path)
-            if not text:
-                client.messages.create(
-                    body="Nie udało się odczytać tekstu z faktury. Spróbuj ponownie.",
-                    from_=TWILIO_WHATSAPP_NUMBER,
-                    to=from_number
-                )
-                return "OCR failed", 500
-
-            parsed_data = parse_invoice_text(text, paid_status)
-            if not parsed_data:
-                client.messages.create(
-                    body="Nie udało się sparsować danych faktury. Sprawdź jakość lub format obrazu.",
-                    from_=TWILIO_WHATSAPP_NUMBER,
-                    to=from_number
-                )
-                return "Parsing failed", 500
-
-            try:
-                store_invoice_data(parsed_data)
-            except Exception as e:
-                logger.error(f"Failed to store data: {e}")
-                client.messages.create(
-                    body="Nie udało się zapisać danych faktury. Spróbuj ponownie później.",
-                    from_=TWILIO_WHATSAPP_NUMBER,
-                    to=from_number
-                )
-                return "Storage failed", 500
-
+        media_urls = [
+            request.form.get(f"MediaUrl{i}")
+            for i in range(num_media)
+            if (request.form.get(f"MediaContentType{i}") or "").startswith("image/")
+        ]
+        if media_urls:
             try:
-                spreadsheet = get_spreadsheet()
-                price_changes_by_category = {}
-                categories = ["JEDZENIE", "NAPOJE", "NAPOJE ALKOHOLOWE", "CHEMIA", "INNE"]
-                for category in categories:
-                    category_ingredients = [
-                        ing for ing in parsed_data["ingredients"] if ing["category"] == category
-                    ]
-                    if category_ingredients:
-                        changes = detect_price_changes(spreadsheet, category_ingredients, category)
-                        if changes:
-                            price_changes_by_category[category] = changes
-                notify_price_changes(price_changes_by_category)
+                pool = ensure_workers(process_invoice_job, notify_job_failure)
+                job_id = get_queue().enqueue({
+                    "from_number": from_number,
+                    "media_urls": media_urls,
+                    "paid_status": paid_status
+                }, message_sid=request.form.get("MessageSid"))
+                pool.notify()
             except Exception as e:
-                logger.error(f"Failed to detect price changes: {e}")
-
-            try:
-                sync_invoice_status(spreadsheet)
-                notify_payment_reminders(spreadsheet)
-            except Exception as e:
-                logger.error(f"Failed to sync invoices or send reminders: {e}")
-                client.messages.create(
-                    body="Nie udało się zsynchronizować faktur lub wysłać przypomnień. Spróbuj ponownie później.",
-                    from_=TWILIO_WHATSAPP_NUMBER,
-                    to=from_number
-                )
-                return "Sync failed", 500
-
-            clean_old_invoices(INVOICES_DIR, days=30)
-            client.messages.create(
-                body=f"Przetworzono fakturę: {new_filename} (Opłacona: {'Tak' if paid_status == 'T' else 'Nie'}). Zapisano {len(parsed_data['ingredients'])} składników.",
-                from_=TWILIO_WHATSAPP_NUMBER,
-                to=from_number
+                logger.error(f"Failed to queue invoice: {e}")
+                return twiml_reply("Nie udało się przyjąć faktury. Spróbuj ponownie później.", 500)
+            if job_id is None:
+                return str(MessagingResponse()), 200, {"Content-Type": "application/xml"}
+            pages = f", stron: {len(media_urls)}" if len(media_urls) > 1 else ""
+            return twiml_reply(
+                f"Otrzymano fakturę (Opłacona: {'Tak' if paid_status == 'T' else 'Nie'}{pages}). Trwa przetwarzanie..."
             )
-            logger.info(f"Processed and stored invoice: {json.dumps(parsed_data, ensure_ascii=False)}")
-            return "Invoice processed", 200
         else:
-            client.messages.create(
-                body="Proszę wysłać plik graficzny (np. JPG).",
-                from_=TWILIO_WHATSAPP_NUMBER,
-                to=from_number
-            )
-            return "Invalid media type", 400
+            return twiml_reply("Proszę wysłać plik graficzny (np. JPG).")
     else:
-        client.messages.create(
-            body="Proszę wysłać zdjęcie faktury z dopiskiem 'Paid' lub 'Unpaid'.",
-            from_=TWILIO_WHATSAPP_NUMBER,
-            to=from_number
-        )
-        return "No media", 400
+        return twiml_reply("Proszę wysłać zdjęcie faktury z dopiskiem 'Paid' lub 'Unpaid'.")
+
+@app.route("/jobs/stats", methods=["GET"])
+@limiter.exempt
+def job_stats():
+    stats = get_stats()
+    stats["cache"] = get_cache_stats()
+    stats["templates"] = get_template_stats()
+    stats["notifications"] = get_dispatch_stats()
+    stats["email"] = dict(email_sender.stats)
+    stats["sheets"] = dict(sheets_scheduler.counters)
+    return jsonify(stats)
+
+QUEUE_DEPTH = gauge("invoice_queue_depth", "Entries in the durable queues, by queue and status.")
+
+@app.route("/metrics", methods=["GET"])
+@limiter.exempt
+def metrics():
+    """Prometheus scrape endpoint."""
+    for name, queue in (("jobs", get_queue()), ("outbox", get_outbox())):
+        for status, count in queue.depth().items():
+            QUEUE_DEPTH.set(count, queue=name, status=status)
+    return render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
 
 if __name__ == "__main__":
+    start_background_workers()
     app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
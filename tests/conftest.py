@@ -0,0 +1,59 @@
+import os
+
+# src.parser builds its client at import time
+os.environ.setdefault("XAI_API_KEY", "test")
+
+import pytest
+from src import metrics, sheets
+from src.benchmark import CATEGORY_HEADER
+from src.cache import ocr_cache, parse_cache
+from src.dedup import invoice_index
+from src.fakes import (
+    FaultInjector, FakeSpreadsheet, FakeVisionClient, FakeOpenAIClient, FakeTwilioClient, FakeHttpSession
+)
+from src.payments import LEDGER_HEADER
+from src.price_history import price_history
+from src.price_index import price_index
+from src.reminders import reminder_index
+from src.replica import sheet_replica
+from src.sheets_quota import sheets_scheduler
+
+@pytest.fixture(autouse=True)
+def metric_store(tmp_path, monkeypatch):
+    """Keep the metrics every test records in its own database."""
+    store = metrics.MetricStore(str(tmp_path / "metrics.db"))
+    monkeypatch.setattr(metrics, "_store", store)
+    return store
+
+@pytest.fixture
+def fake_spreadsheet(tmp_path, monkeypatch):
+    """Point the Sheets client at a FakeSpreadsheet, with every local database under tmp_path."""
+    monkeypatch.chdir(tmp_path)
+    for singleton in (sheet_replica, price_history, reminder_index):
+        monkeypatch.setattr(singleton, "_conn", None)
+    monkeypatch.setattr(sheet_replica, "_revision", None)
+    monkeypatch.setattr(sheet_replica, "_checked_at", 0.0)
+    monkeypatch.setattr(price_index, "_categories", {})
+    sheets_scheduler._reset()
+    headers = {category: CATEGORY_HEADER for category in sheets.CATEGORY_SHEETS}
+    headers.update({"Faktury Niezapłacone": LEDGER_HEADER, "Faktury Zapłacone": LEDGER_HEADER})
+    spreadsheet = FakeSpreadsheet(FaultInjector("sheets"), headers)
+    monkeypatch.setattr(sheets, "_spreadsheet", spreadsheet)
+    return spreadsheet
+
+@pytest.fixture
+def fake_services(fake_spreadsheet, monkeypatch):
+    """Fake every external service the pipeline calls. Returns {service: FaultInjector} plus the media dict."""
+    from src import ocr, parser, notifications, utils
+    from src.config import INVOICES_DIR
+    injectors = {service: FaultInjector(service) for service in ("media", "vision", "xai", "twilio")}
+    injectors["sheets"] = fake_spreadsheet.injector
+    session = FakeHttpSession(injectors["media"])
+    monkeypatch.setattr(ocr, "_client", FakeVisionClient(injectors["vision"]))
+    monkeypatch.setattr(parser, "client", FakeOpenAIClient(injectors["xai"]))
+    monkeypatch.setattr(notifications, "client", FakeTwilioClient(injectors["twilio"]))
+    monkeypatch.setattr(utils, "_session", session)
+    for singleton in (ocr_cache, parse_cache, invoice_index):
+        monkeypatch.setattr(singleton, "_conn", None)
+    os.makedirs(INVOICES_DIR)
+    return injectors, session.media
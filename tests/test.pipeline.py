@@ -4,7 +4,7 @@ from src.utils import download_media
 from src.ocr import detect_text
 from src.parser import parse_invoice_text
 from src.sheets import store_invoice_data, get_spreadsheet
-from src.price_changes import detect_price_changes
+from src.price_changes import detect_price_changes_by_category
 from src.payments import sync_invoice_status
 from src.notifications import notify_price_changes, notify_payment_reminders
 import logging
@@ -30,18 +30,11 @@ def run_test(test_name, image_path, paid_status, expected_outcome):
             logger.info("Test passed: Parsing failed as expected")
             return
         assert parsed_data, "Parsing failed unexpectedly"
-        store_invoice_data(parsed_data)
         spreadsheet = get_spreadsheet()
-        price_changes_by_category = {}
-        categories = ["JEDZENIE", "NAPOJE", "NAPOJE ALKOHOLOWE", "CHEMIA", "INNE"]
-        for category in categories:
-            category_ingredients = [
-                ing for ing in parsed_data["ingredients"] if ing["category"] == category
-            ]
-            if category_ingredients:
-                changes = detect_price_changes(spreadsheet, category_ingredients, category)
-                if changes:
-                    price_changes_by_category[category] = changes
+        price_changes_by_category = detect_price_changes_by_category(
+            spreadsheet, parsed_data["ingredients"], parsed_data.get("invoice_date")
+        )
+        store_invoice_data(parsed_data)
         notify_price_changes(price_changes_by_category)
         sync_invoice_status(spreadsheet)
         notify_payment_reminders(spreadsheet)
@@ -0,0 +1,16 @@
+from src.dedup import InvoiceIndex
+
+def test_images_of_an_invoice_without_number_are_recognised(tmp_path):
+    index = InvoiceIndex(str(tmp_path / "jobs.db"))
+    invoice = {"seller": "Hurtownia Smak", "invoice_number": ""}
+    assert index.claim(invoice, "job:1") is None
+    index.record_images(invoice, ["hash-1", "hash-2"])
+    assert index.find_images(["hash-2", "hash-1"]) == {"seller": "Hurtownia Smak", "invoice_number": ""}
+    assert index.find_images(["hash-1", "hash-3"]) is None
+
+def test_images_are_recorded_under_the_invoice_key(tmp_path):
+    index = InvoiceIndex(str(tmp_path / "jobs.db"))
+    invoice = {"seller": "Makro Sp. z o.o.", "invoice_number": "FV/1/2026"}
+    assert index.claim(invoice, "job:1") is None
+    index.record_images(invoice, ["hash-1"])
+    assert index.find_images(["hash-1"]) == {"seller": "Makro Sp. z o.o.", "invoice_number": "FV/1/2026"}
@@ -0,0 +1,29 @@
+import pytest
+from src.fuzzy import NameIndex, normalize_name
+
+CATALOG = ["Cukier", "Masło 200g", "Cebula", "Ser mozzarella 2kg", "Kukurydza kolby 2,5kg", "Mleko 3,2% 1l"]
+
+@pytest.mark.parametrize("name, normalized", [
+    ("Kukurydza kolby 2,5kg", "kukurydza kolby 2.5kg"),
+    ("Kukurydza kolby 2.5 kg Oerlemans", "kukurydza kolby 2.5kg oerlemans"),
+    ("Mleko 3,2% 1l", "mleko 3.2 1l"),
+    ("Jabłka 12 x 1 kg", "jablka x12 1kg"),
+])
+def test_normalize_name(name, normalized):
+    assert normalize_name(name) == normalized
+
+@pytest.mark.parametrize("name", [
+    "Cukier puder", "Masło 200g extra", "Masło 250g", "Ser mozzarella 1kg", "Mleko 2% 1l"
+])
+def test_different_products_do_not_match(name):
+    assert NameIndex(CATALOG).match(name)[0] is None
+
+@pytest.mark.parametrize("name, canonical", [
+    ("kukurydza  kolby 2.5 KG", "Kukurydza kolby 2,5kg"),
+    ("Kukurydza kolby 2.5 kg Oerlemans", "Kukurydza kolby 2,5kg"),
+    ("Mleko 3.2% 1 l", "Mleko 3,2% 1l"),
+    ("Ser mozarella 2kg", "Ser mozzarella 2kg"),
+    ("Cebula 1kg", "Cebula"),
+])
+def test_variants_match_the_catalog_name(name, canonical):
+    assert NameIndex(CATALOG).match(name)[0] == canonical
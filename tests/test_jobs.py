@@ -0,0 +1,130 @@
+import sqlite3
+import threading
+import time
+import pytest
+from src import pipeline
+from src.dedup import invoice_index
+from src.fakes import fake_invoice_image, fake_invoice_text
+from src.jobs import JobQueue, WorkerPool
+
+def _row(queue, job_id):
+    conn = sqlite3.connect(queue.db_path)
+    try:
+        return conn.execute(
+            f"SELECT status, attempts, available_at, error FROM {queue.table} WHERE id = ?", (job_id,)
+        ).fetchone()
+    finally:
+        conn.close()
+
+def test_each_job_is_claimed_once_across_connections(tmp_path):
+    db_path = str(tmp_path / "jobs.db")
+    job_ids = {JobQueue(db_path).enqueue({"n": n}) for n in range(60)}
+    claimed = []
+    lock = threading.Lock()
+
+    def drain():
+        # One connection per thread, like separate worker processes
+        queue = JobQueue(db_path)
+        while True:
+            job = queue.claim()
+            if job is None:
+                return
+            with lock:
+                claimed.append(job["id"])
+
+    threads = [threading.Thread(target=drain) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(job_ids)
+
+def test_redelivered_message_is_queued_once(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    assert queue.enqueue({}, message_sid="SM1") is not None
+    assert queue.enqueue({}, message_sid="SM1") is None
+    assert queue.depth() == {"queued": 1}
+
+def test_requeue_stale_only_requeues_old_running_jobs(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    job_id = queue.enqueue({})
+    queue.claim()
+    assert queue.requeue_stale(older_than=600) == 0
+    assert queue.requeue_stale(older_than=0) == 1
+    assert _row(queue, job_id)[0] == "queued"
+    assert queue.claim()["attempts"] == 2
+
+def test_failed_job_is_retried_with_exponential_backoff_then_failed(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    failures = []
+
+    def handler(job, checkpoint):
+        raise RuntimeError("boom")
+
+    pool = WorkerPool(queue, handler, on_failure=lambda job, e: failures.append(job["id"]), max_attempts=3,
+                      retry_delay=10)
+    job_id = queue.enqueue({})
+    for attempt, delay in ((1, 10), (2, 20)):
+        pool._process(queue.claim())
+        status, attempts, available_at, error = _row(queue, job_id)
+        assert (status, attempts, error) == ("queued", attempt, "boom")
+        assert available_at == pytest.approx(time.time() + delay, abs=1)
+        # Make the retry runnable now instead of waiting for the backoff
+        queue._conn.execute("UPDATE jobs SET available_at = 0 WHERE id = ?", (job_id,))
+    pool._process(queue.claim())
+    assert _row(queue, job_id)[0] == "failed"
+    assert failures == [job_id]
+    assert pool.counters == {"completed": 0, "failed": 1, "retries": 2}
+
+def _invoice_job(queue, media, number="FV/7/2026"):
+    items = [{"name": "Cebula", "unit": "kg", "net_price_per_unit": 3.0, "vat_percent": 5.0,
+              "gross_price_per_unit": 3.15, "category": "JEDZENIE"}]
+    media[f"https://fake.twilio/media/{number}"] = fake_invoice_image(
+        fake_invoice_text(number, "Makro", "05.01.2026", "12.01.2026", items)
+    )
+    return queue.enqueue({
+        "from_number": "whatsapp:+48000000000", "media_urls": [f"https://fake.twilio/media/{number}"],
+        "paid_status": "T"
+    })
+
+def test_retry_resumes_at_the_failed_stage(fake_services, monkeypatch, tmp_path):
+    injectors, media = fake_services
+    queue = JobQueue(str(tmp_path / "queue.db"))
+    pool = WorkerPool(queue, pipeline.process_invoice_job, pipeline.notify_job_failure, retry_delay=0)
+    job_id = _invoice_job(queue, media)
+    checks = []
+
+    def flaky_check(spreadsheet=None):
+        checks.append(1)
+        if len(checks) == 1:
+            raise RuntimeError("Sheets unavailable")
+        return []
+
+    monkeypatch.setattr(pipeline, "run_check", flaky_check)
+    pool._process(queue.claim())
+    assert _row(queue, job_id)[0] == "queued"
+    pool._process(queue.claim())
+    assert _row(queue, job_id)[0] == "done"
+    calls = injectors["sheets"].calls
+    # The retry ran only the sync stage: the invoice was stored once and not OCRed or parsed again
+    assert calls["sheets.append_rows"] == 1
+    assert calls["sheets.append_row"] == 1
+    assert injectors["vision"].calls["vision.batch_annotate_images"] == 1
+    assert injectors["xai"].calls["xai.chat.completions.create"] == 1
+
+def test_permanent_failure_before_store_releases_the_dedup_claim(fake_services, monkeypatch, tmp_path):
+    injectors, media = fake_services
+    queue = JobQueue(str(tmp_path / "queue.db"))
+    pool = WorkerPool(queue, pipeline.process_invoice_job, pipeline.notify_job_failure, max_attempts=1)
+
+    def broken_store(invoice_data):
+        raise RuntimeError("Sheets unavailable")
+
+    monkeypatch.setattr(pipeline, "store_invoice_data", broken_store)
+    job_id = _invoice_job(queue, media)
+    pool._process(queue.claim())
+    assert _row(queue, job_id)[0] == "failed"
+    # A resend of the same invoice is not treated as a duplicate
+    assert invoice_index.claim({"seller": "Makro", "invoice_number": "FV/7/2026"}, "job:resend") is None
+    sent = injectors["twilio"].calls["twilio.messages.create"]
+    assert sent == 1
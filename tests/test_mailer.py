@@ -0,0 +1,65 @@
+import socket
+import time
+from email.mime.text import MIMEText
+import pytest
+from src.mailer import EmailSender
+
+# A local SMTP server, as suggested in the EmailSender docstring; not an app dependency
+Controller = pytest.importorskip("aiosmtpd.controller").Controller
+
+class Inbox:
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return "250 OK"
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _message(subject):
+    msg = MIMEText("Treść")
+    msg["Subject"] = subject
+    return msg
+
+@pytest.fixture
+def server():
+    controller = Controller(Inbox(), hostname="127.0.0.1", port=_free_port())
+    controller.start()
+    yield controller
+    if controller.loop.is_running():
+        controller.stop()
+
+def _sender(server, idle_timeout=60):
+    return EmailSender(host=server.hostname, port=server.port, use_ssl=False, idle_timeout=idle_timeout)
+
+def test_session_is_reused_then_closed_when_idle(server):
+    sender = _sender(server, idle_timeout=0.3)
+    for n in range(3):
+        sender.submit("bot@example.com", None, "owner@example.com", _message(f"Faktura {n}"))
+    sender.flush()
+    assert len(server.handler.messages) == 3
+    assert sender.stats["connects"] == 1
+    time.sleep(0.6)
+    assert sender._conn is None
+    sender.submit("bot@example.com", None, "owner@example.com", _message("Faktura 3"))
+    sender.flush()
+    assert sender.stats == {"sent": 4, "failed": 0, "connects": 2}
+
+def test_reconnects_after_the_server_drops_the_session(server):
+    sender = _sender(server)
+    sender.submit("bot@example.com", None, "owner@example.com", _message("Przed restartem"))
+    sender.flush()
+    server.stop()
+    restarted = Controller(Inbox(), hostname=server.hostname, port=server.port)
+    restarted.start()
+    try:
+        sender.submit("bot@example.com", None, "owner@example.com", _message("Po restarcie"))
+        sender.flush()
+    finally:
+        restarted.stop()
+    assert len(restarted.handler.messages) == 1
+    assert sender.stats == {"sent": 2, "failed": 0, "connects": 2}
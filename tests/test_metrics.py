@@ -0,0 +1,66 @@
+import multiprocessing
+import os
+import sqlite3
+from src import metrics
+
+def _record():
+    metrics.count_api_call("sheets", 2)
+    metrics.STAGE_SECONDS.observe(0.3, stage="ocr")
+    metrics.flush()
+
+def _start_operation():
+    metrics.OPERATION_IN_PROGRESS.inc(operation="store")
+    metrics.flush()
+
+def test_render_reports_every_process():
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_record) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    _record()
+    text = metrics.render()
+    assert 'invoice_api_calls_total{service="sheets"} 8' in text
+    assert 'invoice_stage_seconds_bucket{stage="ocr",le="0.25"} 0' in text
+    assert 'invoice_stage_seconds_bucket{stage="ocr",le="0.5"} 4' in text
+    assert 'invoice_stage_seconds_count{stage="ocr"} 4' in text
+
+def test_in_progress_of_dead_processes_is_dropped():
+    context = multiprocessing.get_context("fork")
+    worker = context.Process(target=_start_operation)
+    worker.start()
+    worker.join()
+    metrics.OPERATION_IN_PROGRESS.inc(operation="store")
+    assert 'invoice_operation_in_progress{operation="store"} 1' in metrics.render()
+
+def _rows(store):
+    conn = sqlite3.connect(store.db_path)
+    try:
+        return dict(((metric, field), value) for metric, field, value in conn.execute(
+            "SELECT metric, field, value FROM metric_samples"
+        ))
+    finally:
+        conn.close()
+
+def test_updates_are_buffered_until_flushed(metric_store):
+    metric_store.flush_interval = 3600
+    for _ in range(100):
+        metrics.count_api_call("xai")
+    metrics.OPERATION_IN_PROGRESS.inc(operation="parse")
+    metrics.OPERATION_IN_PROGRESS.dec(operation="parse")
+    # Nothing has touched the database yet
+    assert not os.path.exists(metric_store.db_path)
+    metrics.flush()
+    rows = _rows(metric_store)
+    assert rows[("invoice_api_calls_total", "")] == 100
+    assert list(rows.values()).count(0) == 1
+
+def test_forked_child_does_not_flush_the_parent_buffer(metric_store):
+    metric_store.flush_interval = 3600
+    metrics.count_api_call("twilio")
+    context = multiprocessing.get_context("fork")
+    worker = context.Process(target=_record)
+    worker.start()
+    worker.join()
+    assert 'invoice_api_calls_total{service="twilio"} 1' in metrics.render()
@@ -0,0 +1,41 @@
+import pytest
+from src import parser
+from src.cache import ResultCache
+from src.fakes import FaultInjector, FakeOpenAIClient, fake_invoice_text
+
+def _item(name, price):
+    return {
+        "name": name, "unit": "szt", "net_price_per_unit": price, "vat_percent": 8.0,
+        "gross_price_per_unit": round(price * 1.08, 2), "category": "JEDZENIE"
+    }
+
+@pytest.fixture
+def completions(tmp_path, monkeypatch):
+    client = FakeOpenAIClient(FaultInjector("xai"))
+    monkeypatch.setattr(parser, "client", client)
+    monkeypatch.setattr(parser, "parse_cache", ResultCache("parse", db_path=str(tmp_path / "cache.db")))
+    return client.chat.completions.injector
+
+def test_long_invoice_keeps_repeated_lines(completions):
+    # The same product on several lines at the same price is several deliveries, not a duplicate
+    items = [_item(f"Pomidory krojone {i}", 4.5) for i in range(30)] + [_item("Mleko 3,2% 1l", 3.2)] * 3
+    text = fake_invoice_text("FV/1/2026", "Makro", "05.01.2026", "12.01.2026", items)
+    parsed = parser.parse_invoice_text(text, "N")
+    assert [ingredient["name"] for ingredient in parsed["ingredients"]] == [item["name"] for item in items]
+    assert parsed["invoice_number"] == "FV/1/2026"
+
+def test_truncated_response_is_split_again(completions, monkeypatch):
+    # Chunks of PARSE_CHUNK_ITEMS lines, and the header chunk, overflow this output budget
+    monkeypatch.setattr(parser, "PARSE_MAX_TOKENS", 500)
+    items = [_item(f"Ser {i}", 20.0 + i) for i in range(60)]
+    text = fake_invoice_text("FV/2/2026", "Makro", "05.01.2026", "12.01.2026", items)
+    parsed = parser.parse_invoice_text(text, "N")
+    assert [ingredient["name"] for ingredient in parsed["ingredients"]] == [item["name"] for item in items]
+    assert completions.calls["xai.chat.completions.create"] > 4
+
+def test_header_chunk_ingredients_are_not_merged():
+    # A header chunk that lists lines anyway must not add them next to the line-item chunks
+    header = {"ingredients": [_item("Ser 0", 20.0), _item("Kawa", 30.0)], "invoice_number": "FV/3/2026"}
+    merged = parser.merge_chunk_results(header, [{"ingredients": [_item("Ser 0", 20.0)]}])
+    assert [ingredient["name"] for ingredient in merged["ingredients"]] == ["Ser 0"]
+    assert merged["invoice_number"] == "FV/3/2026"
@@ -0,0 +1,30 @@
+import threading
+from datetime import date, timedelta
+from src.payments import calculate_days_to_due, sync_invoice_status
+
+def _ledger_row(number, days_ahead, paid="N"):
+    due_date = (date.today() + timedelta(days=days_ahead)).strftime("%d.%m.%Y")
+    days_left, alert = calculate_days_to_due(due_date)
+    return ["01.01.2026", number, "Makro", "12,50", "JEDZENIE", due_date, paid, "" if paid == "T" else alert or str(days_left)]
+
+def test_ledger_cells_are_kept_as_the_sheet_holds_them(fake_spreadsheet):
+    unpaid = fake_spreadsheet.worksheet("Faktury Niezapłacone")
+    unpaid.rows += [_ledger_row("0123", 10), _ledger_row("FV/9", 20), _ledger_row("FV/8", 5, "T")]
+    sync_invoice_status(fake_spreadsheet)
+    # Numericised records would have turned "0123" into 123
+    assert [row[1] for row in unpaid.get_all_values()[1:]] == ["0123", "FV/9"]
+    sync_invoice_status(fake_spreadsheet)
+    assert fake_spreadsheet.injector.calls["sheets.update"] == 1
+
+def test_concurrent_syncs_move_a_paid_invoice_once(fake_spreadsheet):
+    unpaid = fake_spreadsheet.worksheet("Faktury Niezapłacone")
+    unpaid.rows += [_ledger_row("FV/1", 10, "T"), _ledger_row("FV/2", 20)]
+    threads = [threading.Thread(target=sync_invoice_status, args=(fake_spreadsheet,)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    paid = fake_spreadsheet.worksheet("Faktury Zapłacone")
+    assert [row[1] for row in paid.get_all_values()[1:]] == ["FV/1"]
+    assert [row[1] for row in unpaid.get_all_values()[1:]] == ["FV/2"]
+    assert fake_spreadsheet.injector.calls["sheets.append_rows"] == 1
@@ -0,0 +1,58 @@
+import numpy as np
+from src.price_history import PriceHistory, analyze_prices, detect_price_trends
+
+def _invoice(history, invoice_date, price, name="Mąka pszenna typ 450 1kg"):
+    """Run trend detection for one ingredient at `price`, then record the invoice like the pipeline does."""
+    ingredients = [{"name": name, "category": "JEDZENIE", "net_price_per_unit": price}]
+    trends = detect_price_trends(ingredients, invoice_date, history=history)
+    history.record_invoice({"invoice_date": invoice_date, "seller": "Makro", "ingredients": ingredients})
+    return trends
+
+def test_jump_then_flat_is_not_a_trend(tmp_path):
+    history = PriceHistory(str(tmp_path / "history.db"))
+    assert _invoice(history, "01.12.2025", 10.0) == {}
+    # The jump itself is reported by detect_price_changes, not as creep
+    assert _invoice(history, "01.01.2026", 12.0) == {}
+    for invoice_date in ("10.01.2026", "20.01.2026", "01.02.2026", "01.03.2026"):
+        assert _invoice(history, invoice_date, 12.0) == {}
+
+def test_gradual_creep_is_reported_once(tmp_path):
+    history = PriceHistory(str(tmp_path / "history.db"))
+    results = [
+        _invoice(history, invoice_date, price)
+        for invoice_date, price in [
+            ("01.01.2026", 10.0), ("08.01.2026", 10.4), ("15.01.2026", 10.8), ("22.01.2026", 11.2),
+            ("29.01.2026", 11.2), ("05.02.2026", 11.3)
+        ]
+    ]
+    assert results[:3] == [{}, {}, {}]
+    change = results[3]["JEDZENIE"][0]
+    assert change["old_price"] == 10.0
+    assert change["new_price"] == 11.2
+    assert change["change_percent"] == 12.0
+    # Measured from the alerted price afterwards, so the same creep is not reported again
+    assert results[4:] == [{}, {}]
+
+def test_corrected_invoice_replaces_its_prices(tmp_path):
+    history = PriceHistory(str(tmp_path / "history.db"))
+    ingredients = [{"name": "Cebula", "category": "JEDZENIE", "net_price_per_unit": 3.0}]
+    history.record_invoice({"invoice_date": "05.01.2026", "seller": "Makro", "ingredients": ingredients})
+    ingredients[0]["net_price_per_unit"] = 3.5
+    history.record_invoice({"invoice_date": "05.01.2026", "seller": "Makro", "ingredients": ingredients})
+    prices, _ = history.load_matrix([("JEDZENIE", "Cebula")], window=3)
+    assert np.isnan(prices[0, :2]).all() and prices[0, 2] == 3.5
+
+def test_invoice_processed_late_ignores_later_prices(tmp_path):
+    history = PriceHistory(str(tmp_path / "history.db"))
+    for invoice_date, price in [("01.01.2026", 10.0), ("08.01.2026", 10.4), ("15.01.2026", 10.8), ("01.03.2026", 20.0)]:
+        _invoice(history, invoice_date, price)
+    change = _invoice(history, "22.01.2026", 11.2)["JEDZENIE"][0]
+    assert (change["old_price"], change["change_percent"]) == (10.0, 12.0)
+
+def test_analyze_prices_drops_future_observations():
+    prices = np.array([[10.0, 10.4, 20.0]])
+    days = np.array([[100.0, 107.0, 160.0]])
+    stats = analyze_prices([10.8], prices, days, today=114)
+    assert stats["last"][0] == 10.4
+    assert stats["baseline"][0] == 10.0
+    assert stats["median"][0] == 10.2
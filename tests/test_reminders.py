@@ -0,0 +1,39 @@
+import threading
+from datetime import date, timedelta
+from src.reminders import ReminderIndex
+
+def _race(target, count=8):
+    """Run target(i) in count threads released together; return their results."""
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def run(i):
+        barrier.wait()
+        results[i] = target(i)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def test_only_one_claimer_wins(tmp_path):
+    # One index per thread: separate connections, like separate worker processes
+    indexes = [ReminderIndex(str(tmp_path / "jobs.db")) for _ in range(8)]
+    results = _race(lambda i: indexes[i]._claim("Makro|FV/1/2026|10.01.2026", [3, 1]))
+    assert results.count(True) == 1
+    assert indexes[0]._claim("Makro|FV/1/2026|10.01.2026", [0]) is True
+
+def test_reminder_is_sent_by_one_process(tmp_path):
+    today = date(2026, 1, 7)
+    record = {
+        "Sprzedawca": "Makro", "Numer Faktury": "FV/1/2026", "Kwota Całkowita (PLN)": "12,50",
+        "Termin Płatności": (today + timedelta(days=3)).strftime("%d.%m.%Y"), "Opłacona (T/N)": "N"
+    }
+    indexes = [ReminderIndex(str(tmp_path / "jobs.db")) for _ in range(8)]
+    for index in indexes:
+        index.add(record)
+    results = _race(lambda i: indexes[i].pop_due(today))
+    assert [len(due) for due in results].count(1) == 1
+    assert sum(len(due) for due in results) == 1
@@ -0,0 +1,78 @@
+import pytest
+from src.fakes import FaultInjector, FakeSpreadsheet
+from src.price_index import price_index
+from src.replica import SheetReplica, sheet_replica
+from src.sheets import get_worksheet
+from src.sheets_quota import sheets_scheduler
+
+HEADER = ["Data", "Składnik", "Jednostka", "Cena netto"]
+
+@pytest.fixture
+def spreadsheet():
+    spreadsheet = FakeSpreadsheet(FaultInjector("sheets"), {"JEDZENIE": HEADER})
+    spreadsheet.worksheet("JEDZENIE").rows.append(["01.01.2026", "Cebula", "kg", "3,00"])
+    return spreadsheet
+
+@pytest.fixture
+def replica(tmp_path, monkeypatch):
+    # Every download in these tests is meant to reach the fake sheet
+    monkeypatch.setattr(sheets_scheduler, "coalesce_window", 0)
+    monkeypatch.chdir(tmp_path)
+    return SheetReplica(str(tmp_path / "replica.db"), check_interval=30, max_age=3600)
+
+def _names(replica, spreadsheet):
+    return [record["Składnik"] for record in replica.records(spreadsheet, "JEDZENIE")]
+
+def _later(replica, seconds=31):
+    """Pretend the last revision check was `seconds` ago."""
+    replica._checked_at -= seconds
+
+def test_revision_is_checked_at_most_once_per_interval(replica, spreadsheet):
+    calls = spreadsheet.injector.calls
+    for _ in range(3):
+        replica.check_revision(spreadsheet)
+    assert calls["sheets.get_lastUpdateTime"] == 1
+    # force only waits a second between checks
+    _later(replica, 1)
+    replica.check_revision(spreadsheet, force=True)
+    assert calls["sheets.get_lastUpdateTime"] == 2
+    _later(replica)
+    replica.check_revision(spreadsheet)
+    assert calls["sheets.get_lastUpdateTime"] == 3
+
+def test_edit_in_the_sheet_is_picked_up_after_the_check_interval(replica, spreadsheet):
+    calls = spreadsheet.injector.calls
+    assert _names(replica, spreadsheet) == ["Cebula"]
+    worksheet = spreadsheet.worksheet("JEDZENIE")
+    worksheet.rows.append(["02.01.2026", "Czosnek", "kg", "9,00"])
+    spreadsheet.touch()
+    assert _names(replica, spreadsheet) == ["Cebula"]
+    assert calls["sheets.get_all_values"] == 1
+    _later(replica)
+    assert _names(replica, spreadsheet) == ["Cebula", "Czosnek"]
+    assert calls["sheets.get_all_values"] == 2
+
+def test_own_write_is_adopted_without_a_reload(replica, spreadsheet):
+    calls = spreadsheet.injector.calls
+    replica.ensure_fresh(spreadsheet, "JEDZENIE")
+    _later(replica, 1)
+    revision = replica.check_revision(spreadsheet, force=True)
+    row = ["02.01.2026", "Czosnek", "kg", "9,00"]
+    replica.record_append("JEDZENIE", spreadsheet.worksheet("JEDZENIE").append_row(row), [row])
+    replica.adopt_revision(spreadsheet, revision)
+    _later(replica)
+    assert replica.ensure_fresh(spreadsheet, "JEDZENIE") == 0
+    assert _names(replica, spreadsheet) == ["Cebula", "Czosnek"]
+    assert calls["sheets.get_all_values"] == 1
+
+def test_version_gap_drops_the_price_index(fake_spreadsheet):
+    worksheet = get_worksheet(fake_spreadsheet, "JEDZENIE")
+    price_index.load_if_needed(worksheet)
+    row = ["02.01.2026", "Czosnek", "kg", "9,00", "5", "9,45", "Makro"]
+    # Another process wrote through to the replica before this one
+    sheet_replica.update_rows("JEDZENIE", {2: ["01.01.2026", "Cebula", "kg", "3,00", "5", "3,15", "Makro"]})
+    sheet_replica.update_rows("JEDZENIE", {3: row})
+    price_index.record("JEDZENIE", {3: row})
+    assert "JEDZENIE" not in price_index._categories
+    # The next use rebuilds it from the replica, with both rows
+    assert set(price_index.get(worksheet)) == {"Cebula", "Czosnek"}
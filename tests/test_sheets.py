@@ -0,0 +1,45 @@
+from src.price_index import price_index
+from src.sheets import store_invoice_data
+
+def _invoice(invoice_date, prices, number="FV/1/2026"):
+    return {
+        "invoice_date": invoice_date, "due_date": invoice_date, "total": sum(prices.values()), "paid": "T",
+        "seller": "Makro", "category": "JEDZENIE", "invoice_number": number,
+        "ingredients": [
+            {"name": name, "unit": "kg", "net_price_per_unit": price, "vat_percent": 5.0,
+             "gross_price_per_unit": round(price * 1.05, 2), "category": "JEDZENIE"}
+            for name, price in prices.items()
+        ]
+    }
+
+def _data_calls(spreadsheet):
+    """Sheets API calls made, leaving out worksheet handles and Drive revision checks."""
+    calls = spreadsheet.injector.calls
+    return sum(calls.values()) - calls["sheets.worksheet"] - calls["sheets.get_lastUpdateTime"]
+
+def test_reported_api_calls_include_the_price_index_load(fake_spreadsheet):
+    # get_all_values of JEDZENIE, append_rows and the ledger append_row
+    assert store_invoice_data(_invoice("01.01.2026", {"Cebula": 3.0})) == _data_calls(fake_spreadsheet) == 3
+
+def test_own_writes_update_price_index_in_place(fake_spreadsheet):
+    store_invoice_data(_invoice("01.01.2026", {"Cebula": 3.0}))
+    names = price_index._categories["JEDZENIE"]["names"]
+    store_invoice_data(_invoice("02.01.2026", {"Cebula": 3.5, "Czosnek": 9.0}, "FV/2/2026"))
+    category = price_index._categories["JEDZENIE"]
+    assert category["names"] is names
+    assert category["entries"]["Cebula"]["row"] == 2
+    assert category["entries"]["Cebula"]["price"] == 3.5
+    assert category["entries"]["Czosnek"]["row"] == 3
+    assert names.match("czosnek")[0] == "Czosnek"
+
+def test_store_invoice_data_makes_a_fixed_number_of_calls(fake_spreadsheet):
+    store_invoice_data(_invoice("01.01.2026", {f"Produkt {i}": 10.0 + i for i in range(20)}))
+    before = _data_calls(fake_spreadsheet)
+    # 10 changed prices, 10 unchanged and 15 new ingredients
+    prices = {f"Produkt {i}": 10.0 + i + (1.0 if i < 10 else 0.0) for i in range(35)}
+    api_calls = store_invoice_data(_invoice("02.01.2026", prices, "FV/2/2026"))
+    # batch_update and append_rows on JEDZENIE, append_row on the ledger; the replica is current
+    assert api_calls == _data_calls(fake_spreadsheet) - before == 3
+    calls = fake_spreadsheet.injector.calls
+    assert calls["sheets.batch_update"] == 1
+    assert calls["sheets.get_all_values"] == 1
@@ -0,0 +1,118 @@
+import threading
+from types import SimpleNamespace
+import pytest
+from src import ratelimit, sheets_quota
+from src.fakes import FaultInjector, FakeSpreadsheet
+from src.sheets_quota import SheetsScheduler
+
+class FakeClock:
+    """Stands in for the time module: sleep() advances the clock instead of waiting."""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        # Like a real sleep, never return without time having passed
+        self.now += max(seconds, 0.001)
+
+class APIError(Exception):
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"HTTP {status_code}")
+        headers = {"Retry-After": str(retry_after)} if retry_after is not None else {}
+        self.response = SimpleNamespace(status_code=status_code, headers=headers)
+
+def _failing(injector, errors):
+    """Make the injector raise each of errors in turn, then succeed."""
+    pending = list(errors)
+
+    def error_factory(name):
+        error = pending.pop(0)
+        if not pending:
+            injector.error_rate = 0.0
+        return error
+    injector.error_rate = 1.0 if pending else 0.0
+    injector.error_factory = error_factory
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(sheets_quota, "time", clock)
+    monkeypatch.setattr(ratelimit, "time", clock)
+    return clock
+
+@pytest.fixture
+def scheduler(tmp_path, clock):
+    return SheetsScheduler(quota_path=str(tmp_path / "quota"), max_attempts=4, backoff_base=1, backoff_max=8)
+
+@pytest.fixture
+def worksheet():
+    return FakeSpreadsheet(FaultInjector("sheets"), {"JEDZENIE": ["Data", "Składnik"]}).worksheet("JEDZENIE")
+
+def test_429_is_retried_after_retry_after_and_blocks_the_bucket(scheduler, worksheet, clock):
+    injector = worksheet.spreadsheet.injector
+    _failing(injector, [APIError(429, retry_after=7), APIError(503)])
+    assert scheduler.call("read", worksheet.get_all_values) == [["Data", "Składnik"]]
+    assert injector.calls["sheets.get_all_values"] == 3
+    assert scheduler.counters["retries"] == 2
+    # Retry-After wins over a shorter jittered backoff
+    assert clock.sleeps[0] == 7
+    # The 429 also emptied the shared bucket, so the retry waited for a token to refill after it
+    assert clock.sleeps[1] == pytest.approx(1 / scheduler.buckets["read"].rate)
+
+def test_429_block_holds_off_other_callers(scheduler, clock):
+    scheduler.buckets["write"].block(30)
+    start = clock.now
+    scheduler.buckets["write"].acquire()
+    assert clock.now - start >= 30
+
+def test_retries_stop_after_max_attempts(scheduler, worksheet):
+    injector = worksheet.spreadsheet.injector
+    _failing(injector, [APIError(429)] * 10)
+    with pytest.raises(APIError):
+        scheduler.call("read", worksheet.get_all_values)
+    assert injector.calls["sheets.get_all_values"] == scheduler.max_attempts
+
+def test_client_errors_are_not_retried(scheduler, worksheet, clock):
+    injector = worksheet.spreadsheet.injector
+    _failing(injector, [APIError(400)])
+    with pytest.raises(APIError):
+        scheduler.call("write", worksheet.append_row, ["01.01.2026", "Cebula"])
+    assert injector.calls["sheets.append_row"] == 1
+    assert clock.sleeps == []
+
+def test_identical_reads_are_coalesced_until_a_write(scheduler, worksheet, clock):
+    calls = worksheet.spreadsheet.injector.calls
+    first = scheduler.read(worksheet, "get_all_values")
+    first.append(["changed by the caller"])
+    assert scheduler.read(worksheet, "get_all_values") == [["Data", "Składnik"]]
+    assert calls["sheets.get_all_values"] == 1
+    scheduler.write(worksheet, "append_row", ["01.01.2026", "Cebula"])
+    assert scheduler.read(worksheet, "get_all_values")[-1] == ["01.01.2026", "Cebula"]
+    assert calls["sheets.get_all_values"] == 2
+    clock.now += scheduler.coalesce_window
+    scheduler.read(worksheet, "get_all_values")
+    assert calls["sheets.get_all_values"] == 3
+
+def test_reads_in_flight_are_shared(tmp_path, worksheet):
+    scheduler = SheetsScheduler(quota_path=str(tmp_path / "quota"), coalesce_window=0)
+    worksheet.spreadsheet.injector.latency = 0.2
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(scheduler.read(worksheet, "get_all_values")))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [[["Data", "Składnik"]]] * 5
+    assert worksheet.spreadsheet.injector.calls["sheets.get_all_values"] == 1
+    assert scheduler.counters["coalesced"] == 4
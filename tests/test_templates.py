@@ -0,0 +1,49 @@
+import json
+import os
+import pytest
+from src import templates
+from src.templates import InvoiceTemplate, parse_with_template
+
+EXAMPLE_PATH = os.path.join(os.path.dirname(__file__), "..", "seller_templates.example.json")
+
+TEXT = """ABC Sp. z o.o.
+FAKTURA VAT nr 051/04/2025
+Data wystawienia: 10.04.2025
+Termin płatności: 17.04.2025
+1. Kukurydza kolby 2,5kg 2 kg 10,00 5% 21,00
+2. Woda 1,5L 6 szt 2,00 8% 12,96
+Do zapłaty: 33,96"""
+
+LAYOUT_TEXT = """HEADER:
+ABC Sp. z o.o.
+FAKTURA VAT nr 051/04/2025
+Data wystawienia: 10.04.2025 | Termin płatności: 17.04.2025
+ITEMS:
+Lp. | Nazwa | Ilość | J.m. | Cena netto | VAT | Wartość brutto
+1. | Kukurydza kolby 2,5kg | 2 | kg | 10,00 | 5% | 21,00
+2. | Woda 1,5L | 6 | szt | 2,00 | 8% | 12,96
+TOTALS:
+Do zapłaty: 33,96"""
+
+@pytest.fixture
+def definition(monkeypatch):
+    monkeypatch.setattr(templates, "_templates", [])
+    with open(EXAMPLE_PATH, encoding="utf-8") as f:
+        return json.load(f)[0]
+
+def test_template_parses_plain_and_layout_text(definition):
+    templates.register_template(InvoiceTemplate(**definition))
+    for text in (TEXT, LAYOUT_TEXT):
+        data = parse_with_template(text, "N")
+        assert [ingredient["name"] for ingredient in data["ingredients"]] == ["Kukurydza kolby 2,5kg", "Woda 1,5L"]
+        assert (data["invoice_number"], data["total"], data["due_date"]) == ("051/04/2025", 33.96, "17.04.2025")
+
+def test_missing_line_fails_the_total_check(definition):
+    templates.register_template(InvoiceTemplate(**definition))
+    assert parse_with_template(TEXT.replace("2. Woda", "2 Woda"), "N") is None
+
+def test_template_without_line_totals_falls_back_to_the_llm(definition):
+    # Without qty or gross_total nothing can be cross-checked against the invoice total
+    definition["line_pattern"] = definition["line_pattern"].replace("(?P<qty>", "(?:").replace("(?P<gross_total>", "(?:")
+    templates.register_template(InvoiceTemplate(**definition))
+    assert parse_with_template(TEXT, "N") is None